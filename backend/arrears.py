@@ -0,0 +1,258 @@
+# arrears.py
+from datetime import timedelta
+from sqlalchemy import (
+    Date,
+    Integer,
+    case,
+    cast,
+    extract,
+    func,
+    literal,
+    or_,
+    select,
+    true,
+    union_all,
+)
+from billing import month_bucket, month_start
+from models import (
+    db,
+    Group,
+    Payment,
+    Student,
+    StudentMonthlyBalance,
+    student_group_association,
+)
+
+# Aging buckets: (label, oldest age in days), youngest first
+AGING_BUCKETS = [("0-30", 30), ("31-60", 60), ("61-90", 90), ("90+", None)]
+
+
+def _sqlite():
+    return db.session.get_bind().dialect.name == "sqlite"
+
+
+def _month_number(column):
+    # Months since year 0, so month spans can be counted by subtraction
+    if _sqlite():
+        year, month = func.strftime("%Y", column), func.strftime("%m", column)
+    else:
+        year, month = extract("year", column), extract("month", column)
+    return cast(year, Integer) * 12 + cast(month, Integer) - 1
+
+
+def _greatest(*values):
+    return func.max(*values) if _sqlite() else func.greatest(*values)
+
+
+def _least(*values):
+    return func.min(*values) if _sqlite() else func.least(*values)
+
+
+def month_number(day):
+    return day.year * 12 + day.month - 1
+
+
+def bucket_months(today):
+    """``(label, first, last)`` month numbers of each aging bucket: the
+    months whose first day is within its age range of ``today``."""
+    ranges = []
+    last = month_number(today)
+    for label, days in AGING_BUCKETS:
+        if days is None:
+            first = 0
+        else:
+            cutoff = (today - timedelta(days=days)).date()
+            first = month_number(cutoff) + (cutoff.day > 1)
+        ranges.append((label, first, last))
+        last = first - 1
+    return ranges
+
+
+def _snapshots():
+    # The group_cost_at_payment of each student's last payment in each month
+    # with payments, and the next month with payments: the snapshot is the
+    # charge of every month from one to the other. One window pass in
+    # (student_id, date) order, which the payments index already provides.
+    bucket = month_bucket(Payment.date)
+    ordered = (
+        select(
+            Payment.student_id,
+            bucket.label("month"),
+            Payment.group_cost_at_payment.label("cost"),
+            func.lead(bucket)
+            .over(
+                partition_by=Payment.student_id,
+                order_by=(Payment.date, Payment.id),
+            )
+            .label("until"),
+        )
+        .where(Payment.date.is_not(None))
+        .subquery()
+    )
+    return (
+        select(ordered)
+        .where(or_(ordered.c.until.is_(None), ordered.c.until != ordered.c.month))
+        .subquery()
+    )
+
+
+def arrears_spans_query(today):
+    """Runs of consecutive months each student is billed the same charge
+    for, up to the month of ``today`` (a datetime), as one statement.
+
+    Columns: student_id, first and last (month numbers), charge, and paid,
+    the amount paid in the first month. Later months of a run have no
+    payments, so nothing is paid in them.
+
+    There is no membership history, so it is rebuilt from the payments:
+    a student is billed from the month of their first payment, through the
+    current month while they are in a group, or else through the month of
+    their last payment. A past month is charged the ``group_cost_at_payment``
+    snapshot of the latest payment made by the end of that month. The
+    current month is charged the student's current group cost, as in
+    payment_status. What was paid in a month comes from the ledger; an
+    overpayment does not carry over to other months.
+    """
+    current = month_start(today)
+    costs = (
+        select(
+            student_group_association.c.student_id,
+            func.sum(Group.group_cost).label("total"),
+        )
+        .join(Group, Group.id == student_group_association.c.group_id)
+        .group_by(student_group_association.c.student_id)
+        .cte("costs")
+    )
+    snapshots = _snapshots()
+
+    # Past months: each snapshot runs until the next month with payments.
+    # The last one runs on while the student is in a group, else it ends
+    # with its own month.
+    first = _month_number(snapshots.c.month)
+    last = case(
+        (snapshots.c.until.is_not(None), _month_number(snapshots.c.until) - 1),
+        (costs.c.total > 0, month_number(current) - 1),
+        else_=first,
+    )
+    past = (
+        select(
+            snapshots.c.student_id,
+            first.label("first"),
+            _least(last, month_number(current) - 1).label("last"),
+            snapshots.c.cost.label("charge"),
+            func.coalesce(StudentMonthlyBalance.total_paid, 0).label("paid"),
+        )
+        .select_from(snapshots)
+        .outerjoin(costs, costs.c.student_id == snapshots.c.student_id)
+        .outerjoin(
+            StudentMonthlyBalance,
+            (StudentMonthlyBalance.student_id == snapshots.c.student_id)
+            & (StudentMonthlyBalance.month == snapshots.c.month),
+        )
+        .where(snapshots.c.month < current)
+    )
+    # The current month, for students in a group
+    this_month = (
+        select(
+            costs.c.student_id,
+            literal(month_number(current)),
+            literal(month_number(current)),
+            costs.c.total,
+            func.coalesce(StudentMonthlyBalance.total_paid, 0),
+        )
+        .outerjoin(
+            StudentMonthlyBalance,
+            (StudentMonthlyBalance.student_id == costs.c.student_id)
+            & (StudentMonthlyBalance.month == literal(current, Date)),
+        )
+        .where(costs.c.total > 0)
+    )
+    return union_all(past, this_month)
+
+
+def arrears_query(today, limit=None):
+    """Outstanding balance per student by age, each month owed aged from its
+    first day, largest total first and cut to ``limit`` rows: student_id,
+    name, one column per AGING_BUCKETS label and total. Every row also
+    carries the number of students owing and the totals of every bucket
+    over all of them, from a one-row aggregate that the limit does not cut;
+    with nobody owing there is a single row with no student."""
+    spans = arrears_spans_query(today).subquery()
+
+    def owed(first, last):
+        # The first month of a run, less what was paid in it, plus the
+        # charge of each of its other months, where they fall in
+        # [first, last]
+        first_month = case(
+            (
+                spans.c.first.between(first, last),
+                _greatest(spans.c.charge - spans.c.paid, 0),
+            ),
+            else_=0,
+        )
+        later_months = _greatest(
+            _least(spans.c.last, last) - _greatest(spans.c.first + 1, first) + 1,
+            0,
+        )
+        return first_month + spans.c.charge * later_months
+
+    labels = [label for label, _ in AGING_BUCKETS] + ["total"]
+    buckets = [
+        cast(func.sum(owed(first, last)), Integer).label(label)
+        for label, first, last in bucket_months(today)
+    ]
+    # Integer sums: on Postgres SUM(bigint) would come back as Decimal
+    total = cast(func.sum(owed(0, month_number(today))), Integer)
+    owing = (
+        select(spans.c.student_id, *buckets, total.label("total"))
+        .group_by(spans.c.student_id)
+        .having(total > 0)
+        .cte("owing")
+    )
+    totals = select(
+        func.count().label("students"),
+        *[
+            cast(func.coalesce(func.sum(owing.c[label]), 0), Integer).label(
+                f"all_{label}"
+            )
+            for label in labels
+        ],
+    ).cte("totals")
+    top = (
+        select(owing)
+        .order_by(owing.c.total.desc(), owing.c.student_id)
+        .limit(limit)
+        .subquery()
+    )
+    # Names are looked up for the returned rows only
+    return (
+        select(totals, top, Student.name)
+        .select_from(totals)
+        .outerjoin(top, true())
+        .outerjoin(Student, Student.id == top.c.student_id)
+        .order_by(top.c.total.desc(), top.c.student_id)
+    )
+
+
+def arrears_report(today, limit=None):
+    """Per-student arrears and their totals by bucket, as of ``today``.
+    ``limit`` (at least 1) keeps the students who owe the most; the totals
+    still cover everyone."""
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be at least 1")
+    labels = [label for label, _ in AGING_BUCKETS] + ["total"]
+    rows = db.session.execute(arrears_query(today, limit)).mappings().all()
+    return {
+        "as_of": today.date().isoformat(),
+        "totals": {label: rows[0][f"all_{label}"] for label in labels},
+        "students": rows[0]["students"],
+        "items": [
+            {
+                "student_id": row["student_id"],
+                "name": row["name"],
+                **{label: row[label] for label in labels},
+            }
+            for row in rows
+            if row["student_id"] is not None
+        ],
+    }
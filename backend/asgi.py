@@ -0,0 +1,393 @@
+# asgi.py
+#
+# ASGI entry point:
+#
+#   cd backend && uvicorn asgi:application
+#
+# The hot read endpoints are coroutines on an AsyncSession (asyncpg for
+# Postgres, aiosqlite for SQLite), so one process keeps many of them in
+# flight while they wait on the database or on Auth0. Every other request
+# (writes, streams, profiled requests) goes to the WSGI app in app.py on a
+# worker thread. URL rules, error handlers, CORS, metrics, the response
+# cache and the JSON shapes are shared with app.py.
+import sys
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from flask import jsonify, request, request_started
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import app
+from auth import requires_auth_async
+from cache import cache_tags, collection_tag, response_cache
+from models import db, Group, Student
+from pagination import keyset_query, keyset_rows, page_args
+from pooling import engine_options
+from profiling import PROFILE_HEADER
+from routing import read_engine, replicas
+from search import search_args, search_page, search_query
+from serializers import (
+    group_cache_tags,
+    group_fieldset,
+    group_loader_options,
+    needs_student_counts,
+    serialize_groups,
+    serialize_students,
+    student_cache_tags,
+    student_counts_query,
+    student_fieldset,
+    student_loader_options,
+)
+from streaming import wants_stream
+from versioning import (
+    Validators,
+    group_stamp_query,
+    group_stamps,
+    row_stamp_query,
+    table_stamp_query,
+)
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(url):
+    """The asyncio-driver equivalent of a SQLAlchemy database URL."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    if backend == "postgresql" and "sslmode" in url.query:
+        # asyncpg spells libpq's sslmode as ssl
+        sslmode = url.query["sslmode"]
+        url = url.difference_update_query(["sslmode"]).update_query_dict(
+            {"ssl": sslmode}
+        )
+    return url
+
+
+class AsyncDatabase:
+    """Async engines on the databases ``db`` reads from: the primary and,
+    for requests routed to one, a read replica (see routing.py).
+
+    Each is created on first use, so its connections belong to the event
+    loop that serves requests. ``dispose()`` closes them when that loop shuts
+    down.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.engines = {}
+        self._sessionmaker = async_sessionmaker(expire_on_commit=False)
+
+    def engine_for(self, sync_engine):
+        name = f"{sync_engine.pool.logging_name}-async"
+        engine = self.engines.get(name)
+        if engine is None:
+            url = async_database_url(sync_engine.url)
+            engine = create_async_engine(url, **engine_options(url, name))
+            if sync_engine in replicas.engines:
+                replicas.watch(engine.sync_engine, sync_engine)
+            self.engines[name] = engine
+        return engine
+
+    def session(self):
+        sync_engine = read_engine()
+        if sync_engine is None:
+            with self.app.app_context():
+                sync_engine = db.engine
+        return self._sessionmaker(bind=self.engine_for(sync_engine))
+
+    async def dispose(self):
+        engines, self.engines = self.engines, {}
+        for engine in engines.values():
+            await engine.dispose()
+
+
+async_db = AsyncDatabase(app)
+
+
+async def _stamp(session, query):
+    return tuple((await session.execute(query)).one())
+
+
+async def _student_counts(session, groups, fieldset):
+    if not needs_student_counts(fieldset):
+        return {}
+    query = student_counts_query([group.id for group in groups])
+    return dict((await session.execute(query)).all())
+
+
+@requires_auth_async("get:groups")
+@response_cache.cached
+async def get_groups(payload):
+    try:
+        page = page_args(request.args)
+        fieldset = group_fieldset(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async with async_db.session() as session:
+        stamps = [await _stamp(session, table_stamp_query(Group))]
+        if "students" in fieldset.expand:
+            stamps.append(await _stamp(session, table_stamp_query(Student)))
+        validators = Validators(*stamps)
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+
+        query = select(Group).options(*group_loader_options(fieldset))
+        if page is None:
+            groups = (await session.scalars(query.order_by(Group.id))).all()
+        else:
+            rows = (await session.scalars(keyset_query(query, Group.id, *page))).all()
+            groups, next_cursor = keyset_rows(rows, Group.id, page[0])
+        items = serialize_groups(
+            groups, fieldset, await _student_counts(session, groups, fieldset)
+        )
+
+    if page is None:
+        response = jsonify(items)
+    else:
+        response = jsonify({"items": items, "next_cursor": next_cursor})
+    cache_tags(collection_tag(Group), *group_cache_tags(groups, fieldset))
+    return validators.apply(response)
+
+
+@requires_auth_async("get:group")
+@response_cache.cached
+async def get_group(payload, group_id):
+    try:
+        fieldset = group_fieldset(request.args, detail=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async with async_db.session() as session:
+        row = (await session.execute(group_stamp_query(group_id))).one_or_none()
+        stamps = group_stamps(row)
+        if stamps is None:
+            return jsonify({"error": "Group not found"}), 404
+        validators = Validators(*stamps)
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+
+        group = await session.get(
+            Group, group_id, options=group_loader_options(fieldset)
+        )
+        counts = await _student_counts(session, [group], fieldset)
+        data = serialize_groups([group], fieldset, counts)[0]
+
+    cache_tags(*group_cache_tags([group], fieldset))
+    return validators.apply(jsonify(data))
+
+
+@requires_auth_async("get:students")
+async def search_students_endpoint(payload):
+    try:
+        term, limit, offset = search_args(request.args)
+        fieldset = student_fieldset(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async with async_db.session() as session:
+        query = search_query(
+            term,
+            limit,
+            offset,
+            student_loader_options(fieldset),
+            session.bind.dialect.name,
+        )
+        students, next_offset = search_page(
+            (await session.scalars(query)).all(), limit, offset
+        )
+        items = serialize_students(students, fieldset)
+    return jsonify({"items": items, "next_offset": next_offset})
+
+
+@requires_auth_async("get:student")
+@response_cache.cached
+async def get_student(payload, student_id):
+    try:
+        fieldset = student_fieldset(request.args, detail=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async with async_db.session() as session:
+        student_stamp = await _stamp(session, row_stamp_query(Student, student_id))
+        if student_stamp[0] == 0:
+            return jsonify({"error": "Student not found"}), 404
+        validators = Validators(student_stamp)
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+
+        student = await session.get(
+            Student, student_id, options=student_loader_options(fieldset)
+        )
+        data = serialize_students([student], fieldset)[0]
+
+    cache_tags(*student_cache_tags([student], fieldset))
+    return validators.apply(jsonify(data)), 200
+
+
+# Keyed by the endpoint names of the matching GET rules in app.py
+ASYNC_VIEWS = {
+    "get_groups": get_groups,
+    "get_group": get_group,
+    "search_students_endpoint": search_students_endpoint,
+    "get_student": get_student,
+}
+
+
+def _environ(scope, body=None):
+    # GET bodies are ignored by the async views, so they get an empty one
+    adapter = WsgiToAsgiInstance(app)
+    adapter.scope = scope
+    return adapter.build_environ(scope, body or BytesIO())
+
+
+def _run_wsgi_app(environ, send):
+    """Runs the WSGI app, sending its response from the calling thread."""
+    send = async_to_sync(send)
+    response_start = None
+    started = False
+
+    def start_response(status, headers, exc_info=None):
+        nonlocal response_start
+        if exc_info and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response_start = {
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ],
+        }
+
+    app_iter = app(environ, start_response)
+    try:
+        for chunk in app_iter:
+            if not started:
+                started = True
+                send(response_start)
+            if chunk:
+                send({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not started:
+            send(response_start)
+        send({"type": "http.response.body"})
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+
+
+# asgiref's WsgiToAsgi runs every WSGI call on one shared thread. The Flask
+# views are thread-safe, so each request gets a pool thread instead.
+_run_wsgi_app_async = sync_to_async(_run_wsgi_app, thread_sensitive=False)
+
+
+async def wsgi_application(scope, receive, send):
+    if scope["type"] != "http":
+        raise ValueError("WSGI app received a non-HTTP scope")
+    with SpooledTemporaryFile(max_size=65536) as body:
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        await _run_wsgi_app_async(_environ(scope, body), send)
+
+
+def _async_view(environ):
+    if environ["REQUEST_METHOD"] != "GET":
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return ASYNC_VIEWS.get(endpoint)
+
+
+async def _full_dispatch_request(view):
+    # Flask.full_dispatch_request(), awaiting the view
+    try:
+        request_started.send(app, _async_wrapper=app.ensure_sync)
+        rv = app.preprocess_request()
+        if rv is None:
+            rv = await view(**request.view_args)
+    except Exception as e:
+        rv = app.handle_user_exception(e)
+    return app.finalize_request(rv)
+
+
+async def _dispatch(view, environ):
+    """Flask.wsgi_app() for a coroutine view. Returns None, with nothing
+    sent, for requests the WSGI app has to serve."""
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        try:
+            ctx.push()
+            if wants_stream() or request.headers.get(PROFILE_HEADER):
+                return None
+            return await _full_dispatch_request(view)
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+        except:  # noqa: E722
+            error = sys.exc_info()[1]
+            raise
+    finally:
+        if error is not None and app.should_ignore_error(error):
+            error = None
+        ctx.pop(error)
+
+
+async def _send(response, environ, send):
+    # As a WSGI server would: no body for HEAD, 304 and the like
+    app_iter, status, headers = response.get_wsgi_response(environ)
+    await send(
+        {
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": b"".join(app_iter)})
+    response.close()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_db.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http":
+        environ = _environ(scope)
+        view = _async_view(environ)
+        if view is not None:
+            response = await _dispatch(view, environ)
+            if response is not None:
+                return await _send(response, environ, send)
+    await wsgi_application(scope, receive, send)
@@ -1,9 +1,15 @@
+import asyncio
+import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
 from flask import request, current_app, g
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 from dotenv import load_dotenv
+from profiling import profile_call, should_profile
 import os
 
 load_dotenv()
@@ -12,6 +18,14 @@ AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 API_AUDIENCE = os.getenv("API_AUDIENCE")
 ALGORITHMS = os.getenv("ALGORITHMS")
 
+# JWKS caching (seconds)
+JWKS_CACHE_TTL = int(os.getenv("JWKS_CACHE_TTL", 600))
+JWKS_REFRESH_COOLDOWN = int(os.getenv("JWKS_REFRESH_COOLDOWN", 30))
+JWKS_FETCH_TIMEOUT = int(os.getenv("JWKS_FETCH_TIMEOUT", 5))
+
+# Number of verified tokens kept in memory
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+
 
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -19,6 +33,180 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class JWKSCache:
+    """Process-wide store of the signing keys published by Auth0.
+
+    Keys are fetched once and served from memory for ``ttl`` seconds. After
+    that they are refreshed in a background thread while the old keys keep
+    being served. An unknown ``kid`` triggers an immediate refetch, shared by
+    all concurrent requests and rate limited by ``cooldown``. If a refresh
+    fails the previous keys stay in use.
+    """
+
+    def __init__(self, url, ttl=JWKS_CACHE_TTL, cooldown=JWKS_REFRESH_COOLDOWN):
+        self.url = url
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def _fetch(self):
+        jsonurl = urlopen(self.url, timeout=JWKS_FETCH_TIMEOUT)
+        jwks = json.loads(jsonurl.read())
+        return {
+            key["kid"]: {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"],
+            }
+            for key in jwks["keys"]
+        }
+
+    def _in_cooldown(self, now):
+        return (
+            self._last_attempt is not None and now - self._last_attempt < self.cooldown
+        )
+
+    def refresh(self, force=False):
+        requested_at = time.monotonic()
+        with self._lock:
+            # Another request refreshed the keys while we waited for the lock.
+            if self._last_attempt is not None and self._last_attempt >= requested_at:
+                return
+            if self._keys and not force and self._in_cooldown(requested_at):
+                return
+            self._last_attempt = time.monotonic()
+            try:
+                keys = self._fetch()
+            except Exception as e:
+                self.refresh_failures += 1
+                print("Error fetching JWKS:", e)
+                if not self._keys:
+                    raise AuthError(
+                        {"code": "invalid_jwk", "description": "Unable to fetch JWKS"},
+                        500,
+                    )
+                return
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except AuthError:
+            pass
+
+    def _refresh_in_background(self, now):
+        if self._lock.locked() or self._in_cooldown(now):
+            return
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        if not self._keys:
+            self.refresh()
+        elif now - self._fetched_at > self.ttl:
+            self._refresh_in_background(now)
+
+        key = self._keys.get(kid)
+        if key is not None:
+            self.hits += 1
+            return key
+
+        # Unknown kid: the signing keys may have been rotated.
+        self.misses += 1
+        self.refresh()
+        return self._keys.get(kid)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "keys": len(self._keys),
+            "age": (
+                time.monotonic() - self._fetched_at
+                if self._fetched_at is not None
+                else None
+            ),
+        }
+
+
+jwks_cache = JWKSCache(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+
+
+class TokenCache:
+    """Bounded LRU of decoded JWT payloads.
+
+    Entries are keyed by a SHA-256 of the raw token and expire at the token's
+    ``exp`` claim. Only tokens that passed full verification are stored, so a
+    miss always falls back to ``jwt.decode`` and its error handling.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, token, payload):
+        expires_at = payload.get("exp")
+        if self.maxsize <= 0 or not isinstance(expires_at, (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+token_cache = TokenCache()
+
+
 def get_token_auth_header():
     auth = request.headers.get("Authorization", None)
     # print("Authorization Header:", auth)
@@ -71,36 +259,34 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    # Obtain the JWKS
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    try:
-        jwks = json.loads(jsonurl.read())
-        # print("JWKS:", jwks)
-    except Exception as e:
-        print("Error fetching JWKS:", e)
-        raise AuthError(
-            {"code": "invalid_jwk", "description": "Unable to fetch JWKS"}, 500
-        )
+    # Tokens already verified by this process skip the signature check
+    payload = token_cache.get(token)
+    g.token_cache_hit = payload is not None
+    if payload is not None:
+        return payload
+    return _decode_jwt(token)
+
+
+async def verify_decode_jwt_async(token):
+    payload = token_cache.get(token)
+    g.token_cache_hit = payload is not None
+    if payload is not None:
+        return payload
+    # The JWKS fetch and the RSA check block, so they run on a worker thread
+    return await asyncio.to_thread(_decode_jwt, token)
 
+
+def _decode_jwt(token):
     # Get the header from the token
     unverified_header = jwt.get_unverified_header(token)
 
-    rsa_key = {}
-
     if "kid" not in unverified_header:
         raise AuthError(
             {"code": "invalid_header", "description": "Authorization malformed."}, 401
         )
 
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
+    # Obtain the signing key from the cached JWKS
+    rsa_key = jwks_cache.get_key(unverified_header["kid"])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -110,6 +296,7 @@ def verify_decode_jwt(token):
                 audience=API_AUDIENCE,
                 issuer=f"https://{AUTH0_DOMAIN}/",
             )
+            token_cache.set(token, payload)
             return payload
         except jwt.ExpiredSignatureError:
             raise AuthError(
@@ -145,10 +332,41 @@ def requires_auth(permission=""):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            start = time.perf_counter()
+            try:
+                payload = verify_decode_jwt(token)
+            finally:
+                # Reported by the metrics module
+                g.auth_seconds = time.perf_counter() - start
             check_permissions(permission, payload)
+            # Keys the read-your-writes pin (see routing.py)
+            g.auth_subject = payload.get("sub")
+            if should_profile(payload):
+                return profile_call(f, payload, *args, **kwargs)
             return f(payload, *args, **kwargs)
 
         return wrapper
 
     return requires_auth_decorator
+
+
+def requires_auth_async(permission=""):
+    """``requires_auth`` for coroutine views (see asgi.py). Requests asking
+    to be profiled are served by the WSGI app instead."""
+
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            token = get_token_auth_header()
+            start = time.perf_counter()
+            try:
+                payload = await verify_decode_jwt_async(token)
+            finally:
+                g.auth_seconds = time.perf_counter() - start
+            check_permissions(permission, payload)
+            g.auth_subject = payload.get("sub")
+            return await f(payload, *args, **kwargs)
+
+        return wrapper
+
+    return requires_auth_decorator
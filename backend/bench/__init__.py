@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.util import await_only
+
+
+def database_url(filename):
+    """BENCH_DATABASE_URL, or a SQLite file in the temp directory.
+
+    Benchmarks drop and recreate every table, so they never fall back to
+    DATABASE_URL.
+    """
+    return os.getenv(
+        "BENCH_DATABASE_URL",
+        f"sqlite:///{os.path.join(tempfile.gettempdir(), filename)}",
+    )
+
+
+def install_statement_latency(seconds):
+    """Sleep ``seconds`` in every SQLite statement, where the driver runs it,
+    standing in for the network round trip to a database server."""
+
+    def wait(statement):
+        time.sleep(seconds)
+
+    @event.listens_for(Engine, "connect")
+    def delay_statements(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            dbapi_connection.set_trace_callback(wait)
+        elif hasattr(dbapi_connection, "driver_connection"):
+            # aiosqlite: the callback runs on the connection's own thread
+            await_only(dbapi_connection.driver_connection.set_trace_callback(wait))
@@ -0,0 +1,209 @@
+# Load test of the ASGI entry point against the WSGI app, one process each.
+#
+# The same mix of read requests (group list and detail, student detail,
+# student search) is fired with --concurrency connections at:
+#
+#   wsgi  app.py under a single-threaded WSGI server, like one sync worker
+#   asgi  asgi.py under uvicorn, one process
+#
+# and each reports throughput, p50/p95 latency and the peak number of
+# requests in flight inside the server. Before the load, every request is
+# sent to both servers and the JSON bodies compared.
+#
+# On SQLite, --db-latency-ms adds a sleep to every SQL statement where the
+# driver runs it (a worker thread for aiosqlite), standing in for the network
+# round trip to a database server. Set it to 0 with a Postgres
+# BENCH_DATABASE_URL. The database is dropped and refilled by bench.datagen.
+#
+#   cd backend && python -m bench.async_load --concurrency 50 --requests 1000
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from bench import database_url, install_statement_latency
+
+os.environ["DATABASE_URL"] = database_url("bench_async_load.db")
+
+import uvicorn  # noqa: E402
+from werkzeug.serving import WSGIRequestHandler, make_server  # noqa: E402
+
+import asgi  # noqa: E402
+from app import app, db  # noqa: E402
+from cache import response_cache  # noqa: E402
+from bench.datagen import add_arguments, dataset_kwargs, generate  # noqa: E402
+from bench.loadgen import (  # noqa: E402
+    HOST,
+    READ_PERMISSIONS,
+    fetch_all,
+    read_paths,
+    run_load,
+)
+from bench.offline_auth import OfflineSigner  # noqa: E402
+
+
+class _InFlight:
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.current -= 1
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _wsgi_server(port, in_flight):
+    def counted(environ, start_response):
+        with in_flight:
+            # The body is built inside app(); buffer it so the count covers it
+            return [b"".join(app(environ, start_response))]
+
+    server = make_server(
+        HOST, port, counted, threaded=False, request_handler=_QuietHandler
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+
+    return stop
+
+
+def _asgi_server(port, in_flight):
+    async def counted(scope, receive, send):
+        if scope["type"] != "http":
+            return await asgi.application(scope, receive, send)
+        with in_flight:
+            await asgi.application(scope, receive, send)
+
+    server = uvicorn.Server(
+        uvicorn.Config(counted, host=HOST, port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"uvicorn did not start on port {port}")
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return stop
+
+
+# The client runs in a separate process so it does not share the GIL with
+# the server under test.
+
+
+def _measure(start_server, paths, headers, args, client):
+    in_flight = _InFlight()
+    stop = start_server(args.port, in_flight)
+    try:
+        # Warm the token cache and connection pools
+        client.submit(run_load, args.port, paths[:20], headers, 4).result()
+        in_flight.peak = 0
+        wall, timings, statuses = client.submit(
+            run_load, args.port, paths, headers, args.concurrency
+        ).result()
+    finally:
+        stop()
+    timings.sort()
+    return {
+        "requests": len(timings),
+        "seconds": round(wall, 3),
+        "requests_per_second": round(len(timings) / wall, 1),
+        "p50_ms": round(statistics.median(timings) * 1000, 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95)] * 1000, 2),
+        "peak_in_flight": in_flight.peak,
+        "statuses": statuses,
+    }
+
+
+def _compare(paths, headers, args, client):
+    bodies = {}
+    for name, start_server in (("wsgi", _wsgi_server), ("asgi", _asgi_server)):
+        stop = start_server(args.port, _InFlight())
+        try:
+            bodies[name] = client.submit(fetch_all, args.port, paths, headers).result()
+        finally:
+            stop()
+    mismatches = [
+        path
+        for path, (wsgi_status, wsgi_body), (asgi_status, asgi_body) in zip(
+            paths, bodies["wsgi"], bodies["asgi"]
+        )
+        if wsgi_status != asgi_status or json.loads(wsgi_body) != json.loads(asgi_body)
+    ]
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    # Every request reaches the database
+    response_cache.backend = None
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        summary = generate(**dataset_kwargs(args))
+        dialect = db.engine.dialect.name
+    if args.db_latency_ms and dialect == "sqlite":
+        install_statement_latency(args.db_latency_ms / 1000)
+
+    signer = OfflineSigner()
+    headers = {"Authorization": f"Bearer {signer.token(READ_PERMISSIONS)}"}
+    paths = read_paths(summary, args.requests, args.seed)
+    unique_paths = list(dict.fromkeys(paths))[:200]
+
+    with signer.installed(), ProcessPoolExecutor(
+        1, mp_context=get_context("spawn")
+    ) as client:
+        mismatches = _compare(unique_paths, headers, args, client)
+        results = {
+            "wsgi": _measure(_wsgi_server, paths, headers, args, client),
+            "asgi": _measure(_asgi_server, paths, headers, args, client),
+        }
+
+    print(
+        json.dumps(
+            {
+                "dataset": dataset_kwargs(args),
+                "concurrency": args.concurrency,
+                "db_latency_ms": args.db_latency_ms if dialect == "sqlite" else None,
+                "compared_requests": len(unique_paths),
+                "same_json": not mismatches,
+                "mismatches": mismatches[:10],
+                **results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Micro-benchmark of the per-request cost of @requires_auth.
+#
+# Runs offline: a throwaway RSA key signs the token and the JWKS request is
+# answered locally. "cold" clears the verified-token cache before every call
+# (full RSA signature and claims check), "warm" reuses it.
+#
+#   cd backend && python -m bench.auth_overhead
+import json
+import statistics
+import time
+
+from flask import Flask
+
+import auth
+from bench.offline_auth import OfflineSigner
+
+ITERATIONS = 2000
+
+
+def _measure(view, headers, clear_cache):
+    app = Flask(__name__)
+    timings = []
+    with app.test_request_context(headers=headers):
+        for _ in range(ITERATIONS):
+            if clear_cache:
+                auth.token_cache.clear()
+            start = time.perf_counter()
+            view()
+            timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return {
+        "p50_us": round(statistics.median(timings), 1),
+        "p95_us": round(timings[int(len(timings) * 0.95)], 1),
+        "mean_us": round(statistics.fmean(timings), 1),
+    }
+
+
+def main():
+    signer = OfflineSigner()
+    headers = {"Authorization": f"Bearer {signer.token(['get:groups'])}"}
+
+    @auth.requires_auth("get:groups")
+    def view(payload):
+        return payload
+
+    with signer.installed():
+        results = {
+            "cold": _measure(view, headers, clear_cache=True),
+            "warm": _measure(view, headers, clear_cache=False),
+        }
+    results["speedup"] = round(
+        results["cold"]["mean_us"] / results["warm"]["mean_us"], 1
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Seeded synthetic dataset: N groups, M students, K group memberships and P
+# payments per student, spread over the months before DATASET_END. The same
+# arguments always produce the same rows.
+#
+# The database is dropped and recreated, so point BENCH_DATABASE_URL at a
+# scratch database (defaults to a SQLite file in the temp directory):
+#
+#   cd backend && python -m bench.datagen --groups 50 --students 5000
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from billing import rebuild_ledger
+from models import db, Group, Student, Payment, student_group_association
+
+from bench import database_url
+
+BATCH = 10000
+# Payments end here rather than at the wall clock, so monthly buckets and
+# ledger months are the same from one run to the next
+DATASET_END = datetime(2026, 1, 1)
+FIRST_NAMES = ["Ana", "Luis", "María", "José", "Sofía", "Diego", "Valeria", "Mateo"]
+LAST_NAMES = ["García", "López", "Martínez", "Pérez", "Sánchez", "Cruz", "Díaz"]
+
+
+def _insert(table, rows):
+    for offset in range(0, len(rows), BATCH):
+        db.session.execute(table.insert(), rows[offset : offset + BATCH])
+
+
+def generate(
+    groups=20, students=1000, memberships=2, payments=6, months=6, seed=0, now=None
+):
+    """Insert the dataset into the (empty) current database and fill the
+    payment ledger. Must run inside an app context. Payments fall in the
+    ``months`` before ``now``, DATASET_END by default.
+
+    Returns a summary with the ranges of generated ids.
+    """
+    rng = random.Random(seed)
+    now = now or DATASET_END
+    memberships = min(memberships, groups)
+
+    costs = [rng.choice((100, 150, 200, 250)) for _ in range(groups)]
+    _insert(
+        Group.__table__,
+        [
+            {"title": f"Group {i + 1}", "group_cost": cost}
+            for i, cost in enumerate(costs)
+        ],
+    )
+    _insert(
+        Student.__table__,
+        [
+            {
+                "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i + 1}",
+                "parent_phone_number": f"52{rng.randint(10**9, 10**10 - 1)}",
+            }
+            for i in range(students)
+        ],
+    )
+    group_ids = db.session.scalars(db.select(Group.id).order_by(Group.id)).all()
+    student_ids = db.session.scalars(db.select(Student.id).order_by(Student.id)).all()
+
+    membership_rows = []
+    payment_rows = []
+    span = int(timedelta(days=30 * months).total_seconds())
+    start = now - timedelta(seconds=span)
+    for student_id in student_ids:
+        member_of = rng.sample(range(groups), memberships)
+        membership_rows += [
+            {"student_id": student_id, "group_id": group_ids[index]}
+            for index in member_of
+        ]
+        cost = sum(costs[index] for index in member_of)
+        payment_rows += [
+            {
+                "student_id": student_id,
+                "amount": rng.randint(10, 200),
+                "group_cost_at_payment": cost,
+                "date": start + timedelta(seconds=rng.randint(0, span)),
+            }
+            for _ in range(payments)
+        ]
+    _insert(student_group_association, membership_rows)
+    _insert(Payment.__table__, payment_rows)
+    db.session.commit()
+    rebuild_ledger()
+
+    return {
+        "groups": len(group_ids),
+        "students": len(student_ids),
+        "memberships": len(membership_rows),
+        "payments": len(payment_rows),
+        "group_ids": [group_ids[0], group_ids[-1]] if group_ids else [],
+        "student_ids": [student_ids[0], student_ids[-1]] if student_ids else [],
+        "seed": seed,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--memberships", type=int, default=2, help="groups per student")
+    parser.add_argument("--payments", type=int, default=6, help="per student")
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def dataset_kwargs(args):
+    return {
+        "groups": args.groups,
+        "students": args.students,
+        "memberships": args.memberships,
+        "payments": args.payments,
+        "months": args.months,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = database_url("bench_data.db")
+    from app import app
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        print(json.dumps(generate(**dataset_kwargs(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
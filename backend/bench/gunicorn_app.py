@@ -0,0 +1,16 @@
+# WSGI app served by bench.gunicorn_load: app.app, verifying tokens against
+# the JWKS in BENCH_JWKS (fetched after BENCH_JWKS_LATENCY_MS), with
+# BENCH_DB_LATENCY_MS added to every SQLite statement.
+import json
+import os
+
+from bench import install_statement_latency
+from bench.offline_auth import install_jwks
+from app import app  # noqa: F401
+
+install_jwks(
+    json.loads(os.environ["BENCH_JWKS"]),
+    float(os.getenv("BENCH_JWKS_LATENCY_MS", 0)) / 1000,
+)
+if float(os.getenv("BENCH_DB_LATENCY_MS", 0)):
+    install_statement_latency(float(os.environ["BENCH_DB_LATENCY_MS"]) / 1000)
@@ -0,0 +1,140 @@
+# Load test of the gunicorn serving profile in gunicorn.conf.py against the
+# Procfile's previous command, `gunicorn app:app` with no configuration: one
+# sync worker, nothing preloaded or prewarmed.
+#
+# Each setup is launched from scratch and reports:
+#
+#   listen_seconds  from launch until the port accepts connections
+#   cold            a burst of --concurrency requests sent as soon as the port
+#                   accepts connections, while workers load the app, connect
+#                   to the database and fetch the Auth0 keys
+#   steady          --requests requests over --concurrency connections
+#
+# The JWKS is served offline with --jwks-latency-ms of delay, standing in for
+# the round trip to Auth0, and on SQLite --db-latency-ms is added to every
+# statement (see bench.async_load). The response cache is off, so every
+# request reaches the database. The database is dropped and refilled by
+# bench.datagen. WEB_CONCURRENCY and GUNICORN_THREADS size the tuned setup as
+# they would in production.
+#
+#   cd backend && python -m bench.gunicorn_load --concurrency 20 --requests 1000
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+
+from bench import database_url
+
+os.environ["DATABASE_URL"] = database_url("bench_gunicorn_load.db")
+
+from app import app, db  # noqa: E402
+from bench.datagen import add_arguments, dataset_kwargs, generate  # noqa: E402
+from bench.loadgen import HOST, READ_PERMISSIONS, read_paths, run_load  # noqa: E402
+from bench.offline_auth import OfflineSigner  # noqa: E402
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = os.path.join(BACKEND, "gunicorn.conf.py")
+
+
+def _summary(wall, timings, statuses):
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "seconds": round(wall, 3),
+        "requests_per_second": round(len(timings) / wall, 1),
+        "p50_ms": round(statistics.median(timings) * 1000, 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95)] * 1000, 2),
+        "max_ms": round(timings[-1] * 1000, 2),
+        "statuses": statuses,
+    }
+
+
+def _wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            socket.create_connection((HOST, port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f"gunicorn did not listen on port {port}")
+
+
+def _measure(config, env, paths, headers, args):
+    command = ["gunicorn", "-c", config, "-b", f"{HOST}:{args.port}"]
+    command += ["--log-level", "warning", "bench.gunicorn_app:app"]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=BACKEND, env=env)
+    try:
+        _wait_for_port(args.port, process)
+        listen_seconds = time.perf_counter() - start
+        cold = run_load(args.port, paths[: args.concurrency], headers, args.concurrency)
+        steady = run_load(args.port, paths, headers, args.concurrency)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+    return {
+        "listen_seconds": round(listen_seconds, 3),
+        "cold": _summary(*cold),
+        "steady": _summary(*steady),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--jwks-latency-ms", type=float, default=150.0)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        summary = generate(**dataset_kwargs(args))
+        dialect = db.engine.dialect.name
+
+    signer = OfflineSigner()
+    headers = {"Authorization": f"Bearer {signer.token(READ_PERMISSIONS)}"}
+    paths = read_paths(summary, args.requests, args.seed)
+    env = dict(
+        os.environ,
+        CACHE_URL="none",
+        BENCH_JWKS=json.dumps(signer.jwks()),
+        BENCH_JWKS_LATENCY_MS=str(args.jwks_latency_ms),
+        BENCH_DB_LATENCY_MS=str(args.db_latency_ms if dialect == "sqlite" else 0),
+    )
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    # What the Procfile ran before: gunicorn's defaults, no config file
+    with tempfile.NamedTemporaryFile("w", suffix=".py") as defaults:
+        results = {
+            "baseline": _measure(defaults.name, env, paths, headers, args),
+            "tuned": _measure(CONFIG, env, paths, headers, args),
+        }
+
+    print(
+        json.dumps(
+            {
+                "dataset": dataset_kwargs(args),
+                "concurrency": args.concurrency,
+                "db_latency_ms": args.db_latency_ms if dialect == "sqlite" else None,
+                "jwks_latency_ms": args.jwks_latency_ms,
+                **results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# HTTP load generator for the serving benchmarks. Requests are raw HTTP/1.1
+# on asyncio streams, one connection per request, as the single-threaded
+# WSGI server in bench.async_load does not keep connections alive.
+import asyncio
+import random
+import time
+
+HOST = "127.0.0.1"
+READ_PERMISSIONS = ["get:groups", "get:group", "get:students", "get:student"]
+SEARCH_TERMS = ["ana", "garcia", "luis l", "maria", "52", "sofia cruz"]
+
+
+def read_paths(summary, count, seed):
+    """``count`` paths mixing group list and detail, student detail and
+    student search, for a dataset from bench.datagen."""
+    rng = random.Random(seed)
+    first_group, last_group = summary["group_ids"]
+    first_student, last_student = summary["student_ids"]
+    builders = [
+        lambda: "/api/groups?limit=20",
+        lambda: f"/api/groups/{rng.randint(first_group, last_group)}?expand=",
+        lambda: f"/api/students/{rng.randint(first_student, last_student)}",
+        lambda: f"/api/students/search?q={rng.choice(SEARCH_TERMS).replace(' ', '%20')}",
+    ]
+    return [rng.choice(builders)() for _ in range(count)]
+
+
+async def _fetch(port, path, headers):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    lines = [f"GET {path} HTTP/1.1", f"Host: {HOST}:{port}", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, body = raw.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    if b"transfer-encoding: chunked" in head.lower():
+        chunks = []
+        while body:
+            size, _, body = body.partition(b"\r\n")
+            size = int(size, 16)
+            chunks.append(body[:size])
+            body = body[size + 2 :]
+        body = b"".join(chunks)
+    return status, body
+
+
+async def _load(port, paths, headers, concurrency):
+    queue = list(reversed(paths))
+    timings = []
+    statuses = {}
+
+    async def worker():
+        while queue:
+            path = queue.pop()
+            start = time.perf_counter()
+            status, _ = await _fetch(port, path, headers)
+            timings.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, timings, statuses
+
+
+def run_load(port, paths, headers, concurrency):
+    return asyncio.run(_load(port, paths, headers, concurrency))
+
+
+def fetch_all(port, paths, headers):
+    async def fetch():
+        return [await _fetch(port, path, headers) for path in paths]
+
+    return asyncio.run(fetch())
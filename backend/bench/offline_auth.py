@@ -0,0 +1,104 @@
+# Offline stand-in for Auth0: a throwaway RSA key signs tokens and the JWKS
+# request made by auth.JWKSCache is answered locally, so @requires_auth runs
+# its full verification path without network access.
+import base64
+import json
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import rsa
+from jose import jwt
+
+import auth
+
+DOMAIN = "bench.local"
+AUDIENCE = "bench"
+KID = "bench"
+
+
+def _b64(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+class _JWKSResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class OfflineSigner:
+    def __init__(self, domain=DOMAIN, audience=AUDIENCE, kid=KID):
+        self.domain = domain
+        self.audience = audience
+        self.kid = kid
+        self.public_key, self.private_key = rsa.newkeys(2048)
+        self.jwks_fetches = 0
+
+    def jwks(self):
+        return {
+            "keys": [
+                {
+                    "kty": "RSA",
+                    "kid": self.kid,
+                    "use": "sig",
+                    "n": _b64(self.public_key.n),
+                    "e": _b64(self.public_key.e),
+                }
+            ]
+        }
+
+    def token(self, permissions, ttl=3600, subject="bench|user"):
+        now = int(time.time())
+        return jwt.encode(
+            {
+                "iss": f"https://{self.domain}/",
+                "aud": self.audience,
+                "sub": subject,
+                "iat": now,
+                "exp": now + ttl,
+                "permissions": list(permissions),
+            },
+            self.private_key.save_pkcs1().decode(),
+            algorithm="RS256",
+            headers={"kid": self.kid},
+        )
+
+    def _urlopen(self, url, timeout=None):
+        self.jwks_fetches += 1
+        return _JWKSResponse(json.dumps(self.jwks()).encode())
+
+    @contextmanager
+    def installed(self):
+        """Point the auth module at this signer for the duration of the block."""
+        jwks_url = f"https://{self.domain}/.well-known/jwks.json"
+        with mock.patch.multiple(
+            auth,
+            AUTH0_DOMAIN=self.domain,
+            API_AUDIENCE=self.audience,
+            ALGORITHMS=["RS256"],
+            jwks_cache=auth.JWKSCache(jwks_url),
+            token_cache=auth.TokenCache(),
+            urlopen=self._urlopen,
+        ):
+            yield self
+
+
+def install_jwks(jwks, latency=0):
+    """Point the auth module of this process at ``jwks`` for good, answering
+    every JWKS fetch after ``latency`` seconds. For servers started in a
+    subprocess, where ``OfflineSigner.installed`` cannot reach."""
+    body = json.dumps(jwks).encode()
+
+    def fetch(url, timeout=None):
+        time.sleep(latency)
+        return _JWKSResponse(body)
+
+    auth.AUTH0_DOMAIN = DOMAIN
+    auth.API_AUDIENCE = AUDIENCE
+    auth.ALGORITHMS = ["RS256"]
+    auth.jwks_cache = auth.JWKSCache(f"https://{DOMAIN}/.well-known/jwks.json")
+    auth.urlopen = fetch
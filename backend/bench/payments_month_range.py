@@ -0,0 +1,129 @@
+# Month filter on payments: extract(year/month) vs a half-open date range,
+# with and without the (student_id, date) index.
+#
+# The database is dropped and recreated, so point BENCH_DATABASE_URL at a
+# scratch database (defaults to a SQLite file in the temp directory):
+#
+#   cd backend && python -m bench.payments_month_range --payments 1000000
+#   BENCH_DATABASE_URL=postgresql://localhost/bench python -m bench.payments_month_range
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bench import database_url
+
+os.environ["DATABASE_URL"] = database_url("bench_payments.db")
+
+from sqlalchemy import func, text  # noqa: E402
+from app import app, db  # noqa: E402
+from billing import month_window  # noqa: E402
+from models import Payment, Student  # noqa: E402
+
+INDEX = "ix_payments_student_id_date"
+BATCH = 50000
+
+
+def seed(students, payments, months):
+    rng = random.Random(7)
+    db.session.execute(
+        Student.__table__.insert(),
+        [
+            {"name": f"Student {i}", "parent_phone_number": "5550000000"}
+            for i in range(students)
+        ],
+    )
+    start = datetime.utcnow() - timedelta(days=30 * months)
+    span = 30 * months * 86400
+    for offset in range(0, payments, BATCH):
+        db.session.execute(
+            Payment.__table__.insert(),
+            [
+                {
+                    "amount": rng.randint(10, 200),
+                    "student_id": rng.randint(1, students),
+                    "group_cost_at_payment": 200,
+                    "date": start + timedelta(seconds=rng.randint(0, span)),
+                }
+                for _ in range(min(BATCH, payments - offset))
+            ],
+        )
+    db.session.commit()
+
+
+def extract_query(student_id, now):
+    return db.session.query(func.coalesce(func.sum(Payment.amount), 0)).filter(
+        Payment.student_id == student_id,
+        func.extract("year", Payment.date) == now.year,
+        func.extract("month", Payment.date) == now.month,
+    )
+
+
+def range_query(student_id, now):
+    start, end = month_window(now)
+    return db.session.query(func.coalesce(func.sum(Payment.amount), 0)).filter(
+        Payment.student_id == student_id,
+        Payment.date >= start,
+        Payment.date < end,
+    )
+
+
+def explain(query):
+    statement = query.statement.compile(
+        db.engine, compile_kwargs={"literal_binds": True}
+    )
+    if db.engine.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN ANALYZE "
+    rows = db.session.execute(text(prefix + str(statement))).all()
+    return [" ".join(str(column) for column in row) for row in rows]
+
+
+def measure(build, student_ids, now):
+    timings = []
+    for student_id in student_ids:
+        start = time.perf_counter()
+        build(student_id, now).scalar()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.fmean(timings), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=10000)
+    parser.add_argument("--payments", type=int, default=1000000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.students, args.payments, args.months)
+
+        now = datetime.utcnow()
+        student_ids = random.Random(1).sample(range(1, args.students + 1), args.lookups)
+        results = {"dialect": db.engine.dialect.name, "payments": args.payments}
+        for indexed in (False, True):
+            if indexed:
+                db.session.execute(
+                    text(f"CREATE INDEX {INDEX} ON payments (student_id, date)")
+                )
+            else:
+                db.session.execute(text(f"DROP INDEX {INDEX}"))
+            db.session.commit()
+            label = "indexed" if indexed else "no_index"
+            for name, build in (("extract", extract_query), ("range", range_query)):
+                results[f"{label}.{name}"] = {
+                    "mean_ms": measure(build, student_ids, now),
+                    "plan": explain(build(student_ids[0], now)),
+                }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+# p50/p95 latency, SQL queries per request and peak Python memory of every
+# route in app.py. Requests go through the full Flask stack, including
+# @requires_auth, with tokens from the offline signer. The verified-token
+# cache is warm after the first request, as in production.
+#
+# The database is dropped, recreated and filled by bench.datagen, so point
+# BENCH_DATABASE_URL at a scratch database (defaults to a SQLite file in the
+# temp directory). Results are written as JSON; a later run can be compared
+# against them and exits non-zero on a regression:
+#
+#   cd backend && python -m bench.routes --output baseline.json
+#   python -m bench.routes --compare baseline.json
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from bench import database_url
+
+os.environ["DATABASE_URL"] = database_url("bench_routes.db")
+
+from sqlalchemy import event, insert  # noqa: E402
+from app import app, db  # noqa: E402
+from cache import response_cache  # noqa: E402
+from models import Group, Student, Payment, student_group_association  # noqa: E402
+from bench.datagen import add_arguments, dataset_kwargs, generate  # noqa: E402
+from bench.offline_auth import OfflineSigner  # noqa: E402
+
+PERMISSIONS = [
+    "get:groups",
+    "get:group",
+    "create:group",
+    "patch:group",
+    "delete:group",
+    "get:students_by_group",
+    "add:student_to_group",
+    "remove:student_from_group",
+    "get:students",
+    "get:student",
+    "create:student",
+    "patch:student",
+    "delete:student",
+    "create:payment",
+    "delete:payment",
+    "get:payment_status",
+    "get:reports",
+    "get:cache_stats",
+    "profile:requests",
+]
+BULK_SIZE = 50
+# Below these absolute differences a slower run is treated as noise
+LATENCY_NOISE_MS = 1.0
+MEMORY_NOISE_KIB = 64
+
+
+class Fixture:
+    """Ids of the generated dataset, plus fresh rows for routes that consume
+    what they act on (deletes, membership removal)."""
+
+    def __init__(self, summary, client, headers, seed=1):
+        self.client = client
+        self.headers = headers
+        self.group_ids = range(summary["group_ids"][0], summary["group_ids"][1] + 1)
+        self.student_ids = range(
+            summary["student_ids"][0], summary["student_ids"][1] + 1
+        )
+        self.rng = random.Random(seed)
+
+    def group(self):
+        return self.rng.choice(self.group_ids)
+
+    def student(self):
+        return self.rng.choice(self.student_ids)
+
+    def _insert(self, model, rows):
+        ids = db.session.scalars(
+            insert(model).returning(model.id, sort_by_parameter_order=True), rows
+        ).all()
+        db.session.commit()
+        return ids
+
+    def new_groups(self, count):
+        rows = [{"title": f"Bench {i}", "group_cost": 100} for i in range(count)]
+        return self._insert(Group, rows)
+
+    def new_students(self, count, group_id=None):
+        rows = [
+            {"name": f"Bench Student {i}", "parent_phone_number": "5550000000"}
+            for i in range(count)
+        ]
+        ids = self._insert(Student, rows)
+        if group_id is not None:
+            db.session.execute(
+                insert(student_group_association),
+                [{"student_id": id, "group_id": group_id} for id in ids],
+            )
+            db.session.commit()
+        return ids
+
+    def new_payments(self, count):
+        rows = [
+            {"student_id": self.student(), "amount": 10, "group_cost_at_payment": 100}
+            for _ in range(count)
+        ]
+        ids = self._insert(Payment, rows)
+        return [(row["student_id"], id) for row, id in zip(rows, ids)]
+
+    def profile(self):
+        response = self.client.get(
+            "/api/groups", headers={**self.headers, "X-Profile": "1"}
+        )
+        return response.headers["X-Profile-Id"]
+
+
+# One entry per endpoint: a function returning ``count`` keyword dicts for
+# the test client. Reads come first so writes cannot change what they see.
+def _get(path):
+    return {"path": path}
+
+
+CASES = {
+    "get_groups": lambda fx, n: [_get("/api/groups")] * n,
+    "get_group": lambda fx, n: [_get(f"/api/groups/{fx.group()}") for _ in range(n)],
+    "get_students_by_group": lambda fx, n: [
+        _get(f"/api/groups/{fx.group()}/students") for _ in range(n)
+    ],
+    "get_group_payment_status": lambda fx, n: [
+        _get(f"/api/groups/{fx.group()}/payment_status") for _ in range(n)
+    ],
+    "get_students": lambda fx, n: [_get("/api/students")] * n,
+    "get_student": lambda fx, n: [
+        _get(f"/api/students/{fx.student()}") for _ in range(n)
+    ],
+    "search_students_endpoint": lambda fx, n: [
+        _get(f"/api/students/search?q={fx.rng.choice(['ana', 'jos', 'mar', '52'])}")
+        for _ in range(n)
+    ],
+    "get_payment_status": lambda fx, n: [
+        _get(f"/api/students/{fx.student()}/payment_status") for _ in range(n)
+    ],
+    "get_students_payment_status": lambda fx, n: [
+        _get(
+            "/api/students/payment_status?ids="
+            + ",".join(str(fx.student()) for _ in range(BULK_SIZE))
+        )
+        for _ in range(n)
+    ],
+    "get_billing_report": lambda fx, n: [_get("/api/reports/billing")] * n,
+    "get_revenue_report": lambda fx, n: [_get("/api/reports/revenue")] * n,
+    "get_arrears_report": lambda fx, n: [_get("/api/reports/arrears?limit=50")] * n,
+    "get_cache_stats": lambda fx, n: [_get("/api/cache/stats")] * n,
+    "metrics": lambda fx, n: [_get("/metrics")] * n,
+    "get_profiles": lambda fx, n: [_get("/api/profiles")] * n,
+    "download_profile": lambda fx, n: [
+        _get(f"/api/profiles/{profile_id}/pstats") for profile_id in [fx.profile()]
+    ]
+    * n,
+    "create_group": lambda fx, n: [
+        {"path": "/api/groups", "json": {"title": f"New {i}", "group_cost": 120}}
+        for i in range(n)
+    ],
+    "update_group": lambda fx, n: [
+        {"path": f"/api/groups/{fx.group()}", "json": {"group_cost": 100 + i}}
+        for i in range(n)
+    ],
+    "create_student": lambda fx, n: [
+        {
+            "path": "/api/students",
+            "json": {
+                "name": f"New Student {i}",
+                "parent_phone_number": "5551112222",
+                "group_ids": [fx.group()],
+            },
+        }
+        for i in range(n)
+    ],
+    "bulk_create_students": lambda fx, n: [
+        {
+            "path": "/api/students/bulk",
+            "json": [
+                {"name": f"Bulk {i}-{j}", "parent_phone_number": "5551112222"}
+                for j in range(BULK_SIZE)
+            ],
+        }
+        for i in range(n)
+    ],
+    "update_student": lambda fx, n: [
+        {"path": f"/api/students/{fx.student()}", "json": {"name": f"Renamed {i}"}}
+        for i in range(n)
+    ],
+    "set_student_groups": lambda fx, n: [
+        {
+            "path": f"/api/students/{id}/groups",
+            "json": {"group_ids": [fx.group(), fx.group()]},
+        }
+        for id in fx.new_students(n)
+    ],
+    "set_group_students": lambda fx, n: [
+        {
+            "path": f"/api/groups/{fx.new_groups(1)[0]}/students",
+            "json": {"student_ids": [fx.student() for _ in range(10)]},
+        }
+        for _ in range(n)
+    ],
+    "add_student_to_group": lambda fx, n: [
+        {"path": f"/api/groups/{fx.group()}/students", "json": {"student_id": id}}
+        for id in fx.new_students(n)
+    ],
+    "add_payment": lambda fx, n: [
+        {"path": f"/api/students/{fx.student()}/payments", "json": {"amount": 50}}
+        for _ in range(n)
+    ],
+    "bulk_add_payments": lambda fx, n: [
+        {
+            "path": "/api/payments/bulk",
+            "json": [
+                {"student_id": fx.student(), "amount": 25} for _ in range(BULK_SIZE)
+            ],
+        }
+        for _ in range(n)
+    ],
+    "remove_student_from_group": lambda fx, n: [
+        {"path": f"/api/groups/{group_id}/students/{id}"}
+        for group_id in [fx.group()]
+        for id in fx.new_students(n, group_id)
+    ],
+    "delete_payment": lambda fx, n: [
+        {"path": f"/api/students/{student_id}/payments/{id}"}
+        for student_id, id in fx.new_payments(n)
+    ],
+    "delete_student": lambda fx, n: [
+        {"path": f"/api/students/{id}"} for id in fx.new_students(n)
+    ],
+    "delete_group": lambda fx, n: [
+        {"path": f"/api/groups/{id}"} for id in fx.new_groups(n)
+    ],
+}
+
+
+def routes():
+    """``endpoint -> (method, rule)`` for every route except static files."""
+    found = {}
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == "static":
+            continue
+        (method,) = rule.methods - {"HEAD", "OPTIONS"}
+        found[rule.endpoint] = (method, rule.rule)
+    missing = sorted(set(found) - set(CASES))
+    if missing:
+        raise SystemExit(f"No benchmark case for: {', '.join(missing)}")
+    return found
+
+
+def fetch(client, method, headers, kwargs):
+    # Streamed responses run their queries while the body is read, so the
+    # body is read before the response counts as done
+    response = client.open(method=method, headers=headers, **kwargs)
+    response.get_data()
+    response.close()
+    return response
+
+
+def measure(client, method, requests, warmup, headers, statements):
+    for kwargs in requests[:warmup]:
+        fetch(client, method, headers, kwargs)
+
+    timings = []
+    queries = []
+    statuses = set()
+    for kwargs in requests[warmup:-1]:
+        statements.clear()
+        start = time.perf_counter()
+        response = fetch(client, method, headers, kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(statements))
+        statuses.add(response.status_code)
+
+    tracemalloc.start()
+    response = fetch(client, method, headers, requests[-1])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    statuses.add(response.status_code)
+
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[max(int(len(timings) * 0.95) - 1, 0)], 3),
+        "queries": max(queries),
+        "peak_kib": round(peak / 1024, 1),
+        "statuses": sorted(statuses),
+    }
+
+
+def run(args):
+    if not args.response_cache:
+        response_cache.backend = None
+    endpoints = routes()
+    signer = OfflineSigner()
+    headers = {"Authorization": f"Bearer {signer.token(PERMISSIONS)}"}
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        summary = generate(**dataset_kwargs(args))
+        dialect = db.engine.dialect.name
+        engine = db.engine
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *rest):
+        statements.append(statement)
+
+    results = {}
+    client = app.test_client()
+    fixture = Fixture(summary, client, headers)
+    with signer.installed():
+        for endpoint, build in CASES.items():
+            method, rule = endpoints[endpoint]
+            with app.app_context():
+                requests = build(fixture, args.warmup + args.iterations + 1)
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+            try:
+                results[f"{method} {rule}"] = measure(
+                    client, method, requests, args.warmup, headers, statements
+                )
+            finally:
+                event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    return {
+        "meta": {
+            "dialect": dialect,
+            "python": platform.python_version(),
+            "iterations": args.iterations,
+            "response_cache": args.response_cache,
+            "dataset": dataset_kwargs(args),
+        },
+        "routes": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Lines describing routes that got slower, heavier or chattier."""
+    regressions = []
+    for route, now in current["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            continue
+        # p95 over a few dozen requests is too noisy to gate on; p50 is not.
+        if (
+            now["p50_ms"] > before["p50_ms"] * (1 + tolerance)
+            and now["p50_ms"] - before["p50_ms"] > LATENCY_NOISE_MS
+        ):
+            regressions.append(f"{route}: p50 {before['p50_ms']} -> {now['p50_ms']} ms")
+        if now["queries"] > before["queries"]:
+            regressions.append(
+                f"{route}: queries {before['queries']} -> {now['queries']}"
+            )
+        if (
+            now["peak_kib"] > before["peak_kib"] * (1 + tolerance)
+            and now["peak_kib"] - before["peak_kib"] > MEMORY_NOISE_KIB
+        ):
+            regressions.append(
+                f"{route}: peak memory {before['peak_kib']} -> {now['peak_kib']} KiB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument(
+        "--response-cache",
+        action="store_true",
+        help="keep the response cache on (reads then measure cache hits)",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed relative growth of p50 latency and peak memory",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["dataset"] != results["meta"]["dataset"]:
+            print("warning: baseline was recorded with a different dataset")
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
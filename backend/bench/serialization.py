@@ -0,0 +1,78 @@
+# Payload size and serialization time of the read endpoints, comparing the
+# legacy full to_dict() shape with the default (shallow) fieldsets.
+#
+# Uses an in-memory SQLite database and calls the views without the auth
+# and response cache decorators, so only loading and serialization are
+# measured.
+#
+#   cd backend && python -m bench.serialization
+import inspect
+import json
+import os
+import random
+import statistics
+import time
+
+os.environ["DATABASE_URL"] = "sqlite://"
+
+from app import app, db, get_groups, get_students  # noqa: E402
+from models import Group, Student, Payment  # noqa: E402
+
+GROUPS = 40
+STUDENTS = 1200
+GROUPS_PER_STUDENT = 2
+PAYMENTS_PER_STUDENT = 12
+ITERATIONS = 10
+
+CASES = [
+    ("get_groups", get_groups, "expand=students.payments,students.groups"),
+    ("get_groups", get_groups, ""),
+    ("get_groups", get_groups, "fields=id,title,student_count"),
+    ("get_students", get_students, "expand=payments,groups"),
+    ("get_students", get_students, ""),
+]
+
+
+def seed():
+    rng = random.Random(42)
+    groups = [Group(title=f"Group {i}", group_cost=100) for i in range(GROUPS)]
+    db.session.add_all(groups)
+    for i in range(STUDENTS):
+        student = Student(name=f"Student {i}", parent_phone_number="5550000000")
+        student.groups = rng.sample(groups, GROUPS_PER_STUDENT)
+        student.payments = [
+            Payment(amount=50, group_cost_at_payment=200)
+            for _ in range(PAYMENTS_PER_STUDENT)
+        ]
+        db.session.add(student)
+    db.session.commit()
+
+
+def measure(view, query_string):
+    timings = []
+    for _ in range(ITERATIONS):
+        with app.test_request_context(query_string=query_string):
+            db.session.expunge_all()
+            start = time.perf_counter()
+            response = inspect.unwrap(view)({})
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "bytes": len(response.get_data()),
+        "p50_ms": round(statistics.median(timings), 2),
+    }
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        seed()
+        results = []
+        for name, view, query_string in CASES:
+            result = {"endpoint": name, "query": query_string or "(default)"}
+            result.update(measure(view, query_string))
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Latency of GET /api/students/search's query against the previous approach
+# of downloading every student and filtering on the client.
+#
+# The database is dropped and recreated, so point BENCH_DATABASE_URL at a
+# scratch database (defaults to a SQLite file in the temp directory):
+#
+#   cd backend && python -m bench.student_search --students 100000
+#   BENCH_DATABASE_URL=postgresql://localhost/bench python -m bench.student_search
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+from bench import database_url
+
+os.environ["DATABASE_URL"] = database_url("bench_search.db")
+
+from sqlalchemy import text  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Student, search_text  # noqa: E402
+from search import SEARCH_PAGE_SIZE, search_students  # noqa: E402
+
+BATCH = 20000
+FIRST_NAMES = [
+    "Ana", "Luis", "María", "José", "Sofía", "Diego", "Valeria", "Mateo",
+    "Camila", "Santiago", "Lucía", "Daniel", "Emma", "Sebastián", "Renata",
+    "Nicolás", "Ximena", "Emilio", "Regina", "Joaquín",
+]  # fmt: skip
+LAST_NAMES = [
+    "García", "Hernández", "López", "Martínez", "González", "Pérez",
+    "Rodríguez", "Sánchez", "Ramírez", "Cruz", "Flores", "Gómez", "Morales",
+    "Vázquez", "Jiménez", "Reyes", "Díaz", "Torres", "Gutiérrez", "Ruiz",
+]  # fmt: skip
+
+
+def seed(students):
+    rng = random.Random(11)
+    for offset in range(0, students, BATCH):
+        db.session.execute(
+            Student.__table__.insert(),
+            [
+                {
+                    "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} "
+                    f"{rng.choice(LAST_NAMES)} {offset + i}",
+                    "parent_phone_number": f"52{rng.randint(10**9, 10**10 - 1)}",
+                }
+                for i in range(min(BATCH, students - offset))
+            ],
+        )
+    db.session.commit()
+
+
+def terms(count):
+    rng = random.Random(5)
+    rows = db.session.execute(
+        text(
+            "SELECT name, parent_phone_number FROM students ORDER BY random() LIMIT :n"
+        ),
+        {"n": count},
+    ).all()
+    result = []
+    for name, phone in rows:
+        result.append(name[: rng.randint(2, 8)])
+        result.append(name.split()[1][:4])
+        result.append(phone[: rng.randint(4, 8)])
+    result.append("zzzz")
+    return result
+
+
+def client_side_filter(term):
+    # What Students.js would have to do: fetch everything, filter locally.
+    needle = search_text(term)
+    names = db.session.execute(text("SELECT id, name FROM students")).all()
+    return [row for row in names if needle in search_text(row.name)][:SEARCH_PAGE_SIZE]
+
+
+def measure(run, search_terms):
+    timings = []
+    for term in search_terms:
+        db.session.expunge_all()
+        start = time.perf_counter()
+        run(term)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=100000)
+    parser.add_argument("--terms", type=int, default=50)
+    parser.add_argument("--baseline-terms", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.students)
+
+        search_terms = terms(args.terms)
+        results = {
+            "dialect": db.engine.dialect.name,
+            "students": args.students,
+            "search": measure(
+                lambda term: search_students(term, SEARCH_PAGE_SIZE), search_terms
+            ),
+            "client_side_filter": measure(
+                client_side_filter, search_terms[: args.baseline_terms]
+            ),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
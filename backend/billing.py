@@ -0,0 +1,429 @@
+# billing.py
+from datetime import datetime, timezone
+from sqlalchemy import Date, cast, delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from streaming import STREAM_BATCH_SIZE
+from versioning import count_changes, touch
+from models import (
+    db,
+    Group,
+    Student,
+    Payment,
+    StudentMonthlyBalance,
+    insert_returning_ids,
+    student_group_association,
+)
+
+UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def month_start(moment):
+    return moment.date().replace(day=1)
+
+
+def month_window(moment):
+    """Half-open ``[start, end)`` datetime range of the month containing moment.
+
+    Filtering with ``Payment.date >= start, Payment.date < end`` lets the
+    (student_id, date) index serve the query, unlike extract(year/month).
+    """
+    start = datetime(moment.year, moment.month, 1)
+    if moment.month == 12:
+        end = datetime(moment.year + 1, 1, 1)
+    else:
+        end = datetime(moment.year, moment.month + 1, 1)
+    return start, end
+
+
+def parse_month(value):
+    """Parse ``YYYY-MM`` into the first day of that month."""
+    return datetime.strptime(value, "%Y-%m")
+
+
+def month_bucket(column):
+    """SQL expression truncating a timestamp column to the first of its month."""
+    if db.session.get_bind().dialect.name == "sqlite":
+        return func.date(column, "start of month")
+    return cast(func.date_trunc("month", column), Date)
+
+
+def apply_to_ledger(student_id, paid_at, amount, count=1):
+    """Add ``amount`` (negative to remove) to a student's monthly balance.
+
+    Runs in the caller's transaction, so the ledger commits or rolls back
+    together with the payment itself.
+    """
+    apply_ledger_deltas({(student_id, month_start(paid_at)): (amount, count)})
+
+
+def apply_ledger_deltas(deltas):
+    """Apply ``{(student_id, month): (amount, count)}`` to the ledger in bulk."""
+    if not deltas:
+        return
+    table = StudentMonthlyBalance.__table__
+    rows = [
+        {
+            "student_id": student_id,
+            "month": month,
+            "total_paid": amount,
+            "payment_count": count,
+        }
+        for (student_id, month), (amount, count) in deltas.items()
+    ]
+    upsert = UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.student_id, table.c.month],
+            set_={
+                "total_paid": table.c.total_paid + stmt.excluded.total_paid,
+                "payment_count": table.c.payment_count + stmt.excluded.payment_count,
+            },
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    for row in rows:
+        result = db.session.execute(
+            update(table)
+            .where(
+                table.c.student_id == row["student_id"],
+                table.c.month == row["month"],
+            )
+            .values(
+                total_paid=table.c.total_paid + row["total_paid"],
+                payment_count=table.c.payment_count + row["payment_count"],
+            )
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(table).values(**row))
+
+
+def group_costs(student_ids):
+    """Current total group cost of each existing student in ``student_ids``."""
+    rows = db.session.execute(
+        select(Student.id, func.coalesce(func.sum(Group.group_cost), 0))
+        .outerjoin(
+            student_group_association,
+            student_group_association.c.student_id == Student.id,
+        )
+        .outerjoin(Group, Group.id == student_group_association.c.group_id)
+        .where(Student.id.in_(student_ids))
+        .group_by(Student.id)
+    )
+    return dict(rows.all())
+
+
+def is_integer(value):
+    # bool is an int subclass, but JSON true/false are not amounts or ids
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _parse_payment_date(value):
+    if value is None:
+        return datetime.utcnow()
+    if not isinstance(value, str):
+        raise ValueError
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def ingest_payments(records, best_effort=False):
+    """Record many payments at once.
+
+    The group-cost snapshot of every student is computed in one aggregate
+    query and all payments are inserted with one executemany. Without
+    ``best_effort`` a single invalid record rejects the whole batch.
+
+    Returns ``(results, created)`` with one result per record, in order.
+    """
+    results = []
+    valid = []
+    student_ids = {
+        record.get("student_id")
+        for record in records
+        if isinstance(record, dict) and is_integer(record.get("student_id"))
+    }
+    costs = group_costs(student_ids) if student_ids else {}
+
+    for index, record in enumerate(records):
+        errors = {}
+        if not isinstance(record, dict):
+            results.append(
+                {
+                    "index": index,
+                    "status": "error",
+                    "errors": {"record": "must be an object"},
+                }
+            )
+            continue
+        student_id = record.get("student_id")
+        if not is_integer(student_id):
+            errors["student_id"] = "student_id is required and must be an integer"
+        elif student_id not in costs:
+            errors["student_id"] = "Student not found"
+        amount = record.get("amount")
+        if amount is None:
+            errors["amount"] = "Amount is required"
+        elif not is_integer(amount):
+            errors["amount"] = "Amount must be an integer"
+        try:
+            paid_at = _parse_payment_date(record.get("date"))
+        except ValueError:
+            errors["date"] = "date must be an ISO 8601 timestamp"
+        if errors:
+            results.append({"index": index, "status": "error", "errors": errors})
+            continue
+        row = {
+            "student_id": student_id,
+            "amount": amount,
+            "date": paid_at,
+            "group_cost_at_payment": costs[student_id],
+        }
+        results.append({"index": index, "status": "valid", "row": row})
+        valid.append(results[-1])
+
+    if len(valid) < len(results) and not best_effort:
+        for result in valid:
+            result["status"] = "skipped"
+            del result["row"]
+        return results, 0
+
+    if valid:
+        rows = [result["row"] for result in valid]
+        ids = insert_returning_ids(Payment, rows)
+        count_changes(Payment)
+        deltas = {}
+        for row in rows:
+            key = (row["student_id"], month_start(row["date"]))
+            amount, count = deltas.get(key, (0, 0))
+            deltas[key] = (amount + row["amount"], count + 1)
+        apply_ledger_deltas(deltas)
+        touch(Student, {row["student_id"] for row in rows})
+        db.session.commit()
+
+        for result, payment_id in zip(valid, ids):
+            row = result.pop("row")
+            result["status"] = "created"
+            result["payment"] = {
+                "id": payment_id,
+                "amount": row["amount"],
+                "date": row["date"].isoformat(),
+                "student_id": row["student_id"],
+                "group_cost_at_payment": row["group_cost_at_payment"],
+            }
+    return results, len(valid)
+
+
+def _ledger_from_payments(month=None):
+    bucket = month_bucket(Payment.date)
+    query = (
+        select(
+            Payment.student_id,
+            bucket.label("month"),
+            func.sum(Payment.amount).label("total_paid"),
+            func.count(Payment.id).label("payment_count"),
+        )
+        .where(Payment.date.is_not(None))
+        .group_by(Payment.student_id, bucket)
+    )
+    if month is not None:
+        start, end = month_window(month)
+        query = query.where(Payment.date >= start, Payment.date < end)
+    return query
+
+
+def _ledger_month_filter(month=None):
+    if month is None:
+        return []
+    return [StudentMonthlyBalance.month == month_start(month)]
+
+
+def rebuild_ledger(month=None):
+    """Recompute student_monthly_balance from the payments table.
+
+    With ``month`` (a datetime) only that month is rebuilt.
+    """
+    table = StudentMonthlyBalance.__table__
+    db.session.execute(delete(table).where(*_ledger_month_filter(month)))
+    db.session.execute(
+        insert(table).from_select(
+            ["student_id", "month", "total_paid", "payment_count"],
+            _ledger_from_payments(month),
+        )
+    )
+    db.session.commit()
+    return db.session.execute(
+        select(func.count()).select_from(table).where(*_ledger_month_filter(month))
+    ).scalar()
+
+
+def check_ledger(month=None):
+    """Compare the ledger with the payments table.
+
+    Returns a list of ``(student_id, month, ledger, expected)`` tuples, where
+    ledger and expected are ``(total_paid, payment_count)``. Empty means the
+    ledger is consistent.
+    """
+    expected = {}
+    for student_id, bucket, total_paid, payment_count in db.session.execute(
+        _ledger_from_payments(month)
+    ):
+        if isinstance(bucket, str):
+            bucket = datetime.strptime(bucket, "%Y-%m-%d").date()
+        expected[(student_id, bucket)] = (total_paid, payment_count)
+
+    mismatches = []
+    balances = StudentMonthlyBalance.query.filter(*_ledger_month_filter(month))
+    for balance in balances.yield_per(1000):
+        key = (balance.student_id, balance.month)
+        actual = (balance.total_paid, balance.payment_count)
+        wanted = expected.pop(key, (0, 0))
+        if actual != wanted:
+            mismatches.append((*key, actual, wanted))
+    for key, wanted in expected.items():
+        mismatches.append((*key, (0, 0), wanted))
+    return sorted(mismatches)
+
+
+def resolve_status(total_group_cost, total_payments):
+    if total_payments == 0:
+        return "PENDING", total_group_cost
+    elif total_payments < total_group_cost:
+        return "PENDING", total_group_cost - total_payments
+    return "PAID", 0
+
+
+def payment_statuses(student_filter):
+    """Payment status of every student matched by ``student_filter``.
+
+    Group costs are summed per student and joined with this month's ledger
+    row in a single query. Returns a list of dicts ordered by student id.
+    """
+    group_costs = (
+        select(
+            student_group_association.c.student_id,
+            func.sum(Group.group_cost).label("total_group_cost"),
+        )
+        .join(Group, Group.id == student_group_association.c.group_id)
+        .group_by(student_group_association.c.student_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(
+            Student.id,
+            func.coalesce(group_costs.c.total_group_cost, 0),
+            func.coalesce(StudentMonthlyBalance.total_paid, 0),
+        )
+        .outerjoin(group_costs, group_costs.c.student_id == Student.id)
+        .outerjoin(
+            StudentMonthlyBalance,
+            (StudentMonthlyBalance.student_id == Student.id)
+            & (StudentMonthlyBalance.month == month_start(datetime.utcnow())),
+        )
+        .filter(student_filter)
+        .order_by(Student.id)
+    )
+
+    statuses = []
+    for student_id, total_group_cost, total_payments in rows:
+        status, pending_amount = resolve_status(total_group_cost, total_payments)
+        statuses.append(
+            {
+                "student_id": student_id,
+                "status": status,
+                "pending_amount": pending_amount,
+            }
+        )
+    return statuses
+
+
+BILLING_STATEMENT_COLUMNS = [
+    "student_id",
+    "student_name",
+    "parent_phone_number",
+    "groups",
+    "total_group_cost",
+    "amount_paid",
+    "pending_amount",
+    "status",
+]
+
+
+def billing_statement_query(month):
+    """One row per student: name, phone, group titles (alphabetical, joined
+    with "; "), total group cost and the amount paid in ``month``."""
+    sqlite_bind = db.session.get_bind().dialect.name == "sqlite"
+    memberships = select(
+        student_group_association.c.student_id, Group.title, Group.group_cost
+    ).join(Group, Group.id == student_group_association.c.group_id)
+    if sqlite_bind:
+        # group_concat() keeps the order in which rows reach it
+        memberships = memberships.order_by(
+            student_group_association.c.student_id, Group.title
+        )
+    memberships = memberships.subquery()
+    if sqlite_bind:
+        titles = func.group_concat(memberships.c.title, "; ")
+    else:
+        titles = func.string_agg(
+            memberships.c.title, aggregate_order_by(literal("; "), memberships.c.title)
+        )
+    groups = (
+        select(
+            memberships.c.student_id,
+            titles.label("titles"),
+            func.sum(memberships.c.group_cost).label("total_group_cost"),
+        )
+        .group_by(memberships.c.student_id)
+        .subquery()
+    )
+    return (
+        select(
+            Student.id,
+            Student.name,
+            Student.parent_phone_number,
+            func.coalesce(groups.c.titles, ""),
+            func.coalesce(groups.c.total_group_cost, 0),
+            func.coalesce(StudentMonthlyBalance.total_paid, 0),
+        )
+        .outerjoin(groups, groups.c.student_id == Student.id)
+        .outerjoin(
+            StudentMonthlyBalance,
+            (StudentMonthlyBalance.student_id == Student.id)
+            & (StudentMonthlyBalance.month == month_start(month)),
+        )
+        .order_by(Student.id)
+    )
+
+
+def billing_statement(month, batch_size=STREAM_BATCH_SIZE):
+    """Rows of the billing statement for ``month`` (a datetime), matching
+    BILLING_STATEMENT_COLUMNS, in batches of ``batch_size``.
+
+    The rows come from one query read through a server-side cursor, so only
+    one batch is held in memory at a time.
+    """
+    result = db.session.execute(
+        billing_statement_query(month).execution_options(yield_per=batch_size)
+    )
+    for partition in result.partitions():
+        batch = []
+        for student_id, name, phone, titles, total_group_cost, paid in partition:
+            status, pending_amount = resolve_status(total_group_cost, paid)
+            batch.append(
+                [
+                    student_id,
+                    name,
+                    phone,
+                    titles,
+                    total_group_cost,
+                    paid,
+                    pending_amount,
+                    status,
+                ]
+            )
+        yield batch
@@ -0,0 +1,370 @@
+# cache.py
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, g, make_response, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import Group, Student, Payment
+from routing import pinned, read_from_replica
+
+# "memory" for a per-process LRU, a redis:// URL for a shared cache, or
+# "none" to disable response caching.
+CACHE_URL = os.getenv("CACHE_URL", "memory")
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", 1024))
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "sta:")
+
+# Invalidating this tag drops every entry
+ALL = "*"
+
+# Response headers replayed on a cache hit
+CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Vary")
+
+
+def collection_tag(model):
+    return model.__tablename__
+
+
+def entity_tag(model, id):
+    return f"{model.__tablename__}:{id}"
+
+
+class MemoryBackend:
+    """Bounded in-process LRU with a tag index for invalidation."""
+
+    name = "memory"
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[2]:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, tags):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, tags, time.monotonic() + self.ttl)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            self._generation += 1
+            if ALL in tags:
+                removed = len(self._entries)
+                self._entries.clear()
+                self._tags.clear()
+                return removed
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def generation(self):
+        return self._generation
+
+    def clear(self):
+        self.invalidate({ALL})
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Cache shared between processes through a redis-py client.
+
+    Each tag is a Redis set holding the keys of the entries it covers. An
+    entry and its tags are written in one pipelined transaction, and tag
+    sets expire with the entries they list.
+    """
+
+    name = "redis"
+
+    def __init__(self, client, ttl=CACHE_TTL, prefix=CACHE_KEY_PREFIX):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points at Redis; install the redis package")
+        return cls(redis.Redis.from_url(url))
+
+    def _entry(self, key):
+        return f"{self.prefix}entry:{key}"
+
+    def _tag(self, tag):
+        return f"{self.prefix}tag:{tag}"
+
+    def get(self, key):
+        return self.client.get(self._entry(key))
+
+    def set(self, key, value, tags):
+        entry = self._entry(key)
+        pipe = self.client.pipeline()
+        pipe.set(entry, value, ex=self.ttl)
+        for tag in tags:
+            pipe.sadd(self._tag(tag), entry)
+            pipe.expire(self._tag(tag), self.ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        self.client.incr(f"{self.prefix}generation")
+        if ALL in tags:
+            keys = list(self.client.scan_iter(match=f"{self.prefix}entry:*"))
+            tag_keys = list(self.client.scan_iter(match=f"{self.prefix}tag:*"))
+        else:
+            keys = set()
+            tag_keys = [self._tag(tag) for tag in tags]
+            for tag_key in tag_keys:
+                keys |= self.client.smembers(tag_key)
+            keys = list(keys)
+        if keys or tag_keys:
+            self.client.delete(*keys, *tag_keys)
+        return len(keys)
+
+    def generation(self):
+        return int(self.client.get(f"{self.prefix}generation") or 0)
+
+    def clear(self):
+        self.invalidate({ALL})
+
+    def size(self):
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.prefix}entry:*"))
+
+
+def backend_from_url(url=CACHE_URL):
+    if url == "none":
+        return None
+    if url == "memory":
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+class ResponseCache:
+    """Caches successful JSON responses of read endpoints.
+
+    Entries are keyed by endpoint, URL parameters, query string, Accept header
+    and the caller's permissions. A view opts a response in by calling
+    ``cache_tags()`` with the entities it was built from; a commit that
+    touches any of them drops the entry (see the session listeners below).
+
+    With read replicas, only responses built from the primary are stored: a
+    lagging replica can still return what a write has just invalidated.
+    Clients pinned to the primary after a write (read-your-writes) bypass
+    the cache altogether.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _key(payload):
+        scope = sorted(payload.get("permissions", []))
+        parts = (
+            request.endpoint,
+            sorted((request.view_args or {}).items()),
+            sorted(request.args.items(multi=True)),
+            request.headers.get("Accept"),
+            scope,
+        )
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+        return f"{request.endpoint}:{digest}"
+
+    def _load(self, value):
+        entry = json.loads(value)
+        response = Response(entry["body"], status=entry["status"])
+        for name, header in entry["headers"]:
+            response.headers[name] = header
+        response.headers["X-Cache"] = "HIT"
+        # As Validators.not_modified: only If-None-Match yields a 304
+        environ = dict(request.environ)
+        environ.pop("HTTP_IF_MODIFIED_SINCE", None)
+        return response.make_conditional(environ)
+
+    def _store(self, key, response, tags):
+        entry = {
+            "status": response.status_code,
+            "headers": [
+                [name, response.headers[name]]
+                for name in CACHED_HEADERS
+                if name in response.headers
+            ],
+            "body": response.get_data(as_text=True),
+        }
+        self.backend.set(key, json.dumps(entry), sorted(tags))
+        self.stores += 1
+
+    def _lookup(self, payload):
+        key = self._key(payload)
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return key, self._load(value)
+        self.misses += 1
+        g.cache_tags = None
+        return key, None
+
+    def _finish(self, key, generation, rv):
+        response = make_response(rv)
+        response.headers["X-Cache"] = "MISS"
+        tags = g.pop("cache_tags", None)
+        # Skip the store if a write committed while the response was
+        # being built; it may already be stale.
+        if (
+            tags
+            and response.status_code == 200
+            and not response.is_streamed
+            and not read_from_replica()
+            and self.backend.generation() == generation
+        ):
+            self._store(key, response, tags)
+        return response
+
+    def cached(self, f):
+        """Decorator for views wrapped by ``requires_auth`` or, for coroutine
+        views, ``requires_auth_async``."""
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_wrapper(payload, *args, **kwargs):
+                if self.backend is None or pinned():
+                    return await f(payload, *args, **kwargs)
+                key, hit = self._lookup(payload)
+                if hit is not None:
+                    return hit
+                generation = self.backend.generation()
+                return self._finish(key, generation, await f(payload, *args, **kwargs))
+
+            return async_wrapper
+
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            # Profiled requests always run the view
+            if self.backend is None or g.get("profiling") or pinned():
+                return f(payload, *args, **kwargs)
+            key, hit = self._lookup(payload)
+            if hit is not None:
+                return hit
+            generation = self.backend.generation()
+            return self._finish(key, generation, f(payload, *args, **kwargs))
+
+        return wrapper
+
+    def invalidate(self, tags):
+        if self.backend is None or not tags:
+            return
+        self.invalidations += 1
+        self.evicted += self.backend.invalidate(tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+            "evicted": self.evicted,
+            "size": self.backend.size() if self.backend is not None else 0,
+        }
+
+
+response_cache = ResponseCache(backend_from_url())
+
+
+def cache_tags(*tags):
+    """Mark the response being built as cacheable under ``tags``."""
+    if g.get("cache_tags") is None:
+        g.cache_tags = set()
+    g.cache_tags.update(tags)
+
+
+# Write-driven invalidation. Tags of everything a transaction flushes are
+# collected in session.info and dropped from the cache once it commits.
+# Core-level inserts (bulk imports) only create rows no cached response
+# refers to yet; the memberships they add re-stamp the groups via touch().
+
+
+def _pending(session):
+    return session.info.setdefault("cache_tags", set())
+
+
+def _instance_tags(instance):
+    tags = {collection_tag(type(instance)), entity_tag(type(instance), instance.id)}
+    if isinstance(instance, Payment) and instance.student_id is not None:
+        tags.add(entity_tag(Student, instance.student_id))
+    return tags
+
+
+@event.listens_for(Session, "after_flush")
+def collect_flushed(session, flush_context):
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, (Group, Student, Payment)):
+            _pending(session).update(_instance_tags(instance))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed(session):
+    tags = session.info.pop("cache_tags", set())
+    # Rows re-stamped by versioning.touch() after a Core-level write
+    for model, id in session.info.pop("touched", ()):
+        tags |= {collection_tag(model), entity_tag(model, id)}
+    if tags:
+        response_cache.invalidate(tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_rolled_back(session):
+    session.info.pop("cache_tags", None)
+    session.info.pop("touched", None)
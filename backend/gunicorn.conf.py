@@ -0,0 +1,132 @@
+# gunicorn.conf.py
+#
+# Production serving profile, loaded by the Procfile:
+#
+#   web: cd backend && gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master and forked into the workers. Each
+# worker drops the database connections it inherited, then fetches the Auth0
+# signing keys and opens its connection pool before it accepts a request.
+# Workers are replaced after a jittered number of requests.
+#
+# Settings are read from the environment; see README.md.
+import glob
+import multiprocessing
+import os
+import sys
+import tempfile
+
+
+def _flag(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+CPUS = multiprocessing.cpu_count()
+
+workers = int(os.getenv("WEB_CONCURRENCY", CPUS * 2 + 1))
+# Requests served at once by each worker; they share the worker's pool
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+preload_app = _flag("GUNICORN_PRELOAD", "1")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+# Spread out the restarts of workers that started together
+max_requests_jitter = int(
+    os.getenv("GUNICORN_MAX_REQUESTS_JITTER", max(max_requests // 10, 1))
+)
+if os.path.isdir("/dev/shm"):
+    # Worker heartbeats; a disk-backed /tmp can stall them
+    worker_tmp_dir = "/dev/shm"
+
+# One connection per thread, unless configured. Read by pooling.py, which
+# the app imports after this file.
+os.environ.setdefault("DB_POOL_SIZE", str(threads))
+
+# Per-process state is not shared between workers: an invalidation or a
+# read-your-writes pin would only reach the worker that handled the write.
+# The in-memory response cache is turned off, and pins have to be in Redis.
+if workers > 1:
+    if os.getenv("CACHE_URL", "memory") == "memory":
+        os.environ["CACHE_URL"] = "none"
+    if (
+        os.getenv("DATABASE_REPLICA_URLS")
+        and float(os.getenv("READ_YOUR_WRITES_SECONDS", 0)) > 0
+        and os.getenv("READ_YOUR_WRITES_URL", "memory") == "memory"
+    ):
+        raise RuntimeError(
+            "READ_YOUR_WRITES_URL must point at Redis when running several workers"
+        )
+
+# Several workers need the multiprocess metrics registry, configured before
+# prometheus_client is imported. Samples from a previous run are removed.
+if workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(
+        prefix="student_track_metrics_"
+    )
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(path)
+
+
+def _engines():
+    from app import app, db
+    from routing import replicas
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    engines += replicas.engines
+    if "asgi" in sys.modules:
+        engines += [
+            engine.sync_engine
+            for engine in sys.modules["asgi"].async_db.engines.values()
+        ]
+    return engines
+
+
+def when_ready(server):
+    # The master serves no requests; close anything it opened while loading
+    # the app (DB_POOL_WARMUP) instead of holding it for its lifetime
+    if not server.cfg.preload_app:
+        return
+    for engine in _engines():
+        engine.dispose()
+
+
+def post_fork(server, worker):
+    # Connections inherited from the master are shared with every other
+    # worker. Forget them without closing them; the worker opens its own.
+    if not server.cfg.preload_app:
+        return
+    for engine in _engines():
+        engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    import auth
+    from sqlalchemy.exc import SQLAlchemyError
+    from app import app, db
+    from pooling import DB_POOL_WARMUP, warm_up
+    from routing import replicas
+
+    try:
+        auth.jwks_cache.refresh()
+    except auth.AuthError:
+        worker.log.warning("JWKS prefetch failed; retrying on the first request")
+
+    count = DB_POOL_WARMUP or threads
+    try:
+        with app.app_context():
+            warm_up(db.engine, count)
+        if replicas.urls:
+            replicas.start()
+            for engine, healthy in zip(replicas.engines, replicas.healthy):
+                if healthy:
+                    warm_up(engine, count)
+    except SQLAlchemyError as e:
+        worker.log.warning("Connection pool warm-up failed: %s", e)
+
+
+def child_exit(server, worker):
+    from metrics import child_exit
+
+    child_exit(server, worker)
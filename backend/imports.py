@@ -0,0 +1,154 @@
+# imports.py
+import csv
+import io
+import json
+from sqlalchemy import insert, select
+from models import (
+    db,
+    Group,
+    Student,
+    insert_returning_ids,
+    student_group_association,
+)
+from versioning import count_changes, touch
+
+NAME_MAX_LENGTH = Student.__table__.c.name.type.length
+PHONE_MAX_LENGTH = Student.__table__.c.parent_phone_number.type.length
+INSERT_BATCH_SIZE = 1000
+
+
+class StudentImportError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+
+
+def parse_csv(text):
+    """Read students from CSV with name, parent_phone_number and an optional
+    group_ids column holding ids separated by ``;``."""
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        row = {
+            "name": record.get("name"),
+            "parent_phone_number": record.get("parent_phone_number"),
+        }
+        group_ids = (record.get("group_ids") or "").strip()
+        if group_ids:
+            row["group_ids"] = [_csv_id(value) for value in group_ids.split(";")]
+        rows.append(row)
+    return rows
+
+
+def _csv_id(value):
+    # Digits become an id; anything else is left for validation to reject
+    value = value.strip()
+    return int(value) if value.isascii() and value.isdigit() else value
+
+
+def parse_json(text):
+    rows = json.loads(text)
+    if not isinstance(rows, list):
+        raise ValueError("Expected a JSON array of students")
+    return rows
+
+
+def _validate_text(row, field, max_length, errors):
+    value = row.get(field)
+    if not isinstance(value, str) or not value.strip():
+        errors[field] = f"{field} is required and cannot be blank"
+        return None
+    value = value.strip()
+    if len(value) > max_length:
+        errors[field] = f"{field} must be at most {max_length} characters"
+        return None
+    return value
+
+
+def validate_students(rows):
+    """Validate every row before anything is written.
+
+    Returns the cleaned rows, or raises StudentImportError with one entry per
+    invalid row (``row`` is 1-based).
+    """
+    referenced = set()
+    cleaned = []
+    errors = {}
+    for number, row in enumerate(rows, start=1):
+        row_errors = {}
+        if not isinstance(row, dict):
+            errors[number] = {"row": "must be an object"}
+            cleaned.append({"group_ids": []})
+            continue
+        name = _validate_text(row, "name", NAME_MAX_LENGTH, row_errors)
+        phone = _validate_text(row, "parent_phone_number", PHONE_MAX_LENGTH, row_errors)
+        group_ids = row.get("group_ids") or []
+        # Checked, not coerced: 1.9, "1" or true are not group ids
+        if isinstance(group_ids, list) and all(
+            isinstance(group_id, int) and not isinstance(group_id, bool)
+            for group_id in group_ids
+        ):
+            group_ids = sorted(set(group_ids))
+        else:
+            row_errors["group_ids"] = "group_ids must be a list of integers"
+            group_ids = []
+        if row_errors:
+            errors[number] = row_errors
+        referenced.update(group_ids)
+        cleaned.append(
+            {"name": name, "parent_phone_number": phone, "group_ids": group_ids}
+        )
+
+    if referenced:
+        existing = set(
+            db.session.scalars(select(Group.id).where(Group.id.in_(referenced)))
+        )
+        missing = referenced - existing
+        if missing:
+            for number, row in enumerate(cleaned, start=1):
+                unknown = sorted(set(row["group_ids"]) & missing)
+                if unknown:
+                    row_errors = errors.setdefault(number, {})
+                    row_errors["group_ids"] = f"Groups not found: {unknown}"
+
+    if errors:
+        raise StudentImportError(
+            [{"row": number, "errors": errors[number]} for number in sorted(errors)]
+        )
+    return cleaned
+
+
+def import_students(rows):
+    """Insert validated rows and their group memberships in one transaction.
+
+    Returns the new student ids in input order.
+    """
+    rows = validate_students(rows)
+    student_ids = []
+    try:
+        for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[offset : offset + INSERT_BATCH_SIZE]
+            ids = insert_returning_ids(
+                Student,
+                [
+                    {
+                        "name": row["name"],
+                        "parent_phone_number": row["parent_phone_number"],
+                    }
+                    for row in batch
+                ],
+            )
+            memberships = [
+                {"student_id": student_id, "group_id": group_id}
+                for student_id, row in zip(ids, batch)
+                for group_id in row["group_ids"]
+            ]
+            if memberships:
+                db.session.execute(insert(student_group_association), memberships)
+                touch(Group, {row["group_id"] for row in memberships})
+            student_ids.extend(ids)
+        if student_ids:
+            count_changes(Student)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return student_ids
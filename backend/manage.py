@@ -1,11 +1,34 @@
 # manage.py
+import click
+from datetime import datetime
 from flask.cli import FlaskGroup
 from app import app, db
 from models import Group, Student, Payment
+from billing import (
+    BILLING_STATEMENT_COLUMNS,
+    billing_statement,
+    check_ledger,
+    parse_month,
+    rebuild_ledger,
+)
+from imports import StudentImportError, import_students, parse_csv, parse_json
+from revenue import rollup_revenue
+from arrears import AGING_BUCKETS, arrears_report
+from streaming import csv_chunks
 
 cli = FlaskGroup(app)
 
 
+def _month(ctx, param, value):
+    # Click callback: parse a YYYY-MM option into a datetime
+    if value is None:
+        return None
+    try:
+        return parse_month(value)
+    except ValueError:
+        raise click.BadParameter(f"{value!r} is not a month in YYYY-MM format")
+
+
 @cli.command("create_tables")
 def create_tables():
     with app.app_context():
@@ -13,5 +36,122 @@ def create_tables():
     print("Tables created successfully.")
 
 
+@cli.command("rebuild_ledger")
+@click.option("--month", callback=_month, help="Only rebuild this month (YYYY-MM).")
+def rebuild_ledger_command(month):
+    with app.app_context():
+        rows = rebuild_ledger(month)
+    print(f"Ledger rebuilt: {rows} student-month balances.")
+
+
+@cli.command("check_ledger")
+@click.option("--month", callback=_month, help="Only check this month (YYYY-MM).")
+def check_ledger_command(month):
+    with app.app_context():
+        mismatches = check_ledger(month)
+    if not mismatches:
+        print("Ledger is consistent with payments.")
+        return
+    for student_id, month, ledger, expected in mismatches:
+        print(
+            f"student {student_id} {month:%Y-%m}: "
+            f"ledger total={ledger[0]} count={ledger[1]}, "
+            f"payments total={expected[0]} count={expected[1]}"
+        )
+    raise SystemExit(f"{len(mismatches)} ledger rows do not match payments.")
+
+
+@cli.command("billing_report")
+@click.option(
+    "--month",
+    callback=_month,
+    help="Month to report (YYYY-MM), default the current one.",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.File("w"),
+    default="-",
+    help="CSV file, default stdout.",
+)
+def billing_report_command(month, output):
+    month = month or datetime.utcnow()
+    with app.app_context():
+        for chunk in csv_chunks(BILLING_STATEMENT_COLUMNS, billing_statement(month)):
+            output.write(chunk)
+
+
+@cli.command("rollup_revenue")
+@click.option(
+    "--month", callback=_month, help="Recompute this closed month only (YYYY-MM)."
+)
+@click.option(
+    "--since",
+    callback=_month,
+    help="Backfill every closed month from this one on (YYYY-MM).",
+)
+def rollup_revenue_command(month, since):
+    if month and since:
+        raise click.UsageError("Use either --month or --since")
+    with app.app_context():
+        try:
+            months = rollup_revenue(month, since)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    if not months:
+        print("Revenue rollup is up to date.")
+        return
+    print(
+        f"Revenue rolled up for {len(months)} months: "
+        f"{months[0]:%Y-%m} to {months[-1]:%Y-%m}."
+    )
+    if since:
+        print(
+            "Backfilled months use today's memberships and group costs: their "
+            "expected revenue and member counts are approximate."
+        )
+
+
+@cli.command("arrears_report")
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=50,
+    help="Students listed, most owed first.",
+)
+def arrears_report_command(limit):
+    with app.app_context():
+        report = arrears_report(datetime.utcnow(), limit)
+    columns = [label for label, _ in AGING_BUCKETS] + ["total"]
+    print(f"Arrears as of {report['as_of']}, {report['students']} students owing.")
+    print(f"{'student':>8}  {'name':<30}" + "".join(f"{c:>10}" for c in columns))
+    for item in report["items"]:
+        print(
+            f"{item['student_id']:>8}  {item['name'][:30]:<30}"
+            + "".join(f"{item[c]:>10}" for c in columns)
+        )
+    print(
+        f"{'':>8}  {'total':<30}"
+        + "".join(f"{report['totals'][c]:>10}" for c in columns)
+    )
+
+
+@cli.command("import_students")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_students_command(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    rows = parse_csv(text) if path.lower().endswith(".csv") else parse_json(text)
+    with app.app_context():
+        try:
+            student_ids = import_students(rows)
+        except StudentImportError as e:
+            for error in e.errors:
+                details = "; ".join(error["errors"].values())
+                print(f"row {error['row']}: {details}")
+            raise SystemExit(f"{len(e.errors)} invalid rows, nothing imported.")
+    print(f"Imported {len(student_ids)} students.")
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,97 @@
+# memberships.py
+from sqlalchemy import delete, insert, select
+from models import db, Group, Student, student_group_association
+from billing import UPSERT_DIALECTS
+from versioning import touch
+
+association = student_group_association
+OWNER_MODELS = {"student_id": Student, "group_id": Group}
+
+
+class MembershipError(Exception):
+    def __init__(self, missing):
+        self.missing = missing
+
+
+def _insert_memberships(rows):
+    upsert = UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if upsert is not None:
+        db.session.execute(upsert(association).on_conflict_do_nothing(), rows)
+    else:
+        db.session.execute(insert(association), rows)
+
+
+def _sync(owner_column, owner_id, member_column, member_model, member_ids, strict):
+    wanted = set(member_ids)
+    existing = set()
+    if wanted:
+        existing = set(
+            db.session.scalars(
+                select(member_model.id).where(member_model.id.in_(wanted))
+            )
+        )
+    missing = wanted - existing
+    if missing and strict:
+        raise MembershipError(sorted(missing))
+
+    current = set(
+        db.session.scalars(select(member_column).where(owner_column == owner_id))
+    )
+    added = existing - current
+    removed = current - wanted
+    if removed:
+        db.session.execute(
+            delete(association).where(
+                owner_column == owner_id, member_column.in_(removed)
+            )
+        )
+    if added:
+        _insert_memberships(
+            [
+                {owner_column.key: owner_id, member_column.key: member_id}
+                for member_id in sorted(added)
+            ]
+        )
+    changed = added | removed
+    if changed:
+        touch(member_model, changed)
+        touch(OWNER_MODELS[owner_column.key], [owner_id])
+    return {
+        "member_ids": sorted(existing),
+        "added": sorted(added),
+        "removed": sorted(removed),
+    }
+
+
+def sync_student_groups(student_id, group_ids, strict=True):
+    """Make the student's groups exactly ``group_ids``.
+
+    Only the association rows that differ are inserted or deleted. With
+    ``strict`` unknown group ids raise MembershipError before any change;
+    otherwise they are ignored.
+    """
+    return _sync(
+        association.c.student_id,
+        student_id,
+        association.c.group_id,
+        Group,
+        group_ids,
+        strict,
+    )
+
+
+def sync_group_students(group_id, student_ids, strict=True):
+    """Make the group's students exactly ``student_ids``."""
+    return _sync(
+        association.c.group_id,
+        group_id,
+        association.c.student_id,
+        Student,
+        student_ids,
+        strict,
+    )
+
+
+def add_membership(student_id, group_id):
+    """Add one membership, doing nothing if it already exists."""
+    _insert_memberships([{"student_id": student_id, "group_id": group_id}])
@@ -0,0 +1,162 @@
+# metrics.py
+import os
+import time
+from flask import Response, g, has_request_context, jsonify, request
+from flask import request_finished, request_started
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Set by the process manager before start-up for multi-worker servers; each
+# worker then writes its samples to files in this directory and /metrics
+# aggregates them.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+LABELS = ("method", "endpoint")
+
+REQUESTS = Counter(
+    "http_requests", "Requests handled", ("method", "endpoint", "status")
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to build the response", LABELS
+)
+SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements",
+    "SQL statements executed per request",
+    LABELS,
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, float("inf")),
+)
+SQL_DURATION = Histogram(
+    "http_request_sql_duration_seconds",
+    "Time spent executing SQL per request",
+    LABELS,
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "Size of non-streamed response bodies",
+    LABELS,
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, float("inf")),
+)
+JWT_DURATION = Histogram(
+    "jwt_verification_duration_seconds",
+    "Time spent verifying the bearer token",
+    ("token_cache",),
+    buckets=(0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25, 1),
+)
+
+# Connection pools, labelled by pool_logging_name (see pooling.py)
+POOL_CHECKOUTS = Counter(
+    "db_pool_checkouts", "Connections checked out of the pool", ("pool",)
+)
+POOL_OVERFLOW_CHECKOUTS = Counter(
+    "db_pool_overflow_checkouts",
+    "Checkouts that left the pool using overflow connections",
+    ("pool",),
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts", "Checkouts that gave up after the pool timeout", ("pool",)
+)
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    ("pool",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out",
+    ("pool",),
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_in_use",
+    "Checked-out connections beyond the pool size",
+    ("pool",),
+    multiprocess_mode="livesum",
+)
+REPLICA_HEALTHY = Gauge(
+    "db_replica_healthy",
+    "1 if the read replica passed its last health check",
+    ("pool",),
+    multiprocess_mode="livemin",
+)
+
+
+def _endpoint():
+    return request.endpoint or "<unmatched>"
+
+
+def _started(sender, **extra):
+    g.metrics_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+
+def _finished(sender, response, **extra):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    labels = (request.method, _endpoint())
+    REQUEST_DURATION.labels(*labels).observe(time.perf_counter() - start)
+    REQUESTS.labels(*labels, str(response.status_code)).inc()
+    SQL_STATEMENTS.labels(*labels).observe(g.sql_statements)
+    SQL_DURATION.labels(*labels).observe(g.sql_seconds)
+    # Streamed bodies (stream=1, NDJSON) are still being written here; their
+    # size and any SQL they run afterwards are not counted.
+    if response.content_length is not None:
+        RESPONSE_SIZE.labels(*labels).observe(response.content_length)
+    if "auth_seconds" in g:
+        cache = "hit" if g.get("token_cache_hit") else "miss"
+        JWT_DURATION.labels(cache).observe(g.auth_seconds)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info["metrics_query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    start = conn.info.pop("metrics_query_start", None)
+    if start is None or not has_request_context() or "metrics_start" not in g:
+        return
+    g.sql_statements += 1
+    g.sql_seconds += time.perf_counter() - start
+
+
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != (
+        f"Bearer {METRICS_TOKEN}"
+    ):
+        return jsonify({"error": "Unauthorized"}), 401
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def instrument(app):
+    """Record per-request metrics for ``app`` and serve them at /metrics."""
+    request_started.connect(_started, app)
+    request_finished.connect(_finished, app)
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+def child_exit(server, worker):
+    """gunicorn ``child_exit`` hook: drop the live-gauge files of a dead
+    worker in multiprocess mode."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,63 @@
+"""add student_monthly_balance payment ledger
+
+Revision ID: 1d6a8e3c5b74
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d6a8e3c5b74'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+payments = sa.table(
+    'payments',
+    sa.column('student_id', sa.Integer),
+    sa.column('amount', sa.Integer),
+    sa.column('date', sa.DateTime),
+)
+
+
+def month_bucket(bind, column):
+    if bind.dialect.name == 'sqlite':
+        return sa.func.date(column, 'start of month')
+    return sa.cast(sa.func.date_trunc('month', column), sa.Date)
+
+
+def upgrade():
+    bind = op.get_bind()
+    # The table may already exist from `manage.py create_tables`, in which
+    # case `manage.py rebuild_ledger` fills it.
+    if 'student_monthly_balance' in sa.inspect(bind).get_table_names():
+        return
+    ledger = op.create_table(
+        'student_monthly_balance',
+        sa.Column('student_id', sa.Integer(), sa.ForeignKey('students.id'), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('total_paid', sa.Integer(), nullable=False),
+        sa.Column('payment_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('student_id', 'month'),
+    )
+    bucket = month_bucket(bind, payments.c.date)
+    op.execute(
+        ledger.insert().from_select(
+            ['student_id', 'month', 'total_paid', 'payment_count'],
+            sa.select(
+                payments.c.student_id,
+                bucket,
+                sa.func.sum(payments.c.amount),
+                sa.func.count(),
+            )
+            .where(payments.c.date.is_not(None))
+            .group_by(payments.c.student_id, bucket),
+        )
+    )
+
+
+def downgrade():
+    op.drop_table('student_monthly_balance')
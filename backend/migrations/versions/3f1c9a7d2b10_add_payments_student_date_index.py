@@ -0,0 +1,32 @@
+"""add (student_id, date) index on payments
+
+Revision ID: 3f1c9a7d2b10
+Revises: 1d6a8e3c5b74
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b10'
+down_revision = '1d6a8e3c5b74'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tables may already exist from `manage.py create_tables`, which also
+    # creates this index on new databases.
+    op.create_index(
+        'ix_payments_student_id_date',
+        'payments',
+        ['student_id', 'date'],
+        unique=False,
+        if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_index('ix_payments_student_id_date', table_name='payments', if_exists=True)
@@ -0,0 +1,38 @@
+"""add group_monthly_revenue rollup table
+
+Revision ID: 5e9b2f7a4c16
+Revises: c41d7e9a2f58
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9b2f7a4c16'
+down_revision = 'c41d7e9a2f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `manage.py rollup_revenue`; the table may already exist from
+    # `manage.py create_tables`.
+    if 'group_monthly_revenue' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'group_monthly_revenue',
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('group_cost', sa.Integer(), nullable=False),
+        sa.Column('member_count', sa.Integer(), nullable=False),
+        sa.Column('expected_revenue', sa.Integer(), nullable=False),
+        sa.Column('collected_revenue', sa.Numeric(14, 2), nullable=False),
+        sa.PrimaryKeyConstraint('month', 'group_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('group_monthly_revenue')
@@ -0,0 +1,36 @@
+"""add version change stamps to groups, students and payments
+
+Revision ID: 8b2e4d6f1a37
+Revises: 3f1c9a7d2b10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6f1a37'
+down_revision = '3f1c9a7d2b10'
+branch_labels = None
+depends_on = None
+
+TABLES = ('groups', 'students', 'payments')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        columns = {column['name'] for column in inspector.get_columns(table)}
+        if 'version' in columns:
+            continue
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(
+                sa.Column('version', sa.BigInteger(), nullable=False, server_default='0')
+            )
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
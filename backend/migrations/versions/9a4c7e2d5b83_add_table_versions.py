@@ -0,0 +1,42 @@
+"""add table_versions change counters
+
+Revision ID: 9a4c7e2d5b83
+Revises: 5e9b2f7a4c16
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c7e2d5b83'
+down_revision = '5e9b2f7a4c16'
+branch_labels = None
+depends_on = None
+
+TABLES = ('groups', 'students', 'payments')
+
+
+def upgrade():
+    # The table may already exist from `manage.py create_tables`
+    if 'table_versions' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'table_versions',
+            sa.Column('table_name', sa.String(length=50), nullable=False),
+            sa.Column('changes', sa.BigInteger(), nullable=False),
+            sa.Column('version', sa.BigInteger(), nullable=False),
+            sa.PrimaryKeyConstraint('table_name'),
+        )
+    # Start each counter from the newest stamp already in its table
+    for table in TABLES:
+        op.execute(
+            f"INSERT INTO table_versions (table_name, changes, version) "
+            f"SELECT '{table}', 0, COALESCE(MAX(version), 0) FROM {table} "
+            f"WHERE NOT EXISTS "
+            f"(SELECT 1 FROM table_versions WHERE table_name = '{table}')"
+        )
+
+
+def downgrade():
+    op.drop_table('table_versions')
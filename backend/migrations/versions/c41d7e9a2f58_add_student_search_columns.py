@@ -0,0 +1,99 @@
+"""add normalized search columns and indexes to students
+
+Revision ID: c41d7e9a2f58
+Revises: 8b2e4d6f1a37
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from models import search_digits, search_text
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a2f58'
+down_revision = '8b2e4d6f1a37'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 5000
+
+students = sa.table(
+    'students',
+    sa.column('id', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('parent_phone_number', sa.String),
+    sa.column('search_name', sa.String),
+    sa.column('search_phone', sa.String),
+)
+
+
+def backfill(bind):
+    # Normalization strips accents, which SQL lower() cannot do portably.
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(students.c.id, students.c.name, students.c.parent_phone_number)
+            .where(students.c.id > last_id)
+            .order_by(students.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            return
+        bind.execute(
+            students.update()
+            .where(students.c.id == sa.bindparam('row_id'))
+            .values(
+                search_name=sa.bindparam('row_name'),
+                search_phone=sa.bindparam('row_phone'),
+            ),
+            [
+                {
+                    'row_id': row.id,
+                    'row_name': search_text(row.name),
+                    'row_phone': search_digits(row.parent_phone_number),
+                }
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+
+def upgrade():
+    bind = op.get_bind()
+    columns = {column['name'] for column in sa.inspect(bind).get_columns('students')}
+    if 'search_name' not in columns:
+        with op.batch_alter_table('students') as batch_op:
+            batch_op.add_column(
+                sa.Column('search_name', sa.String(length=80), nullable=False, server_default='')
+            )
+            batch_op.add_column(
+                sa.Column('search_phone', sa.String(length=20), nullable=False, server_default='')
+            )
+        backfill(bind)
+
+    if bind.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in ('search_name', 'search_phone'):
+            op.create_index(
+                f'ix_students_{column}_trgm',
+                'students',
+                [column],
+                postgresql_using='gin',
+                postgresql_ops={column: 'gin_trgm_ops'},
+                if_not_exists=True,
+            )
+    else:
+        for column in ('search_name', 'search_phone'):
+            op.create_index(f'ix_students_{column}', 'students', [column], if_not_exists=True)
+
+
+def downgrade():
+    bind = op.get_bind()
+    suffix = '_trgm' if bind.dialect.name == 'postgresql' else ''
+    for column in ('search_name', 'search_phone'):
+        op.drop_index(f'ix_students_{column}{suffix}', table_name='students', if_exists=True)
+    with op.batch_alter_table('students') as batch_op:
+        batch_op.drop_column('search_phone')
+        batch_op.drop_column('search_name')
@@ -1,8 +1,69 @@
 # models.py
 from flask_sqlalchemy import SQLAlchemy
+from collections import defaultdict, deque
+from sqlalchemy import DDL, event, insert
+from sqlalchemy.orm import validates
 from datetime import datetime
+import re
+import threading
+import time
+import unicodedata
+from routing import RoutingSession
+
+# GET requests read from a replica when DATABASE_REPLICA_URLS is set
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+_stamp_lock = threading.Lock()
+_last_stamp = 0
+
+
+def change_stamp():
+    """Monotonic change stamp: microseconds since the epoch, never repeating
+    within a process. Stored in ``version`` columns on every write."""
+    global _last_stamp
+    with _stamp_lock:
+        _last_stamp = max(time.time_ns() // 1000, _last_stamp + 1)
+        return _last_stamp
+
+
+def insert_returning_ids(model, rows):
+    """Insert ``rows`` (dicts with the same keys) with batched
+    ``INSERT ... RETURNING`` and return the new ids in the order of ``rows``.
+
+    Returned rows are matched back to the input by their values rather than
+    with ``sort_by_parameter_order``, which SQLite can only honour one row
+    per statement. Rows with equal values are interchangeable.
+    """
+    if not rows:
+        return []
+    columns = [getattr(model, key) for key in rows[0]]
+    ids = defaultdict(deque)
+    for id, *values in db.session.execute(
+        insert(model).returning(model.id, *columns), rows
+    ):
+        ids[tuple(values)].append(id)
+    return [ids[tuple(row.values())].popleft() for row in rows]
+
+
+def search_text(value):
+    """Lowercased, accent-free text with single spaces, as stored in
+    ``Student.search_name`` and matched by student search."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+def search_digits(value):
+    return re.sub(r"\D", "", value or "")
+
+
+def _default_search_name(context):
+    return search_text(context.get_current_parameters().get("name"))
+
+
+def _default_search_phone(context):
+    return search_digits(context.get_current_parameters().get("parent_phone_number"))
 
-db = SQLAlchemy()
 
 # Association table
 student_group_association = db.Table(
@@ -17,6 +78,9 @@ class Group(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     group_cost = db.Column(db.Integer, nullable=False)
+    version = db.Column(
+        db.BigInteger, nullable=False, default=change_stamp, server_default="0"
+    )
     students = db.relationship(
         "Student",
         secondary=student_group_association,
@@ -34,12 +98,55 @@ class Group(db.Model):
 
 class Student(db.Model):
     __tablename__ = "students"
+    __table_args__ = (
+        # Trigram indexes serve prefix and substring search on Postgres;
+        # SQLite falls back to b-tree prefix ranges.
+        db.Index(
+            "ix_students_search_name_trgm",
+            "search_name",
+            postgresql_using="gin",
+            postgresql_ops={"search_name": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        db.Index(
+            "ix_students_search_phone_trgm",
+            "search_phone",
+            postgresql_using="gin",
+            postgresql_ops={"search_phone": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        db.Index("ix_students_search_name", "search_name").ddl_if(dialect="sqlite"),
+        db.Index("ix_students_search_phone", "search_phone").ddl_if(dialect="sqlite"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     parent_phone_number = db.Column(db.String(20), nullable=False)
+    # Normalized copies of name and parent_phone_number used by search. The
+    # column defaults cover Core inserts (bulk import); the validator keeps
+    # them in step on ORM writes.
+    search_name = db.Column(
+        db.String(80), nullable=False, default=_default_search_name, server_default=""
+    )
+    search_phone = db.Column(
+        db.String(20), nullable=False, default=_default_search_phone, server_default=""
+    )
+    version = db.Column(
+        db.BigInteger, nullable=False, default=change_stamp, server_default="0"
+    )
     payments = db.relationship(
         "Payment", backref="student", cascade="all, delete-orphan"
     )
+    monthly_balances = db.relationship(
+        "StudentMonthlyBalance", cascade="all, delete-orphan"
+    )
+
+    @validates("name")
+    def _set_search_name(self, key, value):
+        self.search_name = search_text(value)
+        return value
+
+    @validates("parent_phone_number")
+    def _set_search_phone(self, key, value):
+        self.search_phone = search_digits(value)
+        return value
 
     def to_dict(self):
         return {
@@ -51,13 +158,24 @@ class Student(db.Model):
         }
 
 
+event.listen(
+    Student.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
 class Payment(db.Model):
     __tablename__ = "payments"
+    __table_args__ = (db.Index("ix_payments_student_id_date", "student_id", "date"),)
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Integer, nullable=False)
     date = db.Column(db.DateTime, default=datetime.utcnow)
     student_id = db.Column(db.Integer, db.ForeignKey("students.id"), nullable=False)
     group_cost_at_payment = db.Column(db.Integer, nullable=False)
+    version = db.Column(
+        db.BigInteger, nullable=False, default=change_stamp, server_default="0"
+    )
 
     def to_dict(self):
         return {
@@ -67,3 +185,37 @@ class Payment(db.Model):
             "student_id": self.student_id,
             "group_cost_at_payment": self.group_cost_at_payment,
         }
+
+
+# Running total of each student's payments per calendar month, kept in step
+# with the payments table by add_payment/delete_payment.
+class StudentMonthlyBalance(db.Model):
+    __tablename__ = "student_monthly_balance"
+    student_id = db.Column(db.Integer, db.ForeignKey("students.id"), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    total_paid = db.Column(db.Integer, nullable=False, default=0)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Expected and collected revenue of each group in each closed month, filled
+# by `manage.py rollup_revenue` (see revenue.py). Rows keep the group's title
+# and cost as they were, and outlive the group itself.
+class GroupMonthlyRevenue(db.Model):
+    __tablename__ = "group_monthly_revenue"
+    month = db.Column(db.Date, primary_key=True)
+    group_id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(100), nullable=False)
+    group_cost = db.Column(db.Integer, nullable=False)
+    member_count = db.Column(db.Integer, nullable=False)
+    expected_revenue = db.Column(db.Integer, nullable=False)
+    collected_revenue = db.Column(db.Numeric(14, 2), nullable=False)
+
+
+# One row per versioned table: ``changes`` counts the write transactions
+# that touched it, ``version`` is the newest change stamp among them. Kept by
+# versioning.py, so list endpoints validate without scanning the table.
+class TableVersion(db.Model):
+    __tablename__ = "table_versions"
+    table_name = db.Column(db.String(50), primary_key=True)
+    changes = db.Column(db.BigInteger, nullable=False, default=0)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
@@ -0,0 +1,45 @@
+# pagination.py
+import os
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+
+
+def page_args(args):
+    """Read ``limit`` and ``after`` from the query string.
+
+    Returns None when neither is present, so unpaginated clients keep
+    receiving the full list. ``limit`` is capped at MAX_PAGE_SIZE.
+    """
+    if "limit" not in args and "after" not in args:
+        return None
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+        after = int(args["after"]) if args.get("after") else None
+    except ValueError:
+        raise ValueError("limit and after must be integers")
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, MAX_PAGE_SIZE), after
+
+
+def keyset_query(query, column, limit, after):
+    """Narrow a Query or select() to one page, plus one row to detect the end."""
+    if after is not None:
+        query = query.filter(column > after)
+    return query.order_by(column).limit(limit + 1)
+
+
+def keyset_rows(rows, column, limit):
+    """Trim the rows fetched by keyset_query() and return the next cursor."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = getattr(rows[-1], column.key)
+    return rows, next_cursor
+
+
+def keyset_page(query, column, limit, after):
+    """Return one page of ``query`` ordered by ``column`` and the next cursor."""
+    rows = keyset_query(query, column, limit, after).all()
+    return keyset_rows(rows, column, limit)
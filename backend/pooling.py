@@ -0,0 +1,163 @@
+# pooling.py
+import os
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from metrics import (
+    POOL_CHECKED_OUT,
+    POOL_CHECKOUTS,
+    POOL_OVERFLOW,
+    POOL_OVERFLOW_CHECKOUTS,
+    POOL_TIMEOUTS,
+    POOL_WAIT,
+)
+
+
+def _env(name, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+
+# Unset values keep SQLAlchemy's defaults (5 connections, 10 overflow, 30s
+# timeout, no recycling).
+DB_POOL_SIZE = _env("DB_POOL_SIZE")
+DB_MAX_OVERFLOW = _env("DB_MAX_OVERFLOW")
+DB_POOL_TIMEOUT = _env("DB_POOL_TIMEOUT", float)
+# Seconds after which a connection is replaced instead of reused
+DB_POOL_RECYCLE = _env("DB_POOL_RECYCLE")
+# Test each connection on checkout, so connections broken by a database
+# restart or failover are replaced instead of failing a request
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+# Postgres only: statements running longer than this many milliseconds are
+# cancelled by the server
+DB_STATEMENT_TIMEOUT = _env("DB_STATEMENT_TIMEOUT")
+# Connections opened at start-up, up to the pool size
+DB_POOL_WARMUP = _env("DB_POOL_WARMUP") or 0
+
+
+class _InstrumentedPool:
+    """Reports checkouts, waits, timeouts and overflow use to Prometheus,
+    labelled with the engine's ``pool_logging_name``.
+
+    Only public pool API is used: ``connect()``, which ``engine.connect()``
+    calls and which blocks while the pool is exhausted, and the ``checkin``
+    and ``detach`` events.
+    """
+
+    def connect(self):
+        label = self.logging_name or "default"
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.labels(label).inc()
+            raise
+        finally:
+            POOL_WAIT.labels(label).observe(time.perf_counter() - start)
+        # The record outlives this checkout; checkin and detach read it back
+        connection.info["pool_label"] = label
+        connection.info["pool_size"] = self.size()
+        POOL_CHECKOUTS.labels(label).inc()
+        if _count_checkout(label, self.size(), 1) > 0:
+            POOL_OVERFLOW_CHECKOUTS.labels(label).inc()
+        return connection
+
+
+# Connections checked out of each labelled pool
+_checked_out = {}
+_checked_out_lock = threading.Lock()
+
+
+def _count_checkout(label, size, delta):
+    # Update the gauges; returns the number of overflow connections in use
+    with _checked_out_lock:
+        checked_out = _checked_out[label] = _checked_out.get(label, 0) + delta
+    overflow = max(checked_out - size, 0)
+    POOL_CHECKED_OUT.labels(label).set(checked_out)
+    POOL_OVERFLOW.labels(label).set(overflow)
+    return overflow
+
+
+def _returned(dbapi_connection, connection_record, *args):
+    # Also fires for an invalidated connection; a detached one never returns
+    info = connection_record.info
+    if "pool_label" in info:
+        _count_checkout(info.pop("pool_label"), info.pop("pool_size"), -1)
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+# On every QueuePool, async ones included; records not checked out by an
+# instrumented pool carry no label and are skipped
+event.listen(QueuePool, "checkin", _returned)
+event.listen(QueuePool, "detach", _returned)
+
+
+def _in_memory(url):
+    return url.get_backend_name() == "sqlite" and url.database in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def engine_options(url, name):
+    """``create_engine`` options for ``url`` from the DB_* settings.
+
+    ``name`` labels the pool in logs and metrics. In-memory SQLite keeps its
+    single shared connection and gets no pool settings.
+    """
+    url = make_url(url)
+    options = {"pool_logging_name": name}
+    if _in_memory(url):
+        return options
+
+    is_async = url.get_dialect().is_async
+    options["poolclass"] = (
+        InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool
+    )
+    options["pool_pre_ping"] = DB_POOL_PRE_PING
+    for key, value in (
+        ("pool_size", DB_POOL_SIZE),
+        ("max_overflow", DB_MAX_OVERFLOW),
+        ("pool_timeout", DB_POOL_TIMEOUT),
+        ("pool_recycle", DB_POOL_RECYCLE),
+    ):
+        if value is not None:
+            options[key] = value
+
+    if DB_STATEMENT_TIMEOUT and url.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {
+                "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+            }
+        else:
+            options["connect_args"] = {
+                "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"
+            }
+    return options
+
+
+def warm_up(engine, count=None):
+    """Open up to ``count`` (default DB_POOL_WARMUP) connections at once and
+    return them to the pool, so the first requests do not pay for connecting.
+    Returns the number of connections opened."""
+    count = DB_POOL_WARMUP if count is None else count
+    if isinstance(engine.pool, QueuePool):
+        count = min(count, engine.pool.size())
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
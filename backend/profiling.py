@@ -0,0 +1,172 @@
+# profiling.py
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from flask import current_app, g, request
+
+# Callers holding this permission can profile a request by sending
+# "X-Profile: 1".
+PROFILE_PERMISSION = "profile:requests"
+PROFILE_HEADER = "X-Profile"
+# Fraction of authenticated requests profiled regardless of the caller
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "student_track_profiles")
+)
+# Profiles kept on disk; the oldest are deleted first
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.001))
+
+PROFILE_KINDS = {
+    "collapsed": ("collapsed", "text/plain"),
+    "pstats": ("pstats", "application/octet-stream"),
+}
+PROFILE_ID = re.compile(r"^\d{8}T\d{6}\d{6}-[0-9a-f]{8}$")
+
+# One profiled request at a time per process: from Python 3.12 a second
+# cProfile.Profile cannot be enabled while another one is active.
+_profiler_lock = threading.Lock()
+
+
+def should_profile(payload):
+    if request.headers.get(PROFILE_HEADER) == "1":
+        return PROFILE_PERMISSION in payload.get("permissions", [])
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class StackSampler:
+    """Samples the call stack of one thread at a fixed interval and counts
+    identical stacks, root first, for collapsed-stack flamegraphs."""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def _prune():
+    profiles = list_profiles()
+    for meta in profiles[PROFILE_KEEP:]:
+        for suffix in ("json", *PROFILE_KINDS):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{meta['id']}.{suffix}"))
+            except FileNotFoundError:
+                pass
+
+
+def _save(profile, sampler, response, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    profile_id = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    base = os.path.join(PROFILE_DIR, profile_id)
+    profile.dump_stats(f"{base}.pstats")
+    with open(f"{base}.collapsed", "w") as f:
+        f.write(sampler.collapsed())
+    meta = {
+        "id": profile_id,
+        "created": now.isoformat(),
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "duration_ms": round(elapsed * 1000, 3),
+        "samples": sum(sampler.stacks.values()),
+    }
+    # Written last: a profile is listed only once its files are complete
+    with open(f"{base}.json", "w") as f:
+        json.dump(meta, f)
+    _prune()
+    return profile_id
+
+
+def profile_call(f, *args, **kwargs):
+    """Run a view under cProfile and the stack sampler and store both.
+
+    While another request is being profiled, the view just runs, without a
+    profile (and without an X-Profile-Id header).
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        return f(*args, **kwargs)
+    try:
+        g.profiling = True
+        profile = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident())
+        start = time.perf_counter()
+        with sampler:
+            profile.enable()
+            try:
+                rv = f(*args, **kwargs)
+            finally:
+                profile.disable()
+        elapsed = time.perf_counter() - start
+    finally:
+        _profiler_lock.release()
+    response = current_app.make_response(rv)
+    response.headers["X-Profile-Id"] = _save(profile, sampler, response, elapsed)
+    return response
+
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first."""
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted(names, reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id, kind):
+    """Path and mimetype of a stored profile file, or None."""
+    if kind not in PROFILE_KINDS or not PROFILE_ID.match(profile_id):
+        return None
+    suffix, mimetype = PROFILE_KINDS[kind]
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{suffix}")
+    if not os.path.exists(path):
+        return None
+    return path, mimetype
@@ -0,0 +1,219 @@
+# revenue.py
+from datetime import date, datetime
+from sqlalchemy import Float, cast, delete, func, insert, select
+from billing import month_start, parse_month
+from cache import collection_tag, response_cache
+from models import (
+    db,
+    Group,
+    GroupMonthlyRevenue,
+    StudentMonthlyBalance,
+    student_group_association,
+)
+
+# Months served by GET /api/reports/revenue when no range is given
+DEFAULT_REPORT_MONTHS = 12
+# Most months one request may compute live, i.e. not rolled up yet
+MAX_LIVE_MONTHS = 36
+
+
+def add_months(month, count):
+    """First day of the month ``count`` months after ``month`` (a date)."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(first, last):
+    """First days of the months from ``first`` to ``last``, inclusive."""
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return months
+
+
+def current_month():
+    return month_start(datetime.utcnow())
+
+
+def report_args(args):
+    """Read the ``from`` and ``to`` months (YYYY-MM) from the query string.
+    ``to`` defaults to the current month and ``from`` to
+    DEFAULT_REPORT_MONTHS months before it."""
+    try:
+        last = month_start(parse_month(args["to"])) if "to" in args else None
+        first = month_start(parse_month(args["from"])) if "from" in args else None
+    except ValueError:
+        raise ValueError("from and to must be YYYY-MM")
+    last = last or current_month()
+    first = first or add_months(last, 1 - DEFAULT_REPORT_MONTHS)
+    if first > last:
+        raise ValueError("from must not be after to")
+    return first, last
+
+
+def _collected_query(first, end):
+    # Each payment is split between the student's groups in proportion to
+    # their cost, so a student in two groups is not counted twice. Payments
+    # of students without groups are not attributed to any group.
+    student_costs = (
+        select(
+            student_group_association.c.student_id,
+            func.sum(Group.group_cost).label("total_cost"),
+        )
+        .join(Group, Group.id == student_group_association.c.group_id)
+        .group_by(student_group_association.c.student_id)
+        .subquery()
+    )
+    share = (
+        cast(StudentMonthlyBalance.total_paid * Group.group_cost, Float)
+        / student_costs.c.total_cost
+    )
+    return (
+        select(
+            student_group_association.c.group_id,
+            StudentMonthlyBalance.month,
+            func.sum(share),
+        )
+        .join(Group, Group.id == student_group_association.c.group_id)
+        .join(
+            student_costs,
+            student_costs.c.student_id == student_group_association.c.student_id,
+        )
+        .join(
+            StudentMonthlyBalance,
+            StudentMonthlyBalance.student_id == student_group_association.c.student_id,
+        )
+        .where(
+            StudentMonthlyBalance.month >= first,
+            StudentMonthlyBalance.month < end,
+            student_costs.c.total_cost > 0,
+        )
+        .group_by(student_group_association.c.group_id, StudentMonthlyBalance.month)
+    )
+
+
+def compute_revenue(months):
+    """Revenue rows of every current group for each month in ``months``,
+    computed from the groups, memberships and payment ledger as they are
+    now. Two queries, whatever the number of months."""
+    if not months:
+        return []
+    member_counts = (
+        select(
+            student_group_association.c.group_id,
+            func.count().label("member_count"),
+        )
+        .group_by(student_group_association.c.group_id)
+        .subquery()
+    )
+    groups = db.session.execute(
+        select(
+            Group.id,
+            Group.title,
+            Group.group_cost,
+            func.coalesce(member_counts.c.member_count, 0),
+        )
+        .outerjoin(member_counts, member_counts.c.group_id == Group.id)
+        .order_by(Group.id)
+    ).all()
+    collected = {}
+    for group_id, month, amount in db.session.execute(
+        _collected_query(min(months), add_months(max(months), 1))
+    ):
+        if isinstance(month, str):
+            month = date.fromisoformat(month)
+        collected[(group_id, month)] = amount
+
+    return [
+        {
+            "month": month,
+            "group_id": group_id,
+            "title": title,
+            "group_cost": group_cost,
+            "member_count": member_count,
+            "expected_revenue": group_cost * member_count,
+            "collected_revenue": round(float(collected.get((group_id, month), 0)), 2),
+        }
+        for month in sorted(months)
+        for group_id, title, group_cost, member_count in groups
+    ]
+
+
+def _store(months):
+    table = GroupMonthlyRevenue.__table__
+    db.session.execute(delete(table).where(table.c.month.in_(months)))
+    rows = compute_revenue(months)
+    if rows:
+        db.session.execute(insert(table), rows)
+
+
+def rollup_revenue(month=None, since=None):
+    """Store the revenue of closed months in group_monthly_revenue.
+
+    Without arguments, fills every closed month after the last one stored,
+    or only the last closed month on an empty table. With ``month`` (a
+    datetime), recomputes that month only, for payments recorded after it
+    was rolled up. With ``since``, backfills every closed month from that
+    one on; their expected revenue and member counts are approximate, as
+    they use today's memberships and group costs. Returns the months stored.
+    """
+    last_closed = add_months(current_month(), -1)
+    if month is not None or since is not None:
+        first = month_start(month if month is not None else since)
+        if first > last_closed:
+            raise ValueError("Only closed months can be rolled up")
+        months = [first] if month is not None else month_range(first, last_closed)
+    else:
+        last_stored = db.session.scalar(select(func.max(GroupMonthlyRevenue.month)))
+        first = add_months(last_stored, 1) if last_stored else last_closed
+        months = month_range(first, last_closed)
+    # Closed months are frozen as they are now: memberships and group costs
+    # have no history, so the job should run soon after each month closes.
+    _store(months)
+    db.session.commit()
+    response_cache.invalidate({collection_tag(GroupMonthlyRevenue)})
+    return months
+
+
+def revenue_report(first, last):
+    """Revenue per group per month from ``first`` to ``last`` (dates).
+
+    Closed months come from the rollup table. The current month and closed
+    months after the last one rolled up are computed live and marked
+    ``live``. Months after the current one are left out, as are months
+    before the rollup's history starts. Raises ValueError if more than
+    MAX_LIVE_MONTHS months would be computed live.
+    """
+    this_month = current_month()
+    months = month_range(first, min(last, this_month))
+    if not months:
+        return []
+    table = GroupMonthlyRevenue.__table__
+    last_stored = db.session.scalar(select(func.max(table.c.month)))
+    live = [
+        month
+        for month in months
+        if last_stored is None or month > last_stored or month == this_month
+    ]
+    if len(live) > MAX_LIVE_MONTHS:
+        raise ValueError(
+            f"At most {MAX_LIVE_MONTHS} months not rolled up yet can be "
+            "reported; run rollup_revenue first"
+        )
+    items = []
+    if last_stored is not None:
+        stored = db.session.execute(
+            select(table)
+            .where(table.c.month.between(months[0], min(months[-1], last_stored)))
+            .order_by(table.c.month, table.c.group_id)
+        ).mappings()
+        items = [
+            dict(row, collected_revenue=float(row["collected_revenue"]), live=False)
+            for row in stored
+        ]
+    items += [dict(row, live=True) for row in compute_revenue(live)]
+    items.sort(key=lambda item: (item["month"], item["group_id"]))
+    for item in items:
+        item["month"] = f"{item['month']:%Y-%m}"
+    return items
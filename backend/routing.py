@@ -0,0 +1,243 @@
+# routing.py
+import itertools
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from metrics import REPLICA_HEALTHY
+from pooling import engine_options
+
+# Comma-separated URLs of read replicas of DATABASE_URL
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+# Seconds between health checks of each replica
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+# After a write, the same client (token subject) reads from the primary for
+# this many seconds. 0 disables the pin.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 0))
+# "memory" keeps pins per process; a redis:// URL shares them between workers
+READ_YOUR_WRITES_URL = os.getenv("READ_YOUR_WRITES_URL", "memory")
+
+READ_METHODS = ("GET", "HEAD")
+
+
+class ReplicaSet:
+    """Read replicas used in turn, skipping any that fail a health check.
+
+    Replicas are checked with ``SELECT 1`` on first use and then every
+    ``interval`` seconds from a background thread. A disconnect or failed
+    connect takes a replica out of rotation until it passes a check again.
+    """
+
+    def __init__(self, urls, interval=REPLICA_CHECK_INTERVAL):
+        self.urls = list(urls)
+        self.interval = interval
+        self.engines = []
+        self.healthy = []
+        self._cycle = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pid = None
+
+    def start(self):
+        """Create the engines, check them and start the checker thread.
+
+        Runs on first use. Engines and the checker thread belong to one
+        process, so a forked worker drops the pooled connections it
+        inherited and starts over.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self.engines:
+                for engine in self.engines:
+                    engine.dispose(close=False)
+            else:
+                self.engines = [
+                    self._engine(number, url)
+                    for number, url in enumerate(self.urls, start=1)
+                ]
+                self.healthy = [False] * len(self.engines)
+            self.check()
+            if self.interval > 0:
+                threading.Thread(target=self._run, daemon=True).start()
+            self._pid = os.getpid()
+
+    def _engine(self, number, url):
+        engine = create_engine(url, **engine_options(url, f"replica-{number}"))
+        self.watch(engine, engine)
+        return engine
+
+    def watch(self, engine, replica):
+        """Take ``replica`` out of rotation when ``engine`` (the replica's
+        own engine, or an async engine on the same database) loses its
+        connection."""
+
+        @event.listens_for(engine, "handle_error")
+        def on_error(context):
+            if context.is_disconnect or context.connection is None:
+                self._set_health(self.engines.index(replica), False)
+
+    def _set_health(self, index, healthy):
+        self.healthy[index] = healthy
+        REPLICA_HEALTHY.labels(self.engines[index].pool.logging_name).set(healthy)
+
+    def check(self):
+        for index, engine in enumerate(self.engines):
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+            except SQLAlchemyError:
+                self._set_health(index, False)
+            else:
+                self._set_health(index, True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def choose(self):
+        """The next healthy replica engine, or None to use the primary."""
+        if not self.urls:
+            return None
+        self.start()
+        for _ in range(len(self.engines)):
+            index = next(self._cycle) % len(self.engines)
+            if self.healthy[index]:
+                return self.engines[index]
+        return None
+
+    def dispose(self):
+        self._stop.set()
+        for engine in self.engines:
+            engine.dispose()
+
+
+class MemoryPins:
+    def __init__(self):
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def pin(self, subject, seconds):
+        with self._lock:
+            self._until[subject] = time.monotonic() + seconds
+
+    def pinned(self, subject):
+        with self._lock:
+            until = self._until.get(subject)
+            if until is not None and until <= time.monotonic():
+                del self._until[subject]
+                until = None
+        return until is not None
+
+    def clear(self):
+        with self._lock:
+            self._until.clear()
+
+
+class RedisPins:
+    def __init__(self, client, prefix="sta:pin:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                "READ_YOUR_WRITES_URL points at Redis; install the redis package"
+            )
+        return cls(redis.Redis.from_url(url))
+
+    def pin(self, subject, seconds):
+        self.client.set(f"{self.prefix}{subject}", 1, px=int(seconds * 1000))
+
+    def pinned(self, subject):
+        return bool(self.client.exists(f"{self.prefix}{subject}"))
+
+    def clear(self):
+        for key in self.client.scan_iter(match=f"{self.prefix}*"):
+            self.client.delete(key)
+
+
+def pins_from_url(url=READ_YOUR_WRITES_URL):
+    if url == "memory":
+        return MemoryPins()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPins.from_url(url)
+    raise ValueError(f"Unsupported READ_YOUR_WRITES_URL: {url}")
+
+
+replicas = ReplicaSet(DATABASE_REPLICA_URLS)
+pins = pins_from_url()
+
+
+def pinned():
+    """Whether the client making this request wrote within the last
+    READ_YOUR_WRITES_SECONDS, so must read from the primary."""
+    if not has_request_context():
+        return False
+    if "pinned" not in g:
+        subject = g.get("auth_subject")
+        g.pinned = bool(
+            READ_YOUR_WRITES_SECONDS > 0 and subject and pins.pinned(subject)
+        )
+    return g.pinned
+
+
+def read_engine():
+    """The replica engine serving this request's reads, or None for the
+    primary. Chosen once per request, so all its reads see one replica."""
+    if not has_request_context() or request.method not in READ_METHODS:
+        return None
+    if "read_engine" not in g:
+        g.read_engine = None if pinned() else replicas.choose()
+    return g.read_engine
+
+
+def read_from_replica():
+    """Whether this request has read from a replica so far."""
+    return has_request_context() and g.get("read_engine") is not None
+
+
+class RoutingSession(FlaskSession):
+    """Sends the reads of GET requests to a read replica; everything else,
+    and any flush, goes to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            engine = read_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(Session, "after_commit")
+def pin_writer(session):
+    if (
+        READ_YOUR_WRITES_SECONDS > 0
+        and has_request_context()
+        and request.method not in READ_METHODS
+        and g.get("auth_subject")
+    ):
+        pins.pin(g.auth_subject, READ_YOUR_WRITES_SECONDS)
+
+
+def route_reads(app):
+    """Forget each request's replica choice and pin when it ends. Needed where
+    requests share an app context, as in tests."""
+
+    @app.teardown_request
+    def forget_read_engine(error=None):
+        g.pop("read_engine", None)
+        g.pop("pinned", None)
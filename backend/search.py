@@ -0,0 +1,120 @@
+# search.py
+import os
+from sqlalchemy import and_, case, func, or_, select
+from models import db, Student, search_digits, search_text
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", 100))
+# Shorter terms only match prefixes: trigram indexes cannot serve them as
+# substrings.
+SUBSTRING_MIN_LENGTH = 3
+
+
+def search_args(args):
+    """Read ``q``, ``limit`` and ``offset`` from the query string."""
+    term = args.get("q", "")
+    if not search_text(term) and not search_digits(term):
+        raise ValueError("q is required")
+    try:
+        limit = int(args.get("limit", SEARCH_PAGE_SIZE))
+        offset = int(args.get("offset", 0))
+    except ValueError:
+        raise ValueError("limit and offset must be integers")
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be positive and offset non-negative")
+    return term, min(limit, SEARCH_MAX_PAGE_SIZE), offset
+
+
+def _prefix_range(column, prefix):
+    # column >= 'abc' AND column < 'abd' is an index range scan in any
+    # collation-free (bytewise) b-tree, unlike LIKE in SQLite.
+    last = ord(prefix[-1])
+    if last == 0x10FFFF:
+        return column >= prefix
+    return and_(column >= prefix, column < prefix[:-1] + chr(last + 1))
+
+
+def _postgresql_match(name, digits):
+    columns = []
+    if name:
+        columns.append((Student.search_name, name))
+    if digits:
+        columns.append((Student.search_phone, digits))
+
+    conditions = []
+    for column, value in columns:
+        if len(value) >= SUBSTRING_MIN_LENGTH:
+            conditions.append(column.contains(value, autoescape=True))
+        else:
+            conditions.append(column.startswith(value, autoescape=True))
+
+    ranks = []
+    for column, value in columns:
+        ranks += [
+            (column == value, 0),
+            (column.startswith(value, autoescape=True), 1),
+        ]
+    if name:
+        ranks.append((Student.search_name.contains(f" {name}", autoescape=True), 2))
+        similarity = func.similarity(Student.search_name, name).desc()
+    else:
+        similarity = func.similarity(Student.search_phone, digits).desc()
+    return or_(*conditions), [case(*ranks, else_=3), similarity]
+
+
+def _prefix_match(name, digits):
+    columns = []
+    if name:
+        columns.append((Student.search_name, name))
+    if digits:
+        columns.append((Student.search_phone, digits))
+    # Whole-name prefixes only: a later word (a surname) would need a LIKE
+    # with a leading wildcard, which scans the table on every search.
+    conditions = [_prefix_range(column, value) for column, value in columns]
+    ranks = [(column == value, 0) for column, value in columns]
+    return or_(*conditions), [case(*ranks, else_=1), Student.search_name]
+
+
+def search_query(term, limit, offset=0, options=(), dialect="postgresql"):
+    """select() of the students matching ``term``, best first, with one row
+    past the page to detect the end. See search_students()."""
+    name = search_text(term)
+    # Only terms without letters are matched against phone numbers
+    digits = "" if any(c.isalpha() for c in term) else search_digits(term)
+    if dialect == "postgresql":
+        condition, order = _postgresql_match(name, digits)
+    else:
+        condition, order = _prefix_match(name, digits)
+    return (
+        select(Student)
+        .options(*options)
+        .where(condition)
+        .order_by(*order, Student.id)
+        .offset(offset)
+        .limit(limit + 1)
+    )
+
+
+def search_page(students, limit, offset):
+    """Trim the rows fetched by search_query() and return the next offset."""
+    next_offset = None
+    if len(students) > limit:
+        students = students[:limit]
+        next_offset = offset + limit
+    return students, next_offset
+
+
+def search_students(term, limit, offset=0, options=()):
+    """Students whose name or parent phone matches ``term``, best first.
+
+    On Postgres names and phones match anywhere (prefix only for terms
+    shorter than SUBSTRING_MIN_LENGTH) and are ranked exact match, prefix,
+    word prefix, then trigram similarity. Other databases match prefixes of
+    the whole name or phone, through b-tree indexes; later words of the name
+    do not match there. Returns the page and the next offset, or None
+    on the last page.
+    """
+    dialect = db.session.get_bind().dialect.name
+    query = search_query(term, limit, offset, options, dialect)
+    students = db.session.scalars(query).all()
+    return search_page(students, limit, offset)
@@ -0,0 +1,198 @@
+# serializers.py
+from sqlalchemy import func, select
+from sqlalchemy.orm import load_only, selectinload
+from models import db, Group, Student, student_group_association
+from cache import entity_tag
+
+GROUP_FIELDS = ("id", "title", "group_cost", "student_count")
+GROUP_RELATIONS = ("students", "students.payments", "students.groups")
+STUDENT_FIELDS = ("id", "name", "parent_phone_number")
+STUDENT_RELATIONS = ("payments", "groups")
+
+# Shapes returned when the client does not ask for anything specific. List
+# endpoints stay shallow; detail endpoints keep the full to_dict() layout.
+GROUP_LIST_EXPAND = ()
+GROUP_DETAIL_EXPAND = GROUP_RELATIONS
+STUDENT_LIST_EXPAND = ()
+STUDENT_DETAIL_EXPAND = STUDENT_RELATIONS
+
+
+class Fieldset:
+    """Which fields and relations of a resource should be serialized.
+
+    ``fields`` is None for "every scalar field". ``expand`` holds relation
+    paths such as ``students`` or ``students.payments``.
+    """
+
+    def __init__(self, fields=None, expand=()):
+        self.fields = fields
+        self.expand = set(expand)
+
+    @classmethod
+    def from_args(cls, args, scalar_fields, relations, default_expand):
+        fields = None
+        if args.get("fields"):
+            fields = {name.strip() for name in args["fields"].split(",")}
+            fields.discard("")
+            unknown = fields - set(scalar_fields) - set(relations)
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        if args.get("expand") is not None:
+            expand = {path.strip() for path in args["expand"].split(",")}
+            expand.discard("")
+        else:
+            expand = set(default_expand)
+        # Listing a relation in fields= is the same as expanding it
+        if fields is not None:
+            expand |= fields & set(relations)
+        unknown = expand - set(relations)
+        if unknown:
+            raise ValueError(f"Unknown expand paths: {', '.join(sorted(unknown))}")
+        # A nested path needs its parent relation
+        for path in list(expand):
+            if "." in path:
+                expand.add(path.split(".", 1)[0])
+        # A relation left out of fields= is neither loaded nor serialized
+        if fields is not None:
+            expand = {path for path in expand if path.split(".", 1)[0] in fields}
+        return cls(fields, expand)
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields
+
+    def nested(self, relation):
+        prefix = f"{relation}."
+        return Fieldset(
+            None,
+            {path[len(prefix) :] for path in self.expand if path.startswith(prefix)},
+        )
+
+
+def group_fieldset(args, detail=False):
+    default_expand = GROUP_DETAIL_EXPAND if detail else GROUP_LIST_EXPAND
+    return Fieldset.from_args(args, GROUP_FIELDS, GROUP_RELATIONS, default_expand)
+
+
+def student_fieldset(args, detail=False):
+    default_expand = STUDENT_DETAIL_EXPAND if detail else STUDENT_LIST_EXPAND
+    return Fieldset.from_args(args, STUDENT_FIELDS, STUDENT_RELATIONS, default_expand)
+
+
+def _columns(model, scalar_fields, fieldset):
+    names = [
+        name
+        for name in scalar_fields
+        if name in model.__table__.c and (name == "id" or fieldset.includes(name))
+    ]
+    return [getattr(model, name) for name in names]
+
+
+def student_loader_options(fieldset, path=None):
+    """Loader options fetching only what ``fieldset`` will serialize."""
+    columns = _columns(Student, STUDENT_FIELDS, fieldset)
+    if path is None:
+        options = [load_only(*columns)]
+        load = selectinload
+    else:
+        options = [path.load_only(*columns)]
+        load = path.selectinload
+    if "payments" in fieldset.expand:
+        options.append(load(Student.payments))
+    if "groups" in fieldset.expand:
+        options.append(load(Student.groups).load_only(Group.id, Group.title))
+    return options
+
+
+def group_loader_options(fieldset):
+    options = [load_only(*_columns(Group, GROUP_FIELDS, fieldset))]
+    if "students" in fieldset.expand:
+        options += student_loader_options(
+            fieldset.nested("students"), selectinload(Group.students)
+        )
+    return options
+
+
+def student_counts_query(group_ids):
+    return (
+        select(
+            student_group_association.c.group_id,
+            func.count(student_group_association.c.student_id),
+        )
+        .where(student_group_association.c.group_id.in_(group_ids))
+        .group_by(student_group_association.c.group_id)
+    )
+
+
+def student_counts(group_ids):
+    return dict(db.session.execute(student_counts_query(group_ids)).all())
+
+
+def needs_student_counts(fieldset):
+    """Whether serialize_groups() looks up counts for ``fieldset``."""
+    return fieldset.includes("student_count") and "students" not in fieldset.expand
+
+
+def serialize_student(student, fieldset):
+    data = {
+        name: getattr(student, name)
+        for name in STUDENT_FIELDS
+        if fieldset.includes(name)
+    }
+    if "payments" in fieldset.expand and fieldset.includes("payments"):
+        data["payments"] = [payment.to_dict() for payment in student.payments]
+    if "groups" in fieldset.expand and fieldset.includes("groups"):
+        data["groups"] = [
+            {"id": group.id, "title": group.title} for group in student.groups
+        ]
+    return data
+
+
+def serialize_students(students, fieldset):
+    return [serialize_student(student, fieldset) for student in students]
+
+
+def serialize_groups(groups, fieldset, counts=None):
+    """``counts`` maps group ids to student counts when the caller already
+    fetched them (see needs_student_counts)."""
+    expand_students = "students" in fieldset.expand
+    if counts is None:
+        counts = {}
+        if needs_student_counts(fieldset):
+            counts = student_counts([group.id for group in groups])
+
+    nested_fieldset = fieldset.nested("students")
+    result = []
+    for group in groups:
+        data = {
+            name: getattr(group, name)
+            for name in ("id", "title", "group_cost")
+            if fieldset.includes(name)
+        }
+        if fieldset.includes("student_count"):
+            data["student_count"] = (
+                len(group.students) if expand_students else counts.get(group.id, 0)
+            )
+        if expand_students and fieldset.includes("students"):
+            data["students"] = serialize_students(group.students, nested_fieldset)
+        result.append(data)
+    return result
+
+
+def student_cache_tags(students, fieldset):
+    """Cache tags of every entity a serialized student list was built from."""
+    tags = set()
+    for student in students:
+        tags.add(entity_tag(Student, student.id))
+        if "groups" in fieldset.expand:
+            tags.update(entity_tag(Group, group.id) for group in student.groups)
+    return tags
+
+
+def group_cache_tags(groups, fieldset):
+    tags = set()
+    for group in groups:
+        tags.add(entity_tag(Group, group.id))
+        if "students" in fieldset.expand:
+            tags |= student_cache_tags(group.students, fieldset.nested("students"))
+    return tags
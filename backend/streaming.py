@@ -0,0 +1,97 @@
+# streaming.py
+import csv
+import io
+import os
+from itertools import islice
+from flask import Response, current_app, request, stream_with_context
+
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson():
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def wants_stream():
+    stream = request.args.get("stream", "").lower() in ("1", "true", "yes")
+    return stream or wants_ndjson()
+
+
+def _batches(query):
+    # yield_per fetches through a server-side cursor where the driver
+    # supports it; rows are dropped from memory once their batch is written.
+    rows = iter(query.yield_per(STREAM_BATCH_SIZE))
+    while True:
+        batch = list(islice(rows, STREAM_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def stream_collection(query, serialize):
+    """Stream ``query`` as a JSON array, or as NDJSON if the client asked.
+
+    ``serialize`` turns one batch of rows into a list of dicts, which lets
+    per-batch lookups (e.g. student counts) stay set-based.
+    """
+    json_provider = current_app.json
+
+    def dumps(item):
+        return json_provider.dumps(item, separators=(",", ":"))
+
+    if wants_ndjson():
+
+        def generate():
+            for batch in _batches(query):
+                yield "".join(dumps(item) + "\n" for item in serialize(batch))
+
+        return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+    def generate():
+        yield "["
+        separator = ""
+        for batch in _batches(query):
+            items = serialize(batch)
+            if items:
+                yield separator + ",".join(dumps(item) for item in items)
+                separator = ","
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+# Spreadsheets evaluate a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def csv_cell(value):
+    """``value``, with a leading ``'`` if it is text a spreadsheet would read
+    as a formula. Numbers are left alone."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(header, batches):
+    """CSV text of ``header`` and then each batch of rows, one chunk per
+    batch. Text cells are escaped with csv_cell()."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([csv_cell(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+
+
+def stream_csv(header, batches, filename):
+    """Stream batches of rows as a CSV attachment named ``filename``."""
+    response = Response(
+        stream_with_context(csv_chunks(header, batches)), mimetype="text/csv"
+    )
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
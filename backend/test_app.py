@@ -1,16 +1,121 @@
-import unittest
+import asyncio
+import contextvars
+import csv
+import io
 import json
 import os
+import pstats
+import runpy
+import sys
+import tempfile
+import time
+import unittest
 import warnings
-from app import app, db
-from models import Group, Student, Payment
+from contextlib import contextmanager
 from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
 from dotenv import load_dotenv
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.orm import Session
+
+import asgi
+import profiling
+from app import app, db
+from arrears import arrears_report
+from auth import AuthError, JWKSCache, TokenCache
+from billing import check_ledger, rebuild_ledger, month_window
+from cache import MemoryBackend, RedisBackend, ResponseCache, response_cache
+from manage import (
+    arrears_report_command,
+    billing_report_command,
+    check_ledger_command,
+    rebuild_ledger_command,
+    rollup_revenue_command,
+)
+from models import Group, Student, Payment, StudentMonthlyBalance
+from pagination import MAX_PAGE_SIZE
+from pooling import engine_options, warm_up
+from revenue import add_months, current_month
+from routing import MemoryPins, ReplicaSet
+from search import SEARCH_PAGE_SIZE, search_query
 
 load_dotenv()
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 
+def scrape_metrics(client):
+    response = client.get("/metrics")
+    samples = {}
+    for family in text_string_to_metric_families(response.get_data(as_text=True)):
+        for sample in family.samples:
+            key = (sample.name, tuple(sorted(sample.labels.items())))
+            samples[key] = sample.value
+    return samples
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def call_asgi(method, path, headers, body=b""):
+    path, _, query = path.partition("?")
+    if body:
+        headers = {**headers, "Content-Length": str(len(body))}
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.application(scope, receive, send)
+    start, *chunks = messages
+    response_headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    return (
+        start["status"],
+        response_headers,
+        b"".join(c.get("body", b"") for c in chunks),
+    )
+
+
+def run_asgi(*requests):
+    """Serve ``(method, path, headers[, body])`` requests concurrently."""
+
+    async def run():
+        try:
+            return await asyncio.gather(*(call_asgi(*r) for r in requests))
+        finally:
+            await asgi.async_db.dispose()
+
+    # Outside the test's app context, as under a real server, so concurrent
+    # requests do not share it
+    return contextvars.Context().run(asyncio.run, run())
+
+
 class TestApp(unittest.TestCase):
     def setUp(self):
         app.config["TESTING"] = True
@@ -19,6 +124,8 @@ class TestApp(unittest.TestCase):
         self.app_context = app.app_context()
         self.app_context.push()
         db.create_all()
+        # drop_all() bypasses the session events that invalidate the cache
+        response_cache.clear()
 
         self.admin_token = os.getenv("ADMIN_JWT_TOKEN")
         self.teacher_token = os.getenv("TEACHER_JWT_TOKEN")
@@ -308,6 +415,21 @@ class TestApp(unittest.TestCase):
             self.assertEqual(response.status_code, 201)
             self.assertEqual(result["amount"], 100)
 
+    def test_add_payment_fail_boolean_amount(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add(student)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.post(
+                f"/api/students/{student.id}/payments",
+                json={"amount": True},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(Payment.query.count(), 0)
+
     def test_add_payment_success_teacher(self):
         with self.app_context:
             student = Student(name="Test Student", parent_phone_number="1234567890")
@@ -362,6 +484,1952 @@ class TestApp(unittest.TestCase):
             db.session.add(student)
             db.session.add(group)
 
+    def test_get_group_payment_status_matches_student_status(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            paid = Student(name="Paid Student", parent_phone_number="1234567890")
+            pending = Student(name="Pending Student", parent_phone_number="1234567890")
+            paid.groups.append(group)
+            pending.groups.append(group)
+            db.session.add_all([group, paid, pending])
+            db.session.commit()
+
+            admin_headers = {"Authorization": f"Bearer {self.admin_token}"}
+            for student, amount in ((paid, 100), (pending, 40)):
+                self.client.post(
+                    f"/api/students/{student.id}/payments",
+                    json={"amount": amount},
+                    headers=admin_headers,
+                )
+
+            headers = {"Authorization": f"Bearer {self.teacher_token}"}
+            response = self.client.get(
+                f"/api/groups/{group.id}/payment_status", headers=headers
+            )
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data), 2)
+            self.assertEqual([entry["status"] for entry in data], ["PAID", "PENDING"])
+            for entry in data:
+                single = self.client.get(
+                    f"/api/students/{entry['student_id']}/payment_status",
+                    headers=headers,
+                )
+                expected = json.loads(single.data)
+                self.assertEqual(entry["status"], expected["status"])
+                self.assertEqual(entry["pending_amount"], expected["pending_amount"])
+
+    def test_get_group_payment_status_fail_not_found(self):
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        response = self.client.get("/api/groups/999/payment_status", headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_students_payment_status_by_ids(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add(student)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.get(
+                f"/api/students/payment_status?ids={student.id},999", headers=headers
+            )
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data), 1)
+            self.assertEqual(data[0]["student_id"], student.id)
+            self.assertEqual(data[0]["status"], "PENDING")
+
+    def test_get_students_payment_status_fail_invalid_ids(self):
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        response = self.client.get(
+            "/api/students/payment_status?ids=abc", headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_students_payment_status_caps_ids(self):
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        for count, status in ((MAX_PAGE_SIZE, 200), (MAX_PAGE_SIZE + 1, 400)):
+            ids = ",".join(str(i) for i in range(1, count + 1))
+            response = self.client.get(
+                f"/api/students/payment_status?ids={ids}", headers=headers
+            )
+            self.assertEqual(response.status_code, status)
+
+    def seed_billing(self):
+        paid = Student(name="Ana, López", parent_phone_number="1234567890")
+        paid.groups = [
+            Group(title="Piano", group_cost=100),
+            Group(title="Art", group_cost=50),
+        ]
+        paid.payments = [
+            Payment(amount=150, date=datetime(2024, 3, 5), group_cost_at_payment=150),
+            Payment(amount=20, date=datetime(2024, 2, 9), group_cost_at_payment=150),
+        ]
+        db.session.add_all([paid, Student(name="Luis", parent_phone_number="555")])
+        db.session.commit()
+        rebuild_ledger()
+
+    def test_billing_report_streams_csv(self):
+        with self.app_context:
+            self.seed_billing()
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.get(
+                "/api/reports/billing?month=2024-02", headers=headers
+            )
+
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(response.mimetype, "text/csv")
+            self.assertIn(
+                "billing-2024-02.csv", response.headers["Content-Disposition"]
+            )
+            rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+            self.assertEqual(
+                rows,
+                [
+                    [
+                        "student_id",
+                        "student_name",
+                        "parent_phone_number",
+                        "groups",
+                        "total_group_cost",
+                        "amount_paid",
+                        "pending_amount",
+                        "status",
+                    ],
+                    ["1", "Ana, López", "1234567890", "Art; Piano", "150", "20"]
+                    + ["130", "PENDING"],
+                    ["2", "Luis", "555", "", "0", "0", "0", "PENDING"],
+                ],
+            )
+
+            response = self.client.get(
+                "/api/reports/billing?month=2024-03", headers=headers
+            )
+            rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+            self.assertEqual(rows[1][5:], ["150", "0", "PAID"])
+
+            # Text a spreadsheet would evaluate is escaped; numbers are not
+            group = Group(title="@SUM(A1:A9)", group_cost=100)
+            db.session.add(
+                Student(
+                    name="=HYPERLINK(1)",
+                    parent_phone_number="+52 953 340 4382",
+                    groups=[group],
+                )
+            )
+            db.session.commit()
+            response = self.client.get(
+                "/api/reports/billing?month=2024-03", headers=headers
+            )
+            rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+            self.assertEqual(
+                rows[3][1:],
+                ["'=HYPERLINK(1)", "'+52 953 340 4382", "'@SUM(A1:A9)"]
+                + ["100", "0", "100", "PENDING"],
+            )
+
+            response = self.client.get(
+                "/api/reports/billing?month=2024-3x", headers=headers
+            )
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get(
+                "/api/reports/billing",
+                headers={"Authorization": f"Bearer {self.teacher_token}"},
+            )
+            self.assertEqual(response.status_code, 403)
+
+    def test_billing_report_command(self):
+        with self.app_context:
+            self.seed_billing()
+            result = app.test_cli_runner().invoke(
+                billing_report_command, ["--month", "2024-03"]
+            )
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            rows = list(csv.reader(io.StringIO(result.output)))
+            self.assertEqual(len(rows), 3)
+            self.assertEqual(rows[1][3:], ["Art; Piano", "150", "150", "0", "PAID"])
+
+            result = app.test_cli_runner().invoke(
+                billing_report_command, ["--month", "2024-3x"]
+            )
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn("YYYY-MM", result.output)
+
+    def test_revenue_report_rollup(self):
+        with self.app_context:
+            current = current_month()
+            previous = add_months(current, -1)
+            art = Group(title="Art", group_cost=100)
+            music = Group(title="Music", group_cost=50)
+            both = Student(name="Ana", parent_phone_number="1234567890")
+            both.groups = [art, music]
+            one = Student(name="Luis", parent_phone_number="1234567890")
+            one.groups = [art]
+            both.payments = [
+                Payment(amount=150, date=datetime(previous.year, previous.month, 10)),
+                Payment(amount=30, date=datetime(current.year, current.month, 1)),
+            ]
+            one.payments = [
+                Payment(amount=60, date=datetime(previous.year, previous.month, 28))
+            ]
+            for payment in both.payments + one.payments:
+                payment.group_cost_at_payment = 0
+            db.session.add_all([both, one])
+            db.session.commit()
+            rebuild_ledger()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            path = f"/api/reports/revenue?from={previous:%Y-%m}&to={current:%Y-%m}"
+
+            def report():
+                response = self.client.get(path, headers=headers)
+                self.assertEqual(response.status_code, 200)
+                return [
+                    (
+                        item["month"],
+                        item["title"],
+                        item["expected_revenue"],
+                        item["collected_revenue"],
+                        item["live"],
+                    )
+                    for item in response.get_json()["items"]
+                ]
+
+            previous_rows = [
+                (f"{previous:%Y-%m}", "Art", 200, 160.0),
+                (f"{previous:%Y-%m}", "Music", 50, 50.0),
+            ]
+            current_rows = [
+                (f"{current:%Y-%m}", "Art", 200, 20.0),
+                (f"{current:%Y-%m}", "Music", 50, 10.0),
+            ]
+            self.assertEqual(
+                report(), [row + (True,) for row in previous_rows + current_rows]
+            )
+
+            runner = app.test_cli_runner()
+            result = runner.invoke(rollup_revenue_command)
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn(f"1 months: {previous:%Y-%m}", result.output)
+            result = runner.invoke(rollup_revenue_command)
+            self.assertIn("up to date", result.output)
+            result = runner.invoke(
+                rollup_revenue_command, ["--month", f"{current:%Y-%m}"]
+            )
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertIn("Only closed months", result.output)
+            result = runner.invoke(rollup_revenue_command, ["--month", "2024"])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn("YYYY-MM", result.output)
+
+            # Closed months keep the cost they were rolled up with
+            art.group_cost = 200
+            db.session.commit()
+            self.assertEqual(
+                report(),
+                [row + (False,) for row in previous_rows]
+                + [
+                    (f"{current:%Y-%m}", "Art", 400, 24.0, True),
+                    (f"{current:%Y-%m}", "Music", 50, 6.0, True),
+                ],
+            )
+
+            for query in (
+                "from=2024-05&to=2024-01",
+                "to=2024-13",
+            ):
+                response = self.client.get(
+                    f"/api/reports/revenue?{query}", headers=headers
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_revenue_report_live_months_limit(self):
+        with self.app_context:
+            student = Student(name="Ana", parent_phone_number="1234567890")
+            student.groups = [Group(title="Art", group_cost=100)]
+            student.payments = [
+                Payment(
+                    amount=100, date=datetime(2021, 3, 5), group_cost_at_payment=100
+                )
+            ]
+            db.session.add(student)
+            db.session.commit()
+            rebuild_ledger()
+
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        response = self.client.get(
+            "/api/reports/revenue?from=2021-01&to=2023-12", headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            "/api/reports/revenue?from=2021-01&to=2024-01", headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("36 months", response.get_json()["error"])
+
+        # The first rollup stores only the last closed month; older months
+        # are backfilled on request, as approximations
+        previous = add_months(current_month(), -1)
+        runner = app.test_cli_runner()
+        result = runner.invoke(rollup_revenue_command)
+        self.assertIn(f"1 months: {previous:%Y-%m}", result.output)
+        result = runner.invoke(rollup_revenue_command, ["--since", "2021-01"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("2021-01 to", result.output)
+        self.assertIn("approximate", result.output)
+        result = runner.invoke(
+            rollup_revenue_command, ["--since", "2021-01", "--month", "2021-01"]
+        )
+        self.assertEqual(result.exit_code, 2)
+
+        # Rolled-up months are read back, however many
+        response = self.client.get("/api/reports/revenue?from=1900-01", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        items = response.get_json()["items"]
+        self.assertEqual(items[0]["month"], "2021-01")
+        self.assertEqual(items[2]["collected_revenue"], 100.0)
+        self.assertEqual([item["live"] for item in items].count(True), 1)
+
+    def test_arrears_aging(self):
+        with self.app_context:
+            group = Group(title="Piano", group_cost=100)
+            enrolled = Student(name="Ana", parent_phone_number="1234567890")
+            enrolled.groups = [group]
+            enrolled.payments = [
+                Payment(
+                    amount=100, date=datetime(2024, 6, 3), group_cost_at_payment=100
+                ),
+                Payment(
+                    amount=40, date=datetime(2024, 8, 3), group_cost_at_payment=120
+                ),
+            ]
+            left = Student(name="Luis", parent_phone_number="1234567890")
+            left.payments = [
+                Payment(amount=10, date=datetime(2024, 7, 3), group_cost_at_payment=50)
+            ]
+            new = Student(name="Sofía", parent_phone_number="1234567890")
+            new.groups = [group]
+            db.session.add_all([enrolled, left, new])
+            db.session.commit()
+            rebuild_ledger()
+
+            # July is charged June's snapshot, September August's, October
+            # the current cost. Luis left every group after July.
+            report = arrears_report(datetime(2024, 10, 18))
+            columns = ["student_id", "name", "0-30", "31-60", "61-90", "90+", "total"]
+            self.assertEqual(
+                [[item[column] for column in columns] for item in report["items"]],
+                [
+                    [enrolled.id, "Ana", 100, 120, 80, 100, 400],
+                    [new.id, "Sofía", 100, 0, 0, 0, 100],
+                    [left.id, "Luis", 0, 0, 0, 40, 40],
+                ],
+            )
+            self.assertEqual(
+                report["totals"],
+                {"0-30": 200, "31-60": 120, "61-90": 80, "90+": 140, "total": 540},
+            )
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            everyone = self.client.get("/api/reports/arrears", headers=headers)
+            response = self.client.get("/api/reports/arrears?limit=1", headers=headers)
+            data = response.get_json()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data["students"], 3)
+            self.assertEqual(data["totals"], everyone.get_json()["totals"])
+            self.assertEqual(len(data["items"]), 1)
+            self.assertEqual(data["items"][0]["student_id"], enrolled.id)
+            response = self.client.get("/api/reports/arrears?limit=0", headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+            result = app.test_cli_runner().invoke(arrears_report_command)
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("3 students owing", result.output)
+            for limit in ("0", "-1"):
+                result = app.test_cli_runner().invoke(
+                    arrears_report_command, ["--limit", limit]
+                )
+                self.assertEqual(result.exit_code, 2)
+            with self.assertRaises(ValueError):
+                arrears_report(datetime(2024, 10, 18), 0)
+
+            # The totals do not depend on how many rows the limit keeps
+            report = arrears_report(datetime(2024, 10, 18), 1)
+            self.assertEqual(report["students"], 3)
+            self.assertEqual(report["totals"]["total"], 540)
+            self.assertEqual(len(report["items"]), 1)
+
+    def test_arrears_nobody_owing(self):
+        with self.app_context:
+            report = arrears_report(datetime(2024, 10, 18), 5)
+            self.assertEqual(report["students"], 0)
+            self.assertEqual(report["items"], [])
+            self.assertEqual(set(report["totals"].values()), {0})
+
+    def seed_groups(self, group_count, students_per_group):
+        groups = [Group(title=f"Group {i}", group_cost=100) for i in range(group_count)]
+        db.session.add_all(groups)
+        for i in range(group_count * students_per_group):
+            student = Student(name=f"Student {i}", parent_phone_number="1234567890")
+            student.groups = [groups[i % group_count], groups[(i + 1) % group_count]]
+            student.payments = [Payment(amount=50, group_cost_at_payment=200)]
+            db.session.add(student)
+        db.session.commit()
+        return groups[0].id, student.id
+
+    def test_read_endpoints_run_fixed_number_of_queries(self):
+        with self.app_context:
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            for group_count in (2, 10):
+                group_id, student_id = self.seed_groups(group_count, 5)
+                db.session.expunge_all()
+                max_queries = {
+                    "/api/groups": 4,
+                    f"/api/groups/{group_id}": 5,
+                    "/api/students": 3,
+                    f"/api/students/{student_id}": 3,
+                    f"/api/groups/{group_id}/students": 3,
+                }
+                for url, limit in max_queries.items():
+                    with count_queries() as statements:
+                        response = self.client.get(url, headers=headers)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertLessEqual(len(statements), limit, url)
+
+    def test_get_students_paginated(self):
+        with self.app_context:
+            for i in range(5):
+                db.session.add(
+                    Student(name=f"Student {i}", parent_phone_number="1234567890")
+                )
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.teacher_token}"}
+            response = self.client.get("/api/students?limit=2", headers=headers)
+            first = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(first["items"]), 2)
+            self.assertIsNotNone(first["next_cursor"])
+
+            seen = [student["id"] for student in first["items"]]
+            cursor = first["next_cursor"]
+            while cursor is not None:
+                response = self.client.get(
+                    f"/api/students?limit=2&after={cursor}", headers=headers
+                )
+                page = json.loads(response.data)
+                seen.extend(student["id"] for student in page["items"])
+                cursor = page["next_cursor"]
+            self.assertEqual(seen, sorted(seen))
+            self.assertEqual(len(seen), 5)
+
+    def test_get_groups_page_size_is_capped(self):
+        with self.app_context:
+            for i in range(MAX_PAGE_SIZE + 1):
+                db.session.add(Group(title=f"Group {i}", group_cost=100))
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.get("/api/groups?limit=100000", headers=headers)
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data["items"]), MAX_PAGE_SIZE)
+            self.assertEqual(data["next_cursor"], data["items"][-1]["id"])
+
+    def test_get_students_fail_invalid_limit(self):
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        response = self.client.get("/api/students?limit=abc", headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_groups_default_is_shallow(self):
+        with self.app_context:
+            self.seed_groups(2, 3)
+
+            headers = {"Authorization": f"Bearer {self.teacher_token}"}
+            response = self.client.get("/api/groups", headers=headers)
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("students", data[0])
+            self.assertEqual(data[0]["student_count"], 6)
+
+    def test_get_groups_fields_and_expand(self):
+        with self.app_context:
+            self.seed_groups(2, 3)
+
+            headers = {"Authorization": f"Bearer {self.teacher_token}"}
+            response = self.client.get("/api/groups?fields=id,title", headers=headers)
+            data = json.loads(response.data)
+            self.assertEqual(set(data[0]), {"id", "title"})
+
+            response = self.client.get(
+                "/api/groups?expand=students.payments", headers=headers
+            )
+            data = json.loads(response.data)
+            self.assertEqual(len(data[0]["students"]), 6)
+            self.assertIn("payments", data[0]["students"][0])
+            self.assertNotIn("groups", data[0]["students"][0])
+
+            # Expanded but not selected: the students are not loaded at all
+            with count_queries() as statements:
+                response = self.client.get(
+                    "/api/groups?fields=id,student_count&expand=students.payments",
+                    headers=headers,
+                )
+            data = json.loads(response.data)
+            self.assertEqual(set(data[0]), {"id", "student_count"})
+            self.assertEqual(data[0]["student_count"], 6)
+            self.assertFalse([s for s in statements if "FROM students" in s])
+            self.assertFalse([s for s in statements if "FROM payments" in s])
+
+    def test_get_group_detail_keeps_full_shape(self):
+        with self.app_context:
+            group_id, _ = self.seed_groups(2, 3)
+            expected = db.session.get(Group, group_id).to_dict()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.get(f"/api/groups/{group_id}", headers=headers)
+            data = json.loads(response.data)
+
+            self.assertEqual(data["students"], expected["students"])
+
+    def test_get_students_fail_unknown_field(self):
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        response = self.client.get("/api/students?fields=password", headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_students_stream_matches_list(self):
+        with self.app_context:
+            self.seed_groups(2, 3)
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            expected = json.loads(
+                self.client.get("/api/students?expand=groups", headers=headers).data
+            )
+            response = self.client.get(
+                "/api/students?expand=groups&stream=1", headers=headers
+            )
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "application/json")
+            self.assertEqual(json.loads(response.data), expected)
+
+    def test_get_groups_ndjson(self):
+        with self.app_context:
+            self.seed_groups(3, 2)
+
+            headers = {
+                "Authorization": f"Bearer {self.teacher_token}",
+                "Accept": "application/x-ndjson",
+            }
+            response = self.client.get("/api/groups", headers=headers)
+            lines = response.data.decode().splitlines()
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "application/x-ndjson")
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(json.loads(lines[0])["student_count"], 4)
+
+    def test_payments_update_monthly_ledger(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            student.groups.append(group)
+            db.session.add_all([group, student])
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            url = f"/api/students/{student.id}/payments"
+            first = json.loads(
+                self.client.post(url, json={"amount": 60}, headers=headers).data
+            )
+            self.client.post(url, json={"amount": 40}, headers=headers)
+
+            status = json.loads(
+                self.client.get(
+                    f"/api/students/{student.id}/payment_status", headers=headers
+                ).data
+            )
+            self.assertEqual(status, {"status": "PAID", "pending_amount": 0})
+
+            self.client.delete(f"{url}/{first['id']}", headers=headers)
+            status = json.loads(
+                self.client.get(
+                    f"/api/students/{student.id}/payment_status", headers=headers
+                ).data
+            )
+            self.assertEqual(status, {"status": "PENDING", "pending_amount": 60})
+            self.assertEqual(check_ledger(), [])
+
+    def test_rebuild_ledger_restores_consistency(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            student.payments = [
+                Payment(
+                    amount=30, group_cost_at_payment=100, date=datetime(2024, 1, 5)
+                ),
+                Payment(
+                    amount=20, group_cost_at_payment=100, date=datetime(2024, 1, 9)
+                ),
+                Payment(
+                    amount=50, group_cost_at_payment=100, date=datetime(2024, 2, 1)
+                ),
+            ]
+            db.session.add(student)
+            db.session.commit()
+            self.assertEqual(len(check_ledger()), 2)
+
+            self.assertEqual(rebuild_ledger(), 2)
+            self.assertEqual(check_ledger(), [])
+            january = db.session.get(
+                StudentMonthlyBalance, (student.id, datetime(2024, 1, 1).date())
+            )
+            self.assertEqual(january.total_paid, 50)
+            self.assertEqual(january.payment_count, 2)
+
+    def test_rebuild_ledger_single_month(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            student.payments = [
+                Payment(
+                    amount=30, group_cost_at_payment=100, date=datetime(2024, 1, 31, 23)
+                ),
+                Payment(
+                    amount=50, group_cost_at_payment=100, date=datetime(2024, 2, 1)
+                ),
+            ]
+            db.session.add(student)
+            db.session.commit()
+
+            self.assertEqual(rebuild_ledger(datetime(2024, 1, 1)), 1)
+            self.assertEqual(check_ledger(datetime(2024, 1, 1)), [])
+            self.assertEqual(len(check_ledger(datetime(2024, 2, 1))), 1)
+
+            runner = app.test_cli_runner()
+            result = runner.invoke(check_ledger_command, ["--month", "2024-01"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            for command in (rebuild_ledger_command, check_ledger_command):
+                result = runner.invoke(command, ["--month", "January"])
+                self.assertEqual(result.exit_code, 2)
+                self.assertIn("YYYY-MM", result.output)
+
+    def test_bulk_create_students_json(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            db.session.add(group)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            rows = [
+                {
+                    "name": "Student A",
+                    "parent_phone_number": "1",
+                    "group_ids": [group.id],
+                },
+                {"name": "Student B", "parent_phone_number": "2"},
+            ]
+            response = self.client.post(
+                "/api/students/bulk", json=rows, headers=headers
+            )
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(data["created"], 2)
+            self.assertEqual(len(db.session.get(Group, group.id).students), 1)
+
+    def test_bulk_create_students_batches_inserts(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            db.session.add(group)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            # Duplicates in other groups must still get their own memberships
+            rows = [
+                {
+                    "name": f"Student {i % 10}",
+                    "parent_phone_number": "1",
+                    "group_ids": [group.id] if i % 2 else [],
+                }
+                for i in range(50)
+            ]
+            with count_queries() as statements:
+                response = self.client.post(
+                    "/api/students/bulk", json=rows, headers=headers
+                )
+            self.assertEqual(response.status_code, 201)
+            inserts = [s for s in statements if s.startswith("INSERT INTO students")]
+            self.assertEqual(len(inserts), 1)
+
+            ids = response.get_json()["ids"]
+            self.assertEqual(len(set(ids)), 50)
+            members = {
+                student.id for student in db.session.get(Group, group.id).students
+            }
+            self.assertEqual(members, set(ids[1::2]))
+            names = dict(db.session.query(Student.id, Student.name))
+            self.assertEqual([names[id] for id in ids], [row["name"] for row in rows])
+
+    def test_bulk_create_students_csv(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            db.session.add(group)
+            db.session.commit()
+
+            headers = {
+                "Authorization": f"Bearer {self.admin_token}",
+                "Content-Type": "text/csv",
+            }
+            body = (
+                "name,parent_phone_number,group_ids\n"
+                f"Student A,1,{group.id}\nStudent B,2,\n"
+            )
+            response = self.client.post(
+                "/api/students/bulk", data=body, headers=headers
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(json.loads(response.data)["created"], 2)
+            self.assertEqual(len(db.session.get(Group, group.id).students), 1)
+
+            body = "name,parent_phone_number,group_ids\nStudent C,3,1.0\n"
+            response = self.client.post(
+                "/api/students/bulk", data=body, headers=headers
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_students_fail_reports_rows(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            db.session.add(group)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            rows = [
+                {"name": "Student A", "parent_phone_number": "1"},
+                {"name": "", "parent_phone_number": "2"},
+                {"name": "Student C", "parent_phone_number": "3", "group_ids": [999]},
+            ]
+            # Not coerced into group ids
+            rows += [
+                {"name": "Student D", "parent_phone_number": "4", "group_ids": [value]}
+                for value in (group.id + 0.9, True, str(group.id))
+            ]
+            response = self.client.post(
+                "/api/students/bulk", json=rows, headers=headers
+            )
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                [error["row"] for error in data["errors"]], [2, 3, 4, 5, 6]
+            )
+            for error in data["errors"][2:]:
+                self.assertIn("list of integers", error["errors"]["group_ids"])
+            self.assertEqual(Student.query.count(), 0)
+
+    def test_bulk_create_students_fail_teacher(self):
+        headers = {"Authorization": f"Bearer {self.teacher_token}"}
+        rows = [{"name": "Student A", "parent_phone_number": "1"}]
+        response = self.client.post("/api/students/bulk", json=rows, headers=headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_add_payments_all_or_nothing(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add(student)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            records = [
+                {"student_id": student.id, "amount": 100},
+                {"student_id": 999, "amount": 100},
+            ]
+            response = self.client.post(
+                "/api/payments/bulk", json=records, headers=headers
+            )
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                [result["status"] for result in data["results"]], ["skipped", "error"]
+            )
+            self.assertEqual(Payment.query.count(), 0)
+
+    def test_bulk_add_payments_best_effort(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            student.groups.append(group)
+            db.session.add_all([group, student])
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            records = [
+                {"student_id": student.id, "amount": 60},
+                {"student_id": student.id, "amount": "forty"},
+                {"student_id": student.id, "amount": 40},
+                {"student_id": student.id, "amount": True},
+                {"student_id": True, "amount": 40},
+            ]
+            response = self.client.post(
+                "/api/payments/bulk?mode=best_effort", json=records, headers=headers
+            )
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(data["created"], 2)
+            self.assertEqual(
+                [result["status"] for result in data["results"]],
+                ["created", "error", "created", "error", "error"],
+            )
+            self.assertIn("amount", data["results"][3]["errors"])
+            self.assertIn("student_id", data["results"][4]["errors"])
+            self.assertEqual(
+                data["results"][0]["payment"]["group_cost_at_payment"], 100
+            )
+            status = json.loads(
+                self.client.get(
+                    f"/api/students/{student.id}/payment_status", headers=headers
+                ).data
+            )
+            self.assertEqual(status["status"], "PAID")
+
+    def test_bulk_add_payments_inserts_in_one_statement(self):
+        with self.app_context:
+            students = [
+                Student(name=f"Student {i}", parent_phone_number="1") for i in range(5)
+            ]
+            db.session.add_all(students)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            records = [
+                {
+                    "student_id": students[i % 5].id,
+                    "amount": 10 * (i % 3 + 1),
+                    "date": "2024-05-01T10:00:00",
+                }
+                for i in range(50)
+            ]
+            with count_queries() as statements:
+                response = self.client.post(
+                    "/api/payments/bulk", json=records, headers=headers
+                )
+            self.assertEqual(response.status_code, 201)
+            inserts = [s for s in statements if s.startswith("INSERT INTO payments")]
+            self.assertEqual(len(inserts), 1)
+
+            payments = [result["payment"] for result in response.get_json()["results"]]
+            self.assertEqual(len({payment["id"] for payment in payments}), 50)
+            for record, payment in zip(records, payments):
+                stored = db.session.get(Payment, payment["id"])
+                self.assertEqual(
+                    (stored.student_id, stored.amount),
+                    (record["student_id"], record["amount"]),
+                )
+            self.assertEqual(check_ledger(), [])
+
+    def test_set_student_groups_applies_diff(self):
+        with self.app_context:
+            groups = [Group(title=f"Group {i}", group_cost=100) for i in range(3)]
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            student.groups = groups[:2]
+            db.session.add_all(groups + [student])
+            db.session.commit()
+            ids = [group.id for group in groups]
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            with count_queries() as statements:
+                response = self.client.put(
+                    f"/api/students/{student.id}/groups",
+                    json={"group_ids": ids[1:]},
+                    headers=headers,
+                )
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data["group_ids"], ids[1:])
+            self.assertEqual(data["added"], [ids[2]])
+            self.assertEqual(data["removed"], [ids[0]])
+            writes = [s for s in statements if s.split()[0] in ("INSERT", "DELETE")]
+            self.assertEqual(len(writes), 2)
+
+    def test_set_student_groups_fail_unknown_group(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add(student)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.put(
+                f"/api/students/{student.id}/groups",
+                json={"group_ids": [999]},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data)["missing"], [999])
+
+    def test_set_student_groups_fail_boolean_ids(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add_all([group, student])
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.put(
+                f"/api/students/{student.id}/groups",
+                json={"group_ids": [True]},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(db.session.get(Student, student.id).groups, [])
+
+    def test_set_group_students(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            students = [
+                Student(name=f"Student {i}", parent_phone_number="1") for i in range(3)
+            ]
+            db.session.add_all([group] + students)
+            db.session.commit()
+            ids = [student.id for student in students]
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.put(
+                f"/api/groups/{group.id}/students",
+                json={"student_ids": ids},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(db.session.get(Group, group.id).students), 3)
+
+    def test_set_group_students_fail_teacher(self):
+        headers = {"Authorization": f"Bearer {self.teacher_token}"}
+        response = self.client.put(
+            "/api/groups/1/students", json={"student_ids": []}, headers=headers
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_add_student_to_group_twice(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add_all([group, student])
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            for _ in range(2):
+                response = self.client.post(
+                    f"/api/groups/{group.id}/students",
+                    json={"student_id": student.id},
+                    headers=headers,
+                )
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(db.session.get(Group, group.id).students), 1)
+
+    def test_get_student_conditional_get(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add(student)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            url = f"/api/students/{student.id}"
+            response = self.client.get(url, headers=headers)
+            etag = response.headers["ETag"]
+            self.assertEqual(
+                response.last_modified.timestamp(), student.version // 1_000_000
+            )
+
+            cached = self.client.get(url, headers={**headers, "If-None-Match": etag})
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.data, b"")
+
+            self.client.post(f"{url}/payments", json={"amount": 100}, headers=headers)
+            response = self.client.get(url, headers={**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_get_groups_etag_changes_on_write(self):
+        with self.app_context:
+            self.seed_groups(2, 2)
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            etag = self.client.get("/api/groups", headers=headers).headers["ETag"]
+            conditional = {**headers, "If-None-Match": etag}
+            response = self.client.get("/api/groups", headers=conditional)
+            self.assertEqual(response.status_code, 304)
+
+            self.client.patch(
+                "/api/groups/1", json={"group_cost": 250}, headers=headers
+            )
+            response = self.client.get("/api/groups", headers=conditional)
+            self.assertEqual(response.status_code, 200)
+
+    def test_get_groups_etag_changes_within_the_same_second(self):
+        with self.app_context:
+            db.session.add_all(
+                [Group(title=f"Group {i}", group_cost=100) for i in range(3)]
+            )
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = self.client.get("/api/groups", headers=headers)
+            conditional = {
+                **headers,
+                "If-None-Match": response.headers["ETag"],
+                "If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT",
+            }
+            self.assertEqual(
+                self.client.get("/api/groups", headers=conditional).status_code, 304
+            )
+
+            # A delete that leaves the newest stamp in place
+            self.client.delete("/api/groups/1", headers=headers)
+            response = self.client.get("/api/groups", headers=conditional)
+            self.assertEqual(response.status_code, 200)
+
+            # An update committed with an older stamp, as from another process
+            conditional["If-None-Match"] = response.headers["ETag"]
+            with mock.patch("versioning.change_stamp", return_value=1):
+                db.session.get(Group, 2).title = "Renamed"
+                db.session.commit()
+            response = self.client.get("/api/groups", headers=conditional)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()[0]["title"], "Renamed")
+
+            del conditional["If-None-Match"]
+            response = self.client.get("/api/groups", headers=conditional)
+            self.assertEqual(response.status_code, 200)
+
+    def test_list_validators_read_only_the_change_counter(self):
+        with self.app_context:
+            self.seed_groups(2, 2)
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            etag = self.client.get("/api/students", headers=headers).headers["ETag"]
+            conditional = {**headers, "If-None-Match": etag}
+            with count_queries() as statements:
+                response = self.client.get("/api/students", headers=conditional)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(statements), 1)
+            self.assertIn("table_versions", statements[0])
+
+            # Bulk inserts bypass the ORM but still count as a change
+            rows = [{"name": "New Student", "parent_phone_number": "1234567890"}]
+            self.client.post("/api/students/bulk", json=rows, headers=headers)
+            response = self.client.get("/api/students", headers=conditional)
+            self.assertEqual(response.status_code, 200)
+
+    def test_get_group_etag_changes_on_membership(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add_all([group, student])
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            url = f"/api/groups/{group.id}"
+            etag = self.client.get(url, headers=headers).headers["ETag"]
+            self.client.put(
+                f"/api/students/{student.id}/groups",
+                json={"group_ids": [group.id]},
+                headers=headers,
+            )
+            response = self.client.get(url, headers={**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(json.loads(response.data)["students"]), 1)
+
+    def test_get_student_is_served_from_cache_until_a_write(self):
+        with self.app_context:
+            student = Student(name="Test Student", parent_phone_number="1234567890")
+            db.session.add(student)
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            url = f"/api/students/{student.id}"
+            self.assertEqual(
+                self.client.get(url, headers=headers).headers["X-Cache"], "MISS"
+            )
+            with count_queries() as statements:
+                response = self.client.get(url, headers=headers)
+            self.assertEqual(response.headers["X-Cache"], "HIT")
+            self.assertEqual(statements, [])
+
+            cached = self.client.get(
+                url, headers={**headers, "If-None-Match": response.headers["ETag"]}
+            )
+            self.assertEqual(cached.status_code, 304)
+
+            self.client.post(f"{url}/payments", json={"amount": 100}, headers=headers)
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.headers["X-Cache"], "MISS")
+            self.assertEqual(len(json.loads(response.data)["payments"]), 1)
+
+    def test_group_update_only_invalidates_affected_entries(self):
+        with self.app_context:
+            db.session.add_all(
+                [
+                    Group(title="Group A", group_cost=100),
+                    Group(title="Group B", group_cost=100),
+                ]
+            )
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            for url in ("/api/groups", "/api/groups/1", "/api/groups/2"):
+                self.client.get(url, headers=headers)
+
+            self.client.patch(
+                "/api/groups/1", json={"group_cost": 250}, headers=headers
+            )
+            cache = {
+                url: self.client.get(url, headers=headers).headers["X-Cache"]
+                for url in ("/api/groups", "/api/groups/1", "/api/groups/2")
+            }
+            self.assertEqual(
+                cache,
+                {
+                    "/api/groups": "MISS",
+                    "/api/groups/1": "MISS",
+                    "/api/groups/2": "HIT",
+                },
+            )
+            response = self.client.get("/api/groups/1", headers=headers)
+            self.assertEqual(json.loads(response.data)["group_cost"], 250)
+
+    def test_cache_is_scoped_by_permissions(self):
+        with self.app_context:
+            db.session.add(Group(title="Test Group", group_cost=100))
+            db.session.commit()
+
+            admin = {"Authorization": f"Bearer {self.admin_token}"}
+            teacher = {"Authorization": f"Bearer {self.teacher_token}"}
+            self.client.get("/api/groups", headers=admin)
+            response = self.client.get("/api/groups", headers=teacher)
+            self.assertEqual(response.headers["X-Cache"], "MISS")
+
+    def test_get_cache_stats(self):
+        with self.app_context:
+            db.session.add(Group(title="Test Group", group_cost=100))
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            before = json.loads(
+                self.client.get("/api/cache/stats", headers=headers).data
+            )
+            self.client.get("/api/groups/1", headers=headers)
+            self.client.get("/api/groups/1", headers=headers)
+            response = self.client.get("/api/cache/stats", headers=headers)
+            stats = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(stats["hits"] - before["hits"], 1)
+            self.assertEqual(stats["misses"] - before["misses"], 1)
+            self.assertIsNotNone(stats["hit_ratio"])
+
+            teacher = {"Authorization": f"Bearer {self.teacher_token}"}
+            response = self.client.get("/api/cache/stats", headers=teacher)
+            self.assertEqual(response.status_code, 403)
+
+    def test_search_students(self):
+        with self.app_context:
+            for name, phone in (
+                ("José Núñez", "5215551234"),
+                ("Josefina Ruiz", "5219998888"),
+                ("Jose", "13335550000"),
+                ("Ana López", "5215550000"),
+            ):
+                db.session.add(Student(name=name, parent_phone_number=phone))
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.teacher_token}"}
+            response = self.client.get("/api/students/search?q=JOSE", headers=headers)
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [student["name"] for student in data["items"]],
+                ["Jose", "José Núñez", "Josefina Ruiz"],
+            )
+            self.assertIsNone(data["next_offset"])
+
+            response = self.client.get("/api/students/search?q=521555", headers=headers)
+            names = {student["name"] for student in json.loads(response.data)["items"]}
+            self.assertEqual(names, {"José Núñez", "Ana López"})
+
+            # SQLite matches prefixes of the whole name only
+            for term, expected in (
+                ("jos", ["Jose", "José Núñez", "Josefina Ruiz"]),
+                ("lop", []),
+                ("ruiz", []),
+            ):
+                response = self.client.get(
+                    f"/api/students/search?q={term}", headers=headers
+                )
+                names = [student["name"] for student in response.get_json()["items"]]
+                self.assertEqual(names, expected, term)
+
+    def test_search_students_uses_the_indexes(self):
+        with self.app_context:
+            for term, indexes in (
+                ("Núñez", {"ix_students_search_name"}),
+                ("5215", {"ix_students_search_name", "ix_students_search_phone"}),
+            ):
+                query = search_query(term, SEARCH_PAGE_SIZE, dialect="sqlite")
+                sql = query.compile(db.engine, compile_kwargs={"literal_binds": True})
+                plan = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+                details = [row[-1] for row in plan]
+                self.assertFalse(
+                    [detail for detail in details if detail.startswith("SCAN")],
+                    details,
+                )
+                for index in indexes:
+                    self.assertTrue(
+                        any(f"INDEX {index} " in detail for detail in details), details
+                    )
+
+    def test_search_students_paginated(self):
+        with self.app_context:
+            for i in range(5):
+                db.session.add(
+                    Student(name=f"Student {i}", parent_phone_number="1234567890")
+                )
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.teacher_token}"}
+            first = json.loads(
+                self.client.get(
+                    "/api/students/search?q=stu&limit=3", headers=headers
+                ).data
+            )
+            self.assertEqual(len(first["items"]), 3)
+            self.assertEqual(first["next_offset"], 3)
+            second = json.loads(
+                self.client.get(
+                    "/api/students/search?q=stu&limit=3&offset=3", headers=headers
+                ).data
+            )
+            self.assertEqual(len(second["items"]), 2)
+            self.assertIsNone(second["next_offset"])
+
+    def test_search_students_requires_query(self):
+        with self.app_context:
+            headers = {"Authorization": f"Bearer {self.teacher_token}"}
+            response = self.client.get("/api/students/search?q=%20", headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_metrics_record_requests_sql_and_auth(self):
+        with self.app_context:
+            db.session.add(Group(title="Test Group", group_cost=100))
+            db.session.commit()
+
+            labels = (("endpoint", "get_group"), ("method", "GET"))
+            before = scrape_metrics(self.client)
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            self.client.get("/api/groups/1?fields=id", headers=headers)
+            after = scrape_metrics(self.client)
+
+            def delta(name, labels):
+                return after.get((name, labels), 0) - before.get((name, labels), 0)
+
+            self.assertEqual(
+                delta("http_requests_total", labels + (("status", "200"),)), 1
+            )
+            self.assertEqual(delta("http_request_duration_seconds_count", labels), 1)
+            self.assertGreaterEqual(delta("http_request_sql_statements_sum", labels), 1)
+            self.assertGreater(delta("http_response_size_bytes_sum", labels), 0)
+            jwt_count = sum(
+                delta("jwt_verification_duration_seconds_count", (("token_cache", c),))
+                for c in ("hit", "miss")
+            )
+            self.assertEqual(jwt_count, 1)
+
+    def test_metrics_record_pool_checkouts(self):
+        with self.app_context:
+            labels = (("pool", "primary"),)
+            before = scrape_metrics(self.client)
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            self.client.get("/api/groups", headers=headers)
+            after = scrape_metrics(self.client)
+
+            def delta(name):
+                return after.get((name, labels), 0) - before.get((name, labels), 0)
+
+            self.assertGreaterEqual(delta("db_pool_checkouts_total"), 1)
+            self.assertGreaterEqual(delta("db_pool_checkout_wait_seconds_count"), 1)
+
+    def test_metrics_token(self):
+        with mock.patch("metrics.METRICS_TOKEN", "scrape-secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            response = self.client.get(
+                "/metrics", headers={"Authorization": "Bearer scrape-secret"}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("text/plain", response.content_type)
+
+    def test_profile_request_on_demand(self):
+        with self.app_context, tempfile.TemporaryDirectory() as profile_dir:
+            with mock.patch("profiling.PROFILE_DIR", profile_dir):
+                headers = {"Authorization": f"Bearer {self.admin_token}"}
+                response = self.client.get(
+                    "/api/groups", headers={**headers, "X-Profile": "1"}
+                )
+                profile_id = response.headers["X-Profile-Id"]
+                self.assertEqual(response.status_code, 200)
+
+                response = self.client.get("/api/profiles", headers=headers)
+                profiles = json.loads(response.data)
+                self.assertEqual([p["id"] for p in profiles], [profile_id])
+                self.assertEqual(profiles[0]["endpoint"], "get_groups")
+
+                response = self.client.get(
+                    f"/api/profiles/{profile_id}/pstats", headers=headers
+                )
+                self.assertEqual(response.status_code, 200)
+                path = os.path.join(profile_dir, "download.pstats")
+                with open(path, "wb") as f:
+                    f.write(response.data)
+                self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+                response = self.client.get(
+                    f"/api/profiles/{profile_id}/collapsed", headers=headers
+                )
+                self.assertEqual(response.status_code, 200)
+
+                response = self.client.get(
+                    "/api/profiles/..%2F..%2Fetc/pstats", headers=headers
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_profile_requires_permission(self):
+        with self.app_context, tempfile.TemporaryDirectory() as profile_dir:
+            with mock.patch("profiling.PROFILE_DIR", profile_dir):
+                headers = {
+                    "Authorization": f"Bearer {self.teacher_token}",
+                    "X-Profile": "1",
+                }
+                response = self.client.get("/api/groups", headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("X-Profile-Id", response.headers)
+                self.assertEqual(os.listdir(profile_dir), [])
+
+                response = self.client.get("/api/profiles", headers=headers)
+                self.assertEqual(response.status_code, 403)
+
+    def test_profile_one_request_at_a_time(self):
+        with self.app_context, tempfile.TemporaryDirectory() as profile_dir:
+            with mock.patch("profiling.PROFILE_DIR", profile_dir):
+                headers = {
+                    "Authorization": f"Bearer {self.admin_token}",
+                    "X-Profile": "1",
+                }
+                # Another thread is being profiled: this request runs as usual
+                with profiling._profiler_lock:
+                    response = self.client.get("/api/groups", headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("X-Profile-Id", response.headers)
+                self.assertEqual(os.listdir(profile_dir), [])
+
+                response = self.client.get("/api/groups", headers=headers)
+                self.assertIn("X-Profile-Id", response.headers)
+
+    def test_profile_ring_is_bounded(self):
+        with self.app_context, tempfile.TemporaryDirectory() as profile_dir:
+            with mock.patch.multiple(
+                "profiling", PROFILE_DIR=profile_dir, PROFILE_KEEP=2
+            ):
+                headers = {
+                    "Authorization": f"Bearer {self.admin_token}",
+                    "X-Profile": "1",
+                }
+                ids = [
+                    self.client.get("/api/groups", headers=headers).headers[
+                        "X-Profile-Id"
+                    ]
+                    for _ in range(3)
+                ]
+                response = self.client.get("/api/profiles", headers=headers)
+                listed = [p["id"] for p in json.loads(response.data)]
+                self.assertEqual(listed[-2:], ids[:0:-1])
+                self.assertNotIn(ids[0], listed)
+
+    def test_asgi_views_match_wsgi(self):
+        with self.app_context:
+            group = Group(title="Test Group", group_cost=100)
+            group.students.append(
+                Student(name="Ana López", parent_phone_number="1234567890")
+            )
+            db.session.add(group)
+            db.session.add(Group(title="Empty", group_cost=50))
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            paths = [
+                "/api/groups",
+                "/api/groups?limit=1",
+                "/api/groups?expand=students.payments",
+                "/api/groups/1",
+                "/api/groups/2?fields=title,student_count",
+                "/api/groups/99",
+                "/api/students/1",
+                "/api/students/search?q=ana",
+                "/api/students/search?q=%20",
+                "/api/groups?stream=1",
+                "/api/students",
+            ]
+            served = run_asgi(*[("GET", path, headers) for path in paths])
+            for path, (status, response_headers, body) in zip(paths, served):
+                expected = self.client.get(path, headers=headers)
+                self.assertEqual(status, expected.status_code, path)
+                self.assertEqual(json.loads(body), expected.get_json(), path)
+                self.assertEqual(
+                    response_headers.get("etag"), expected.headers.get("ETag"), path
+                )
+
+            ((status, _, body),) = run_asgi(("GET", "/api/groups", {}))
+            self.assertEqual(status, 401)
+            self.assertEqual(json.loads(body)["error"], "authorization_header_missing")
+
+    def test_asgi_conditional_get(self):
+        with self.app_context:
+            db.session.add(Group(title="Test Group", group_cost=100))
+            db.session.commit()
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            ((status, response_headers, _),) = run_asgi(
+                ("GET", "/api/groups/1", headers)
+            )
+            self.assertEqual(status, 200)
+            ((status, _, body),) = run_asgi(
+                (
+                    "GET",
+                    "/api/groups/1",
+                    {**headers, "If-None-Match": response_headers["etag"]},
+                )
+            )
+            self.assertEqual(status, 304)
+            self.assertEqual(body, b"")
+
+    def test_asgi_writes_use_wsgi_app(self):
+        with self.app_context:
+            headers = {
+                "Authorization": f"Bearer {self.admin_token}",
+                "Content-Type": "application/json",
+            }
+            body = json.dumps({"title": "New Group", "group_cost": 150}).encode()
+            (status, _, data), (list_status, _, listed) = run_asgi(
+                ("POST", "/api/groups", headers, body),
+                ("GET", "/api/cache/stats", headers),
+            )
+            self.assertEqual(status, 201)
+            self.assertEqual(json.loads(data)["title"], "New Group")
+            self.assertEqual(list_status, 200)
+            self.assertEqual(Group.query.count(), 1)
+
+    def test_asgi_streams_wsgi_responses(self):
+        with self.app_context:
+            db.session.add_all(
+                Group(title=f"Group {i}", group_cost=100) for i in range(3)
+            )
+            db.session.commit()
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            ((status, response_headers, body),) = run_asgi(
+                ("GET", "/api/groups?stream=1", headers)
+            )
+            self.assertEqual(status, 200)
+            self.assertNotIn("content-length", response_headers)
+            self.assertEqual(len(json.loads(body)), 3)
+
+    def test_asgi_requests_run_concurrently(self):
+        with self.app_context:
+            db.session.add(Group(title="Test Group", group_cost=100))
+            db.session.commit()
+
+            in_flight = [0]
+            peak = [0]
+            view = asgi.ASYNC_VIEWS["get_group"]
+
+            async def counting_view(**kwargs):
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+                try:
+                    return await view(**kwargs)
+                finally:
+                    in_flight[0] -= 1
+
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            with mock.patch.dict(asgi.ASYNC_VIEWS, get_group=counting_view):
+                served = run_asgi(*[("GET", "/api/groups/1", headers)] * 20)
+
+            self.assertEqual({status for status, _, _ in served}, {200})
+            self.assertEqual(len({body for _, _, body in served}), 1)
+            self.assertGreater(peak[0], 1)
+
+    def test_async_database_url(self):
+        self.assertEqual(
+            asgi.async_database_url("sqlite:////tmp/app.db").drivername,
+            "sqlite+aiosqlite",
+        )
+        url = asgi.async_database_url("postgresql://u:p@db/app?sslmode=require")
+        self.assertEqual(url.drivername, "postgresql+asyncpg")
+        self.assertEqual(dict(url.query), {"ssl": "require"})
+
+
+class TestMonthWindow(unittest.TestCase):
+    def test_month_window_is_half_open(self):
+        start, end = month_window(datetime(2024, 2, 29, 23, 59))
+        self.assertEqual(start, datetime(2024, 2, 1))
+        self.assertEqual(end, datetime(2024, 3, 1))
+
+    def test_month_window_december_rolls_over(self):
+        start, end = month_window(datetime(2023, 12, 15))
+        self.assertEqual(start, datetime(2023, 12, 1))
+        self.assertEqual(end, datetime(2024, 1, 1))
+
+
+class FakeJWKSResponse:
+    def __init__(self, kids):
+        self.kids = kids
+
+    def read(self):
+        keys = [
+            {"kty": "RSA", "kid": kid, "use": "sig", "n": "n", "e": "AQAB"}
+            for kid in self.kids
+        ]
+        return json.dumps({"keys": keys}).encode()
+
+
+class TestJWKSCache(unittest.TestCase):
+    def test_keys_are_fetched_once(self):
+        cache = JWKSCache("https://example.test/.well-known/jwks.json")
+        with mock.patch("auth.urlopen", return_value=FakeJWKSResponse(["a"])) as m:
+            for _ in range(5):
+                self.assertEqual(cache.get_key("a")["kid"], "a")
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(cache.stats()["hits"], 5)
+
+    def test_unknown_kid_refetches_once_within_cooldown(self):
+        cache = JWKSCache("https://example.test/.well-known/jwks.json", cooldown=60)
+        with mock.patch("auth.urlopen", return_value=FakeJWKSResponse(["a"])) as m:
+            cache.get_key("a")
+            m.return_value = FakeJWKSResponse(["a", "b"])
+            cache._last_attempt -= 120
+            self.assertEqual(cache.get_key("b")["kid"], "b")
+            self.assertIsNone(cache.get_key("c"))
+            self.assertIsNone(cache.get_key("c"))
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(cache.stats()["misses"], 3)
+
+    def test_stale_keys_are_served_when_refresh_fails(self):
+        cache = JWKSCache("https://example.test/.well-known/jwks.json", cooldown=0)
+        with mock.patch("auth.urlopen", return_value=FakeJWKSResponse(["a"])) as m:
+            cache.get_key("a")
+            m.side_effect = OSError("identity provider unavailable")
+            cache.refresh(force=True)
+            self.assertEqual(cache.get_key("a")["kid"], "a")
+        self.assertEqual(cache.stats()["refresh_failures"], 1)
+
+    def test_cold_fetch_failure_raises_auth_error(self):
+        cache = JWKSCache("https://example.test/.well-known/jwks.json")
+        with mock.patch("auth.urlopen", side_effect=OSError("down")):
+            with self.assertRaises(AuthError) as ctx:
+                cache.get_key("a")
+        self.assertEqual(ctx.exception.status_code, 500)
+
+
+class TestTokenCache(unittest.TestCase):
+    def test_hit_returns_cached_payload(self):
+        cache = TokenCache(maxsize=2)
+        payload = {"sub": "a", "exp": time.time() + 60}
+        cache.set("token-a", payload)
+        self.assertIs(cache.get("token-a"), payload)
+        self.assertIsNone(cache.get("token-b"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_expired_entries_are_dropped(self):
+        cache = TokenCache()
+        cache.set("token-a", {"sub": "a", "exp": time.time() - 1})
+        self.assertIsNone(cache.get("token-a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TokenCache(maxsize=2)
+        exp = time.time() + 60
+        cache.set("token-a", {"sub": "a", "exp": exp})
+        cache.set("token-b", {"sub": "b", "exp": exp})
+        cache.get("token-a")
+        cache.set("token-c", {"sub": "c", "exp": exp})
+        self.assertIsNotNone(cache.get("token-a"))
+        self.assertIsNone(cache.get("token-b"))
+        self.assertIsNotNone(cache.get("token-c"))
+
+    def test_payload_without_exp_is_not_cached(self):
+        cache = TokenCache()
+        cache.set("token-a", {"sub": "a"})
+        self.assertIsNone(cache.get("token-a"))
+
+
+class TestPooling(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{os.path.join(self.directory.name, 'pool.db')}"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def sample(self, name, pool):
+        return REGISTRY.get_sample_value(name, {"pool": pool}) or 0
+
+    def test_engine_options_from_environment(self):
+        with mock.patch.multiple(
+            "pooling",
+            DB_POOL_SIZE=20,
+            DB_MAX_OVERFLOW=5,
+            DB_POOL_RECYCLE=1800,
+            DB_STATEMENT_TIMEOUT=15000,
+        ):
+            options = engine_options("postgresql://u:p@db/app", "primary")
+            async_options = engine_options("postgresql+asyncpg://u:p@db/app", "a")
+            memory = engine_options("sqlite:///:memory:", "primary")
+
+        self.assertEqual(options["pool_size"], 20)
+        self.assertEqual(options["max_overflow"], 5)
+        self.assertEqual(options["pool_recycle"], 1800)
+        self.assertNotIn("pool_timeout", options)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(
+            options["connect_args"], {"options": "-c statement_timeout=15000"}
+        )
+        self.assertEqual(
+            async_options["connect_args"],
+            {"server_settings": {"statement_timeout": "15000"}},
+        )
+        self.assertEqual(memory, {"pool_logging_name": "primary"})
+
+    def test_pool_reports_overflow_and_timeouts(self):
+        with mock.patch.multiple(
+            "pooling", DB_POOL_SIZE=1, DB_MAX_OVERFLOW=1, DB_POOL_TIMEOUT=0.01
+        ):
+            engine = create_engine(self.url, **engine_options(self.url, "test-pool"))
+        overflow_before = self.sample("db_pool_overflow_checkouts_total", "test-pool")
+        timeouts_before = self.sample("db_pool_timeouts_total", "test-pool")
+        try:
+            with engine.connect(), engine.connect():
+                self.assertEqual(self.sample("db_pool_checked_out", "test-pool"), 2)
+                self.assertEqual(self.sample("db_pool_overflow_in_use", "test-pool"), 1)
+                with self.assertRaises(exc.TimeoutError):
+                    engine.connect()
+            self.assertEqual(self.sample("db_pool_checked_out", "test-pool"), 0)
+            self.assertEqual(
+                self.sample("db_pool_overflow_checkouts_total", "test-pool")
+                - overflow_before,
+                1,
+            )
+            self.assertEqual(
+                self.sample("db_pool_timeouts_total", "test-pool") - timeouts_before,
+                1,
+            )
+        finally:
+            engine.dispose()
+
+    def test_warm_up_fills_the_pool(self):
+        with mock.patch("pooling.DB_POOL_SIZE", 3):
+            engine = create_engine(self.url, **engine_options(self.url, "warm"))
+        try:
+            self.assertEqual(warm_up(engine, 10), 3)
+            self.assertEqual(engine.pool.checkedin(), 3)
+            with engine.connect() as connection:
+                self.assertEqual(connection.execute(text("SELECT 1")).scalar(), 1)
+        finally:
+            engine.dispose()
+
+
+class TestReadReplicas(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.client = app.test_client()
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add(Group(title="Primary", group_cost=100))
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {os.getenv('ADMIN_JWT_TOKEN')}"}
+        # Every GET reaches the database
+        patcher = mock.patch.object(response_cache, "backend", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def replica(self, name, title):
+        url = f"sqlite:///{os.path.join(self.directory.name, name)}"
+        engine = create_engine(url)
+        db.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add(Group(title=title, group_cost=100))
+            session.commit()
+        engine.dispose()
+        return url
+
+    def use_replicas(self, *urls):
+        replicas = ReplicaSet(urls, interval=0)
+        patcher = mock.patch("routing.replicas", replicas)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(replicas.dispose)
+        return replicas
+
+    def titles(self):
+        # A fresh session, so no group is served from the identity map
+        db.session.remove()
+        response = self.client.get("/api/groups", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [group["title"] for group in response.get_json()]
+
+    def test_reads_go_to_replicas_in_turn(self):
+        self.use_replicas(self.replica("a.db", "A"), self.replica("b.db", "B"))
+        self.assertEqual(
+            [self.titles() for _ in range(4)], [["A"], ["B"], ["A"], ["B"]]
+        )
+
+        ((status, _, body),) = run_asgi(("GET", "/api/groups", self.headers))
+        self.assertEqual(status, 200)
+        self.assertIn(json.loads(body)[0]["title"], ("A", "B"))
+
+    def test_writes_go_to_the_primary(self):
+        url = self.replica("a.db", "A")
+        self.use_replicas(url)
+        response = self.client.post(
+            "/api/groups", json={"title": "New", "group_cost": 50}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 201)
+        db.session.remove()
+        self.assertEqual(
+            [group.title for group in Group.query.order_by(Group.id)],
+            ["Primary", "New"],
+        )
+        self.assertEqual(self.titles(), ["A"])
+
+    def test_unhealthy_replicas_are_skipped(self):
+        missing = f"sqlite:///{os.path.join(self.directory.name, 'no', 'c.db')}"
+        replicas = self.use_replicas(missing, self.replica("b.db", "B"))
+        self.assertEqual([self.titles() for _ in range(3)], [["B"]] * 3)
+        self.assertEqual(replicas.healthy, [False, True])
+        self.assertEqual(
+            REGISTRY.get_sample_value("db_replica_healthy", {"pool": "replica-1"}), 0
+        )
+
+        self.use_replicas(missing)
+        self.assertEqual(self.titles(), ["Primary"])
+
+    def test_read_your_writes_pins_the_writer_to_the_primary(self):
+        self.use_replicas(self.replica("a.db", "A"))
+        with mock.patch("routing.READ_YOUR_WRITES_SECONDS", 60), mock.patch(
+            "routing.pins", MemoryPins()
+        ) as pins:
+            self.assertEqual(self.titles(), ["A"])
+            self.client.post(
+                "/api/groups",
+                json={"title": "New", "group_cost": 50},
+                headers=self.headers,
+            )
+            self.assertEqual(self.titles(), ["Primary", "New"])
+            pins.clear()
+            self.assertEqual(self.titles(), ["A"])
+
+    def test_cache_keeps_read_your_writes(self):
+        self.use_replicas(self.replica("a.db", "A"))
+        with mock.patch.object(response_cache, "backend", MemoryBackend()), mock.patch(
+            "routing.READ_YOUR_WRITES_SECONDS", 60
+        ), mock.patch("routing.pins", MemoryPins()):
+            self.client.post(
+                "/api/groups",
+                json={"title": "New", "group_cost": 50},
+                headers=self.headers,
+            )
+            # Another client reads the lagging replica; the body is not stored
+            with mock.patch("routing.pins", MemoryPins()):
+                self.assertEqual(self.titles(), ["A"])
+                self.assertEqual(response_cache.backend.size(), 0)
+            # The writer is pinned: no lookup and no store
+            for _ in range(2):
+                db.session.remove()
+                response = self.client.get("/api/groups", headers=self.headers)
+                self.assertEqual(
+                    [group["title"] for group in response.get_json()],
+                    ["Primary", "New"],
+                )
+                self.assertNotIn("X-Cache", response.headers)
+            self.assertEqual(response_cache.backend.size(), 0)
+
+
+class TestGunicornConfig(unittest.TestCase):
+    def load(self, **env):
+        path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py"
+        )
+        with mock.patch.dict(os.environ, env):
+            for name in (
+                "DB_POOL_SIZE",
+                "PROMETHEUS_MULTIPROC_DIR",
+                "CACHE_URL",
+                "DATABASE_REPLICA_URLS",
+                "READ_YOUR_WRITES_SECONDS",
+                "READ_YOUR_WRITES_URL",
+            ):
+                if name not in env:
+                    os.environ.pop(name, None)
+            config = runpy.run_path(path)
+            config["environ"] = dict(os.environ)
+        return config
+
+    def test_sizing_from_environment(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stale = os.path.join(directory, "counter_1.db")
+            open(stale, "w").close()
+            config = self.load(
+                WEB_CONCURRENCY="3",
+                GUNICORN_THREADS="8",
+                GUNICORN_MAX_REQUESTS="500",
+                PROMETHEUS_MULTIPROC_DIR=directory,
+            )
+            self.assertFalse(os.path.exists(stale))
+        self.assertEqual((config["workers"], config["threads"]), (3, 8))
+        self.assertTrue(config["preload_app"])
+        self.assertEqual(config["max_requests"], 500)
+        self.assertEqual(config["max_requests_jitter"], 50)
+        self.assertEqual(config["environ"]["DB_POOL_SIZE"], "8")
+
+        config = self.load(WEB_CONCURRENCY="1", DB_POOL_SIZE="2")
+        self.assertEqual(config["environ"]["DB_POOL_SIZE"], "2")
+        self.assertNotIn("PROMETHEUS_MULTIPROC_DIR", config["environ"])
+
+    def test_several_workers_need_shared_state(self):
+        config = self.load(WEB_CONCURRENCY="3")
+        self.assertEqual(config["environ"]["CACHE_URL"], "none")
+        config = self.load(WEB_CONCURRENCY="3", CACHE_URL="redis://cache:6379/0")
+        self.assertEqual(config["environ"]["CACHE_URL"], "redis://cache:6379/0")
+        config = self.load(WEB_CONCURRENCY="1")
+        self.assertNotIn("CACHE_URL", config["environ"])
+
+        replicas = {
+            "DATABASE_REPLICA_URLS": "postgresql://replica/app",
+            "READ_YOUR_WRITES_SECONDS": "5",
+        }
+        with self.assertRaises(RuntimeError):
+            self.load(WEB_CONCURRENCY="3", **replicas)
+        self.load(WEB_CONCURRENCY="1", **replicas)
+        self.load(
+            WEB_CONCURRENCY="3", READ_YOUR_WRITES_URL="redis://pins:6379/0", **replicas
+        )
+
+    def test_post_fork_replaces_inherited_connections(self):
+        config = self.load(WEB_CONCURRENCY="1")
+        server = SimpleNamespace(cfg=SimpleNamespace(preload_app=True))
+        with app.app_context():
+            pool = db.engine.pool
+            config["post_fork"](server, None)
+            self.assertIsNot(db.engine.pool, pool)
+
+
+def redis_client():
+    """The Redis server at REDIS_URL, else fakeredis if it is installed, else
+    None. Either speaks the real protocol, unlike a hand-written stand-in."""
+    url = os.getenv("REDIS_URL")
+    if url:
+        import redis
+
+        return redis.Redis.from_url(url)
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    return fakeredis.FakeRedis()
+
+
+class TestResponseCacheBackends(unittest.TestCase):
+    def redis_backend(self):
+        client = redis_client()
+        if client is None:
+            self.skipTest("set REDIS_URL or install fakeredis")
+        # Its own key prefix, so a shared server keeps its other keys
+        prefix = f"test:{os.getpid()}:{self.id()}:"
+        self.addCleanup(
+            lambda: [client.delete(key) for key in client.scan_iter(f"{prefix}*")]
+        )
+        return RedisBackend(client, ttl=60, prefix=prefix)
+
+    def check_backend(self, backend):
+        backend.set("a", "A", ["groups", "groups:1"])
+        backend.set("b", "B", ["groups", "groups:2"])
+        backend.set("c", "C", ["students:1"])
+        self.assertIn(backend.get("a"), ("A", b"A"))
+
+        generation = backend.generation()
+        self.assertEqual(backend.invalidate({"groups:1"}), 1)
+        self.assertGreater(backend.generation(), generation)
+        self.assertIsNone(backend.get("a"))
+        self.assertIsNotNone(backend.get("b"))
+
+        backend.invalidate({"*"})
+        self.assertIsNone(backend.get("b"))
+        self.assertIsNone(backend.get("c"))
+        self.assertEqual(backend.size(), 0)
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryBackend(maxsize=10))
+
+    def test_redis_backend(self):
+        self.check_backend(self.redis_backend())
+
+    def test_redis_backend_expires_entries_and_tags(self):
+        backend = self.redis_backend()
+        backend.set("a", "A", ["groups"])
+        for key in (backend._entry("a"), backend._tag("groups")):
+            self.assertTrue(0 < backend.client.ttl(key) <= 60, key)
+        self.assertEqual(
+            backend.client.smembers(backend._tag("groups")),
+            {backend._entry("a").encode()},
+        )
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBackend(maxsize=2)
+        backend.set("a", "A", ["t"])
+        backend.set("b", "B", ["t"])
+        backend.get("a")
+        backend.set("c", "C", ["t"])
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), "A")
+        self.assertEqual(backend.invalidate({"t"}), 2)
+
+    def test_views_can_run_on_redis_backend(self):
+        with app.app_context():
+            db.create_all()
+            try:
+                db.session.add(Group(title="Test Group", group_cost=100))
+                db.session.commit()
+                headers = {"Authorization": f"Bearer {os.getenv('ADMIN_JWT_TOKEN')}"}
+                client = app.test_client()
+                with mock.patch.object(response_cache, "backend", self.redis_backend()):
+                    first = client.get("/api/groups/1", headers=headers)
+                    second = client.get("/api/groups/1", headers=headers)
+                self.assertEqual(second.headers["X-Cache"], "HIT")
+                self.assertEqual(first.data, second.data)
+                self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+            finally:
+                db.session.remove()
+                db.drop_all()
+
 
 class CustomTestResult(unittest.TextTestResult):
     def addSuccess(self, test):
@@ -371,7 +2439,7 @@ class CustomTestResult(unittest.TextTestResult):
 
 
 if __name__ == "__main__":
-    suite = unittest.TestLoader().loadTestsFromTestCase(TestApp)
+    suite = unittest.TestLoader().loadTestsFromModule(sys.modules[__name__])
     runner = unittest.TextTestRunner(verbosity=2, resultclass=CustomTestResult)
     result = runner.run(suite)
 
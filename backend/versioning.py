@@ -0,0 +1,189 @@
+# versioning.py
+import hashlib
+from datetime import datetime
+from flask import Response, request
+from sqlalchemy import case, event, func, insert, select, true, update
+from sqlalchemy.orm import Session
+from models import (
+    db,
+    Group,
+    Student,
+    Payment,
+    TableVersion,
+    change_stamp,
+    student_group_association,
+)
+
+VERSIONED_MODELS = (Group, Student, Payment)
+# Largest prime below 2**31
+STAMP_MODULUS = 2_147_483_647
+
+
+@event.listens_for(Session, "before_flush")
+def stamp_modified_instances(session, flush_context, instances):
+    # Covers ORM writes, including relationship changes such as
+    # group.students.remove(student). Bulk and Core writes call touch() or
+    # count_changes().
+    changed = set()
+    for instance in session.new:
+        if isinstance(instance, VERSIONED_MODELS):
+            instance.version = change_stamp()
+            changed.add(type(instance))
+    for instance in session.dirty:
+        if isinstance(instance, VERSIONED_MODELS) and session.is_modified(instance):
+            instance.version = change_stamp()
+            changed.add(type(instance))
+    for instance in session.deleted:
+        if isinstance(instance, VERSIONED_MODELS):
+            changed.add(type(instance))
+    _count_changes(session, changed)
+
+
+def _count_changes(session, models):
+    # Sorted, so concurrent writers lock the counter rows in the same order
+    table = TableVersion.__table__
+    stamp = change_stamp()
+    for name in sorted(model.__tablename__ for model in models):
+        result = session.execute(
+            update(table)
+            .where(table.c.table_name == name)
+            .values(
+                changes=table.c.changes + 1,
+                version=case((table.c.version > stamp, table.c.version), else_=stamp),
+            )
+        )
+        if result.rowcount == 0:
+            session.execute(
+                insert(table).values(table_name=name, changes=1, version=stamp)
+            )
+
+
+def count_changes(*models):
+    """Count a Core-level write (bulk inserts) to the tables of ``models``,
+    so their collection validators change. touch() does this itself."""
+    _count_changes(db.session, models)
+
+
+def touch(model, ids):
+    """Give rows of ``model`` a new change stamp after a Core-level write
+    (payments, memberships) that changes how they serialize."""
+    ids = set(ids)
+    if ids:
+        db.session.execute(
+            update(model).where(model.id.in_(ids)).values(version=change_stamp()),
+            execution_options={"synchronize_session": False},
+        )
+        # Core updates skip the flush events, so record them for listeners
+        # that act on committed changes (the response cache).
+        db.session.info.setdefault("touched", set()).update((model, id) for id in ids)
+        _count_changes(db.session, [model])
+
+
+def _checksum(model):
+    # Stamps come from each process's clock, so a write committed later can
+    # carry a smaller stamp than the newest one: max() would miss it. A sum
+    # changes with any row's stamp; the modulus keeps it within 64 bits.
+    return func.coalesce(func.sum(model.version % STAMP_MODULUS), 0)
+
+
+def table_stamp_query(model):
+    # Aggregates, so a table never written to still yields one row
+    return select(
+        func.coalesce(func.max(TableVersion.changes), 0),
+        func.coalesce(func.max(TableVersion.version), 0),
+    ).where(TableVersion.table_name == model.__tablename__)
+
+
+def table_stamp(model):
+    """``(change count, newest change stamp)`` of the table of ``model``: a
+    primary key lookup that changes on every insert, update or delete."""
+    return tuple(db.session.execute(table_stamp_query(model)).one())
+
+
+def row_stamp_query(model, id):
+    return select(
+        func.count(model.id), func.coalesce(func.max(model.version), 0)
+    ).where(model.id == id)
+
+
+def row_stamp(model, id):
+    """``(1, change stamp)`` of one row, or ``(0, 0)`` if it does not exist."""
+    return tuple(db.session.execute(row_stamp_query(model, id)).one())
+
+
+def _members_stamp(group_id):
+    # The group's members only, through the association's index
+    return (
+        select(
+            func.count(Student.id),
+            _checksum(Student),
+            func.coalesce(func.max(Student.version), 0),
+        )
+        .join(
+            student_group_association,
+            student_group_association.c.student_id == Student.id,
+        )
+        .where(student_group_association.c.group_id == group_id)
+    )
+
+
+def group_members_stamp(group_id):
+    return tuple(db.session.execute(_members_stamp(group_id)).one())
+
+
+def group_stamp_query(group_id):
+    members = _members_stamp(group_id).subquery()
+    return (
+        select(Group.version, members.c[0], members.c[1], members.c[2])
+        .join(members, true())
+        .where(Group.id == group_id)
+    )
+
+
+def group_stamps(row):
+    """Turn a group_stamp_query() row into stamps, or None for no row."""
+    if row is None:
+        return None
+    return (1, row[0]), tuple(row[1:])
+
+
+def group_stamp(group_id):
+    """Stamps of a group and its members in one query, or None if the group
+    does not exist."""
+    return group_stamps(db.session.execute(group_stamp_query(group_id)).one_or_none())
+
+
+class Validators:
+    """ETag and Last-Modified for the current GET, derived from stamps
+    whose last item is a change stamp.
+
+    The ETag covers the path, query string and Accept header, so different
+    fieldsets, pages or formats of the same resource get different tags.
+    Last-Modified is the newest change stamp in whole seconds. Only
+    If-None-Match is answered with a 304: seconds cannot tell apart writes
+    within the same second, nor notice a deleted row.
+    """
+
+    def __init__(self, *stamps):
+        args = sorted(request.args.items(multi=True))
+        accept = request.headers.get("Accept")
+        digest = hashlib.sha1(repr((request.path, args, accept, stamps)).encode())
+        self.etag = digest.hexdigest()
+        newest = max(stamp[-1] for stamp in stamps)
+        self.last_modified = (
+            datetime.utcfromtimestamp(newest // 1_000_000) if newest else None
+        )
+
+    def not_modified(self):
+        """Return a 304 response if the client's copy is current, else None."""
+        if not request.if_none_match.contains(self.etag):
+            return None
+        return self.apply(Response(status=304))
+
+    def apply(self, response):
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Accept")
+        return response
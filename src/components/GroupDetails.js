@@ -42,27 +42,22 @@ const GroupDetails = () => {
         setEditedStudents(groupResponse.data.students);
         setLoading(false);
 
-        const paymentStatusPromises = groupResponse.data.students.map(
-          (student) =>
-            axios.get(
-              `${config.API_URL}/api/students/${student.id}/payment_status`,
-              {
-                headers: {
-                  Authorization: `Bearer ${token}`,
-                },
-              }
-            )
+        const paymentStatusResponse = await axios.get(
+          `${config.API_URL}/api/groups/${id}/payment_status`,
+          {
+            headers: {
+              Authorization: `Bearer ${token}`,
+            },
+          }
         );
-
-        const paymentStatusResponses = await Promise.all(paymentStatusPromises);
         const newStudentPaymentStatus = {};
         const newStudentPendingAmount = {};
 
-        paymentStatusResponses.forEach((response, index) => {
-          newStudentPaymentStatus[groupResponse.data.students[index].id] =
-            response.data.status;
-          newStudentPendingAmount[groupResponse.data.students[index].id] =
-            response.data.pending_amount;
+        paymentStatusResponse.data.forEach((paymentStatus) => {
+          newStudentPaymentStatus[paymentStatus.student_id] =
+            paymentStatus.status;
+          newStudentPendingAmount[paymentStatus.student_id] =
+            paymentStatus.pending_amount;
         });
 
         setStudentPaymentStatus(newStudentPaymentStatus);
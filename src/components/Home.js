@@ -95,7 +95,7 @@ const Home = () => {
                 {group.title}
               </h3>
               <p className=" text-[#2F4858]">
-                Number of students: {group.students.length}
+                Number of students: {group.student_count}
               </p>
             </div>
             <div className="absolute top-1 right-2 text-[#F26419]">
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useCallback } from "react";
 import axios from "axios";
 import { useNavigate } from "react-router-dom";
 import { useAuth0 } from "@auth0/auth0-react";
@@ -10,36 +10,86 @@ import PhoneInput from "react-phone-input-2";
 import { usePermissions } from "./usePermissions";
 import config from "../config";
 
+const PAGE_SIZE = 50;
+
 const Students = () => {
   const [students, setStudents] = useState([]);
   const [name, setName] = useState("");
   const [parentPhoneNumber, setParentPhoneNumber] = useState("");
   const [loading, setLoading] = useState(true);
+  const [query, setQuery] = useState("");
+  const [results, setResults] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const navigate = useNavigate();
   const { getAccessTokenSilently } = useAuth0();
   const { hasPermission } = usePermissions();
 
-  useEffect(() => {
-    const fetchStudents = async () => {
+  // One page at a time; the full list can hold thousands of students
+  const fetchStudents = useCallback(
+    async (after = null) => {
       try {
         const token = await getAccessTokenSilently({
           audience: "https://studenttrackapi.com",
         });
         const response = await axios.get(`${config.API_URL}/api/students`, {
+          params: {
+            limit: PAGE_SIZE,
+            fields: "id,name",
+            ...(after !== null && { after }),
+          },
           headers: {
             Authorization: `Bearer ${token}`,
           },
         });
-        setStudents(response.data);
-        setLoading(false);
+        const { items, next_cursor } = response.data;
+        setStudents((previous) =>
+          after === null ? items : [...previous, ...items]
+        );
+        setNextCursor(next_cursor);
       } catch (error) {
         console.error("There was an error fetching the students!", error);
-        setLoading(false);
       }
-    };
+      setLoading(false);
+    },
+    [getAccessTokenSilently]
+  );
 
+  useEffect(() => {
     fetchStudents();
-  }, [getAccessTokenSilently]);
+  }, [fetchStudents]);
+
+  useEffect(() => {
+    if (!query.trim()) {
+      setResults(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const token = await getAccessTokenSilently({
+          audience: "https://studenttrackapi.com",
+        });
+        const response = await axios.get(
+          `${config.API_URL}/api/students/search`,
+          {
+            params: { q: query, fields: "id,name" },
+            headers: {
+              Authorization: `Bearer ${token}`,
+            },
+          }
+        );
+        if (!cancelled) {
+          setResults(response.data.items);
+        }
+      } catch (error) {
+        console.error("There was an error searching the students!", error);
+      }
+    }, 250);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [query, getAccessTokenSilently]);
 
   const handleAddStudent = async (e) => {
     e.preventDefault();
@@ -58,7 +108,10 @@ const Students = () => {
           },
         }
       );
-      setStudents([...students, response.data]);
+      // Newest id: it belongs at the end, once the last page is loaded
+      if (nextCursor === null) {
+        setStudents([...students, response.data]);
+      }
       setName("");
       setParentPhoneNumber("");
     } catch (error) {
@@ -98,8 +151,15 @@ const Students = () => {
       </h1>
       <div className="flex gap-6">
         <div className="w-1/2 h-[45vh] py-1 overflow-auto pr-2">
+          <input
+            type="search"
+            value={query}
+            onChange={(e) => setQuery(e.target.value)}
+            className="border-b-2 border-[#69A1CB] rounded w-full py-2 px-3 mb-4 text-gray-700 focus:outline-none focus:border-[#F26419] relative z-10"
+            placeholder="Search by name or tutor phone"
+          />
           <ul className="list-disc list-inside">
-            {students.map((student) => (
+            {(results ?? students).map((student) => (
               <li
                 key={student.id}
                 className="border-2 hover:-translate-y-1 transition hover:cursor-pointer relative z-10 border-[#69A1CB] p-3 pl-6 backdrop-blur-lg bg-white/50 rounded-lg mb-4 shadow-sm"
@@ -109,6 +169,14 @@ const Students = () => {
               </li>
             ))}
           </ul>
+          {results === null && nextCursor !== null && (
+            <button
+              onClick={() => fetchStudents(nextCursor)}
+              className="relative z-10 text-[#2F4858] font-bold py-2 px-4 rounded hover:scale-110 transition"
+            >
+              Load more
+            </button>
+          )}
         </div>
         <div className="w-1/2 ">
           {hasPermission("create:student") && (